@@ -0,0 +1,296 @@
+# accumulators.py
+#
+# Chunk accumulators for the streaming ingestion path. Each accumulator is fed
+# one DataFrame chunk at a time and keeps only running totals, so the summary
+# blocks of the response can be produced without holding the whole file.
+import numpy as np
+import pandas as pd
+
+from heavy_hitters import HeavyHitters
+
+
+# Scores are reduced once to a small integer code per row. Integral scores
+# 0-10 keep their value; the rare non-integral scores (e.g. 7.5) get one of
+# four extra codes so every segment test below stays exact.
+NON_INTEGRAL_DETRACTOR = 11   # below 6
+NON_INTEGRAL_PASSIVE = 12     # between 7 and 8
+NON_INTEGRAL_BORDER = 13      # between 6 and 7 or 8 and 9: passive overall, not per location
+NON_INTEGRAL_PROMOTER = 14    # above 9
+NUM_SCORE_CODES = 15
+
+PROMOTER_CODES = [9, 10, NON_INTEGRAL_PROMOTER]
+DETRACTOR_CODES = [0, 1, 2, 3, 4, 5, 6, NON_INTEGRAL_DETRACTOR]
+# Locations count passives as 7 <= score <= 8, not as "everything else"
+LOCATION_PASSIVE_CODES = [7, 8, NON_INTEGRAL_PASSIVE]
+
+SEGMENT_BY_CODE = np.array(["passive"] * NUM_SCORE_CODES, dtype=object)
+SEGMENT_BY_CODE[PROMOTER_CODES] = "promoter"
+SEGMENT_BY_CODE[DETRACTOR_CODES] = "detractor"
+
+
+def _code_mask(codes):
+    mask = np.zeros(NUM_SCORE_CODES, dtype=np.int64)
+    mask[codes] = 1
+    return mask
+
+
+_PROMOTER_MASK = _code_mask(PROMOTER_CODES)
+_DETRACTOR_MASK = _code_mask(DETRACTOR_CODES)
+_LOCATION_PASSIVE_MASK = _code_mask(LOCATION_PASSIVE_CODES)
+
+
+def score_codes(scores):
+    """
+    Convert cleaned 0-10 scores to int8 score codes.
+
+    Args:
+        scores: Numeric Series or array with every value in [0, 10]
+
+    Returns:
+        numpy int8 array of codes in [0, NUM_SCORE_CODES)
+    """
+    values = np.asarray(scores, dtype=float)
+    codes = np.empty(len(values), dtype=np.int8)
+
+    integral = values == np.floor(values)
+    codes[integral] = values[integral].astype(np.int8)
+
+    rest = values[~integral]
+    codes[~integral] = np.select(
+        [rest < 6, (rest > 7) & (rest < 8), rest > 9],
+        [NON_INTEGRAL_DETRACTOR, NON_INTEGRAL_PASSIVE, NON_INTEGRAL_PROMOTER],
+        default=NON_INTEGRAL_BORDER,
+    )
+    return codes
+
+
+def _round_pct(part, total):
+    # Same float operations and round-half-even as round(part / total * 100)
+    return np.rint(part / total * 100).astype(np.int64)
+
+
+class ScoreAccumulator:
+    """Running score-code counts overall and per location."""
+
+    def __init__(self):
+        self.code_counts = np.zeros(NUM_SCORE_CODES, dtype=np.int64)
+        # Locations in order of first appearance and their row in location_counts
+        self.location_names = []
+        self.location_ids = {}
+        # location x score-code crosstab; rows beyond len(location_names) are spare capacity
+        self.location_counts = np.zeros((0, NUM_SCORE_CODES), dtype=np.int64)
+
+    @classmethod
+    def from_counts(cls, code_counts, location_names=(), location_counts=None):
+        """
+        Build an accumulator from totals computed elsewhere (e.g. cube sums).
+
+        Args:
+            code_counts: Responses per score code, locations with missing values included
+            location_names: Location values in order of first appearance
+            location_counts: location x score-code counts aligned with location_names
+        """
+        scores = cls()
+        scores.code_counts = np.asarray(code_counts, dtype=np.int64)
+        scores.location_names = list(location_names)
+        scores.location_ids = {name: i for i, name in enumerate(scores.location_names)}
+        if location_counts is not None:
+            scores.location_counts = np.asarray(location_counts, dtype=np.int64).reshape(-1, NUM_SCORE_CODES)
+        return scores
+
+    def add_chunk(self, codes, locations=None):
+        """
+        Add one chunk of score codes.
+
+        Args:
+            codes: int8 array from score_codes()
+            locations: Optional Series of locations aligned with codes
+        """
+        self.code_counts += np.bincount(codes, minlength=NUM_SCORE_CODES)
+
+        if locations is not None:
+            local_ids, uniques = pd.factorize(locations, sort=False)
+            to_global = np.empty(len(uniques), dtype=np.int64)
+            for i, location in enumerate(uniques):
+                global_id = self.location_ids.get(location)
+                if global_id is None:
+                    global_id = len(self.location_names)
+                    self.location_ids[location] = global_id
+                    self.location_names.append(location)
+                to_global[i] = global_id
+            self._reserve(len(self.location_names))
+
+            # factorize marks missing locations with -1; they are not grouped
+            present = local_ids >= 0
+            cells = to_global[local_ids[present]] * NUM_SCORE_CODES + codes[present]
+            crosstab = np.bincount(cells, minlength=len(self.location_names) * NUM_SCORE_CODES)
+            self.location_counts[:len(self.location_names)] += crosstab.reshape(-1, NUM_SCORE_CODES)
+
+    def _reserve(self, rows):
+        if rows > len(self.location_counts):
+            grown = np.zeros((max(rows, 2 * len(self.location_counts)), NUM_SCORE_CODES), dtype=np.int64)
+            grown[:len(self.location_counts)] = self.location_counts
+            self.location_counts = grown
+
+    @property
+    def total(self):
+        return int(self.code_counts.sum())
+
+    @property
+    def promoters(self):
+        return int(self.code_counts @ _PROMOTER_MASK)
+
+    @property
+    def detractors(self):
+        return int(self.code_counts @ _DETRACTOR_MASK)
+
+    @property
+    def passives(self):
+        return self.total - self.promoters - self.detractors
+
+    def summary(self):
+        """NPS summary block with rounded segment percentages."""
+        total = self.total
+        promoters_pct = round(self.promoters / total * 100)
+        detractors_pct = round(self.detractors / total * 100)
+        passives_pct = round(self.passives / total * 100)
+        return {
+            "nps": promoters_pct - detractors_pct,
+            "responses": total,
+            "promoters": promoters_pct,
+            "passives": passives_pct,
+            "detractors": detractors_pct
+        }
+
+    def score_distribution(self):
+        return [{"score": score, "count": int(count)} for score, count in enumerate(self.code_counts[:11])]
+
+    def location_volumes(self, limit=10):
+        """Locations with the most responses, ordered like Series.value_counts()."""
+        if not self.location_names:
+            return []
+        counts = self.location_counts[:len(self.location_names)].sum(axis=1)
+        totals = pd.Series(counts, index=self.location_names)
+        totals = totals.sort_values(ascending=False).head(limit)
+        return [{"name": name, "responses": int(count)} for name, count in totals.items()]
+
+    def location_breakdown(self, min_responses=10):
+        """
+        Promoter/passive/detractor percentages per location.
+
+        Locations are visited in sorted order (as DataFrame.groupby would) and
+        those with fewer than min_responses responses are skipped.
+        """
+        n = len(self.location_names)
+        if n == 0:
+            return []
+        counts = self.location_counts[:n]
+        totals = counts.sum(axis=1)
+        keep = np.flatnonzero(totals >= min_responses)
+        if len(keep) == 0:
+            return []
+
+        counts = counts[keep]
+        totals = totals[keep]
+        promoters = counts @ _PROMOTER_MASK
+        passives = counts @ _LOCATION_PASSIVE_MASK
+        detractors = counts @ _DETRACTOR_MASK
+
+        nps = np.rint((promoters / totals * 100) - (detractors / totals * 100)).astype(np.int64)
+        promoters_pct = _round_pct(promoters, totals)
+        passives_pct = _round_pct(passives, totals)
+        detractors_pct = _round_pct(detractors, totals)
+
+        names = [self.location_names[i] for i in keep]
+        # Numeric ids sort as numbers; any text names after them
+        order = sorted(range(len(keep)), key=lambda i: (isinstance(names[i], str), names[i]))
+        return [{
+            "name": str(names[i]),
+            "nps": int(nps[i]),
+            "responses": int(totals[i]),
+            "promoters_pct": int(promoters_pct[i]),
+            "passives_pct": int(passives_pct[i]),
+            "detractors_pct": int(detractors_pct[i])
+        } for i in order]
+
+
+class KeywordAccumulator:
+    """
+    Keyword counts over all feedback and per promoter/detractor segment.
+
+    Each count is a HeavyHitters sketch, so memory stays within the keyword
+    budget however many distinct words the upload has; counts are exact
+    until a segment exceeds it.
+
+    Args:
+        capacity: Distinct keywords kept per sketch (defaults to
+            config.KEYWORD_SKETCH_SIZE)
+    """
+
+    def __init__(self, capacity=None):
+        self.all_words = HeavyHitters(capacity)
+        self.promoter_words = HeavyHitters(capacity)
+        self.detractor_words = HeavyHitters(capacity)
+        self.failed = False
+
+    def add_corpus(self, corpus):
+        """
+        Update the keyword counters from one chunk's FeedbackCorpus.
+
+        Tokens count towards the overall keywords when the text is longer
+        than 5 characters and towards the promoter or detractor keywords
+        based on the row's segment.
+
+        Args:
+            corpus: FeedbackCorpus built with tokenize=True and segments
+        """
+        if self.failed:
+            return
+        if corpus.tokenize_error:
+            print(f"Error in keyword analysis: {corpus.tokenize_error}")
+            self.failed = True
+            return
+
+        frame = corpus.frame
+        # Count each distinct (text, segment) pair once, weighted by its rows.
+        # Pairs go in order of first appearance, so new keywords are met (and
+        # ties ranked) in the same order as a row-by-row pass
+        inverse = corpus.unique()[1]
+        segment_codes = pd.factorize(frame["segment"])[0] + 1
+        pairs = pd.factorize(inverse.astype(np.int64) * 4 + segment_codes)[0]
+        weights = np.bincount(pairs)
+        rows = np.unique(pairs, return_index=True)[1]
+        columns = (frame[name].to_numpy()[rows] for name in ("text", "is_str", "tokens", "segment"))
+        for (text, is_str, words, segment), weight in zip(zip(*columns), weights.tolist()):
+            if not is_str:
+                continue
+            if len(text) > 5:
+                self.all_words.update(words, weight)
+            if segment == "promoter":
+                self.promoter_words.update(words, weight)
+            elif segment == "detractor":
+                self.detractor_words.update(words, weight)
+
+    def merge(self, other):
+        """Fold in the counts of another accumulator (e.g. from a different worker)."""
+        self.failed = self.failed or other.failed
+        self.all_words.merge(other.all_words)
+        self.promoter_words.merge(other.promoter_words)
+        self.detractor_words.merge(other.detractor_words)
+
+    def _keywords(self, words, n):
+        if self.failed:
+            return []
+        if words.exact:
+            return [{"keyword": k, "count": c} for k, c in words.most_common(n)]
+        # Over the budget: counts may be low by up to max_error
+        return [{"keyword": k, "count": c, "max_error": words.error} for k, c in words.most_common(n)]
+
+    def top_keywords(self, n=10):
+        return self._keywords(self.all_words, n)
+
+    def promoter_keywords(self, n=5):
+        return self._keywords(self.promoter_words, n)
+
+    def detractor_keywords(self, n=5):
+        return self._keywords(self.detractor_words, n)
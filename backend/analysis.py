@@ -0,0 +1,645 @@
+# analysis.py
+#
+# The NPS analysis pipeline as a plain function of a CSV file on disk. It holds
+# no request state, so the API can run it in a worker process while the event
+# loop keeps serving other requests.
+#
+# After parsing, the pipeline is a set of named stages that declare what they
+# need: other stages whose results they read, and which parts of the upload
+# ingestion has to prepare (the feedback corpus, keyword tokens, the rows). A
+# request picks a profile or an explicit stage list; only those stages and
+# their dependencies run, ingestion skips the text preprocessing and row
+# buffers nobody reads, and stages whose dependencies are done run
+# concurrently on a small thread pool.
+import hashlib
+import io
+import json
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+# Import the new feedback analysis module
+import accumulators
+import config
+import estimation
+import feedback_analysis
+import ingestion
+import metrics
+import response_cube
+import response_store
+import text_corpus
+import text_scoring
+import topic_model
+
+
+# Bump when the pipeline's output changes in a way the fingerprint in
+# analysis_version() cannot see (e.g. a new response field)
+PIPELINE_REVISION = 5
+
+def analysis_version():
+    """
+    Fingerprint of everything that determines the analysis output.
+
+    Covers the keyword tables, stopwords and model parameters, so cached
+    results are invalidated automatically when any of them change.
+    """
+    fingerprint = json.dumps({
+        "revision": PIPELINE_REVISION,
+        "categories": feedback_analysis.CATEGORY_KEYWORDS,
+        "aspects": feedback_analysis.ASPECT_KEYWORDS,
+        "emotions": feedback_analysis.EMOTION_KEYWORDS,
+        "stopwords": sorted(text_corpus.ADDITIONAL_STOPWORDS),
+        "vectorizer": topic_model.TOPIC_VECTORIZER_PARAMS,
+        "topic_model": topic_model.TOPIC_MODEL_PARAMS,
+    }, sort_keys=True)
+    return hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:16]
+
+
+class AnalysisError(Exception):
+    """An analysis failure that maps onto an HTTP error response."""
+
+    def __init__(self, status_code, detail):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class AnalysisCancelled(BaseException):
+    """
+    Raised by a progress listener to stop a cancelled analysis.
+
+    Derives from BaseException (like asyncio.CancelledError) so the stages'
+    broad `except Exception` fallbacks cannot swallow it.
+    """
+
+
+class Stage:
+    """
+    One named step of the analysis.
+
+    Args:
+        name: Stage name, as used in timings and in the stages option
+        run: Callable taking the run context (see run_analysis) and returning
+            a dict of response blocks, or None
+        requires: Stages whose results run reads; requesting this stage
+            runs them too
+        after: Stages that must finish first when they are part of the run,
+            without being pulled in by this one
+        inputs: What ingestion has to prepare besides the scores: "corpus"
+            (the FeedbackCorpus), "tokens" (keyword tokens and counts) and
+            "rows" (the projected rows and their score codes, ingest.df)
+    """
+
+    def __init__(self, name, run, requires=(), after=(), inputs=()):
+        self.name = name
+        self.run = run
+        self.requires = tuple(requires)
+        self.after = tuple(after)
+        self.inputs = tuple(inputs)
+
+
+def _summary_stage(ctx):
+    ingest = ctx["ingest"]
+    scores = ingest.scores
+    ctx["timings"].rows(scores.total)
+
+    # Calculate NPS
+    summary = scores.summary()
+    print(f"NPS Score: {summary['nps']}, Total Responses: {scores.total}")
+
+    # Score distribution
+    score_distribution = scores.score_distribution()
+    for item in score_distribution:
+        print(f"Score {item['score']}: {item['count']} responses")
+
+    # 1. Response Volume by Location
+    location_volumes = []
+    if ingest.location_col:
+        location_volumes = scores.location_volumes(10)
+        print(f"Location volumes: {location_volumes}")
+
+    # 2. Enhanced location breakdown with promoter/passive/detractor percentages
+    location_breakdown = []
+    if ingest.location_col:
+        location_breakdown = scores.location_breakdown(min_responses=10)
+
+    return {
+        "summary": summary,
+        "scoreDistribution": score_distribution,
+        "locationBreakdown": sorted(location_breakdown, key=lambda x: x["nps"], reverse=True),
+        "locationVolumes": sorted(location_volumes, key=lambda x: x["responses"], reverse=True),
+        # 3. Get top and bottom locations (if enough locations)
+        "topLocations": sorted(location_breakdown, key=lambda x: x["nps"], reverse=True)[:3],
+        "bottomLocations": sorted(location_breakdown, key=lambda x: x["nps"])[:3],
+        # 4. Analyze NPS by response volume (to see if high-volume locations differ)
+        "highVolumeLocations": sorted(location_breakdown, key=lambda x: x["responses"], reverse=True)[:5],
+    }
+
+
+def _trends_stage(ctx):
+    # Per-period and rolling NPS from the per-day buckets filled during parsing
+    ingest, timings = ctx["ingest"], ctx["timings"]
+    if ingest.trends is None:
+        timings.skip()
+        return {"trends": None}
+    timings.rows(ingest.trends.dated)
+    try:
+        blocks = {"trends": ingest.trends.series()}
+    except ValueError as e:
+        # Too many periods x locations for the default series
+        print(f"Error building trends: {str(e)}")
+        timings.fallback(str(e))
+        blocks = {"trends": None}
+    # Buckets kept for other windows through /trends/{id} (see main.py)
+    if ctx["options"].get("trends"):
+        blocks["trend_buckets"] = ingest.trends
+    return blocks
+
+
+def _keywords_stage(ctx):
+    # Keyword analysis from feedback (counted chunk by chunk during ingestion)
+    ingest, timings = ctx["ingest"], ctx["timings"]
+    blocks = {"keywordAnalysis": [], "promoterKeywords": [], "detractorKeywords": []}
+    if ingest.feedback_col:
+        blocks["keywordAnalysis"] = ingest.keywords.top_keywords(10)
+        blocks["promoterKeywords"] = ingest.keywords.promoter_keywords(5)
+        blocks["detractorKeywords"] = ingest.keywords.detractor_keywords(5)
+        print(f"Top keywords: {[(k['keyword'], k['count']) for k in blocks['keywordAnalysis']]}")
+        timings.rows(len(ingest.corpus))
+        if ingest.corpus.tokenize_error:
+            timings.fallback(ingest.corpus.tokenize_error)
+    else:
+        timings.skip()
+    return blocks
+
+
+def _samples_stage(ctx):
+    ingest, timings = ctx["ingest"], ctx["timings"]
+    df = ingest.df
+    score_col, location_col, feedback_col = ingest.score_col, ingest.location_col, ingest.feedback_col
+    feedback_samples = []
+    try:
+        if feedback_col:
+            # Get representative samples from different score ranges,
+            # selecting each segment's rows once from the score codes
+            codes = ingest.score_codes
+            sample_frames = []
+            for segment_codes, n in ((accumulators.DETRACTOR_CODES, 2),
+                                     (accumulators.LOCATION_PASSIVE_CODES, 1),
+                                     (accumulators.PROMOTER_CODES, 2)):
+                segment_rows = df[np.isin(codes, segment_codes)]
+                if len(segment_rows) > 0:
+                    sample_frames.append(segment_rows.sample(min(n, len(segment_rows))))
+
+            for sample_df in sample_frames:
+                for _, row in sample_df.iterrows():
+                    if pd.isna(row[feedback_col]) or not isinstance(row[feedback_col], str) or len(row[feedback_col]) < 10:
+                        continue
+
+                    feedback = row[feedback_col]
+                    score = row[score_col]
+                    location = str(row[location_col]) if location_col and pd.notna(row[location_col]) else "Unknown"
+
+                    feedback_samples.append({
+                        "text": feedback,
+                        "score": int(score),
+                        "location": location
+                    })
+            print(f"Number of feedback samples: {len(feedback_samples)}")
+        else:
+            timings.skip()
+    except Exception as e:
+        print(f"Error selecting feedback samples: {str(e)}")
+        timings.fallback(str(e))
+        feedback_samples = []
+    return {"feedbackSamples": feedback_samples}
+
+
+def _sentiment_engine(ctx):
+    # VADER engine picked by the request (see sentiment_service.ENGINES)
+    return ctx["options"].get("sentiment") or config.SENTIMENT_ENGINE
+
+
+def _vader_stage(ctx):
+    ingest, timings = ctx["ingest"], ctx["timings"]
+    sentiment_counts = {"positive": 0, "neutral": 0, "negative": 0}
+    try:
+        if ingest.feedback_col:
+            # Sentiment analysis for all feedback
+            # Sharded across processes for large inputs (see text_scoring.py)
+            compounds = text_scoring.vader_scores(ingest.corpus, _sentiment_engine(ctx))
+            sentiment_counts = text_scoring.vader_counts(compounds)
+            ctx["derived"]["vader_compound"] = compounds
+            ctx["counts"]["feedbackSentiment"] = dict(sentiment_counts)
+
+            # Convert to percentages
+            total_sentiment = sum(sentiment_counts.values())
+            timings.rows(total_sentiment)
+            if total_sentiment > 0:
+                for key in sentiment_counts:
+                    sentiment_counts[key] = round(sentiment_counts[key] / total_sentiment * 100)
+
+            print(f"Sentiment breakdown: {sentiment_counts}")
+        else:
+            timings.skip()
+    except Exception as e:
+        print(f"Error in sentiment analysis: {str(e)}")
+        timings.fallback(str(e))
+        # Fallback values
+        sentiment_counts = {"positive": 60, "neutral": 30, "negative": 10}
+    return {"feedbackSentiment": sentiment_counts}
+
+
+def _topics_stage(ctx):
+    # NEW FEATURE 1: Topic Modeling for Customer Feedback
+    ingest, timings = ctx["ingest"], ctx["timings"]
+    topics = []
+    try:
+        if ingest.feedback_col and len(ingest.corpus) >= 20:
+            # Batch refit, or the persisted online model (see topic_model.py)
+            topics = topic_model.extract_topics(ingest.corpus.frame["lower"], ctx["options"].get("topic_mode"))
+            timings.rows(len(ingest.corpus))
+        else:
+            timings.skip()
+    except Exception as e:
+        print(f"Error in topic modeling: {str(e)}")
+        timings.fallback(str(e))
+    return {"topics": topics}
+
+
+def _keyword_hits_stage(ctx):
+    # One keyword scan shared by the emotion and categorization stages,
+    # done before either starts so they never race to fill the cache
+    ingest = ctx["ingest"]
+    if ingest.feedback_col:
+        feedback_analysis.keyword_hits(ingest.corpus)
+        ctx["timings"].rows(len(ingest.corpus))
+    else:
+        ctx["timings"].skip()
+
+
+def _textblob_stage(ctx):
+    # NEW FEATURE 2: Advanced Sentiment Analysis
+    ingest, timings = ctx["ingest"], ctx["timings"]
+    corpus = ingest.corpus
+    advanced_sentiment = {
+        "emotions": {"joy": 0, "sadness": 0, "anger": 0, "surprise": 0, "fear": 0},
+        "intensity_distribution": {"strong_positive": 0, "moderate_positive": 0,
+                                  "neutral": 0, "moderate_negative": 0, "strong_negative": 0}
+    }
+
+    try:
+        if ingest.feedback_col:
+            # Simple emotion detection with keyword approach, plus TextBlob
+            # intensity, sharded across processes for large inputs
+            hits_by_row = feedback_analysis.keyword_hits(corpus)
+            polarities = text_scoring.textblob_scores(corpus)
+            ctx["derived"]["textblob_polarity"] = polarities
+            intensity_counts, emotion_counts = text_scoring.textblob_counts(
+                polarities, [hits["emotions"] for hits in hits_by_row],
+                feedback_analysis.EMOTION_KEYWORDS)
+            ctx["counts"]["emotions"] = emotion_counts
+            ctx["counts"]["intensity"] = intensity_counts
+            if ctx["options"].get("estimate"):
+                # Rows behind each emotion counted, for the design effect of the estimate intervals
+                names = list(feedback_analysis.EMOTION_KEYWORDS)
+                hit_rows, hit_labels = [], []
+                for row, (polarity, hits) in enumerate(zip(polarities, hits_by_row)):
+                    if polarity is not None:
+                        for emotion in hits["emotions"]:
+                            hit_rows.append(row)
+                            hit_labels.append(names.index(emotion))
+                ctx["counts"]["emotionHits"] = {"rows": np.array(hit_rows, dtype=np.int64),
+                                                "labels": np.array(hit_labels, dtype=np.int64)}
+
+            # Calculate percentages for emotions
+            total_emotions = sum(emotion_counts.values())
+            if total_emotions > 0:
+                for emotion, count in emotion_counts.items():
+                    advanced_sentiment["emotions"][emotion] = round((count / total_emotions) * 100)
+
+            # Calculate percentages for intensity
+            total_intensity = sum(intensity_counts.values())
+            timings.rows(total_intensity)
+            if total_intensity > 0:
+                for intensity, count in intensity_counts.items():
+                    advanced_sentiment["intensity_distribution"][intensity] = round((count / total_intensity) * 100)
+        else:
+            timings.skip()
+
+    except Exception as e:
+        print(f"Error in advanced sentiment analysis: {str(e)}")
+        timings.fallback(str(e))
+    return {"advancedSentiment": advanced_sentiment}
+
+
+def _categorize_stage(ctx):
+    # NEW ANALYSIS - Use the feedback analysis module
+    ingest = ctx["ingest"]
+    if not ingest.feedback_col:
+        ctx["timings"].skip()
+        return {"categoryDistribution": [], "categorizedFeedback": []}
+
+    # Text Categorization
+    corpus = ingest.corpus
+    ctx["timings"].rows(len(corpus))
+    # Category codes per row; response dicts are only built for rows served
+    categorized = feedback_analysis.categorize_columns(corpus)
+    ctx["derived"]["primary_category"] = categorized.primary_names()
+    ctx["derived"]["aspects"] = [list(hits["aspects"]) for hits in feedback_analysis.keyword_hits(corpus)]
+
+    blocks = {
+        # Get category distribution (sorted list for the response)
+        "categoryDistribution": categorized.distribution(),
+        "categorizedFeedback": categorized.rows(0, 20),  # Limit to top 20 for response size
+    }
+    # Categorized rows for paging through /feedback/{id} (see main.py)
+    if ctx["options"].get("feedback"):
+        blocks["feedback"] = categorized
+    return blocks
+
+
+def _aspects_stage(ctx):
+    ingest = ctx["ingest"]
+    if not ingest.feedback_col:
+        # Default empty values if no feedback column
+        ctx["timings"].skip()
+        return {"aspectSentiment": {
+            "aspect_sentiments": {},
+            "aspect_mentions": {},
+            "samples": {},
+            "sorted_aspects": []
+        }}
+
+    # Aspect-Based Sentiment Analysis
+    ctx["timings"].rows(len(ingest.corpus))
+    return {"aspectSentiment": feedback_analysis.analyze_aspect_sentiment(ingest.corpus, ctx["mentions"],
+                                                                          _sentiment_engine(ctx))}
+
+
+def _cube_stage(ctx):
+    # Pre-aggregated cube for filtered views (see response_cube.py)
+    ctx["timings"].rows(ctx["ingest"].scores.total)
+    try:
+        return {"cube": response_cube.build_cube(ctx["ingest"], ctx["derived"], ctx["mentions"])}
+    except Exception as e:
+        print(f"Error building response cube: {str(e)}")
+        ctx["timings"].fallback(str(e))
+
+
+def _store_stage(ctx):
+    # Persist the cleaned rows and their derived fields (see response_store.py)
+    upload_id = ctx["options"]["store_upload_id"]
+    ctx["timings"].rows(len(ctx["ingest"].df))
+    try:
+        return {"store": response_store.append_upload(ctx["ingest"], ctx["derived"], upload_id)}
+    except Exception as e:
+        print(f"Error storing responses: {str(e)}")
+        ctx["timings"].fallback(str(e))
+        return {"store": {"upload_id": upload_id, "error": str(e)}}
+
+
+# Every stage, in the order a sequential run executes them
+STAGES = [
+    Stage("summary", _summary_stage),
+    Stage("trends", _trends_stage),
+    Stage("keywords", _keywords_stage, inputs=("corpus", "tokens")),
+    Stage("samples", _samples_stage, inputs=("rows",)),
+    Stage("vader", _vader_stage, inputs=("corpus",)),
+    Stage("topics", _topics_stage, inputs=("corpus",)),
+    Stage("keyword_hits", _keyword_hits_stage, inputs=("corpus",)),
+    Stage("textblob", _textblob_stage, requires=("keyword_hits",), inputs=("corpus",)),
+    Stage("categorize", _categorize_stage, requires=("keyword_hits",), inputs=("corpus",)),
+    Stage("aspects", _aspects_stage, inputs=("corpus",)),
+    # Built from whatever per-row fields the run produced
+    Stage("cube", _cube_stage, after=("vader", "categorize", "aspects"), inputs=("rows",)),
+    # Every per-row field it stores, whatever the requested profile: rows are
+    # stored once, so fields left null now would stay null
+    Stage("store", _store_stage, requires=("vader", "textblob", "categorize"), inputs=("corpus", "rows")),
+]
+STAGES_BY_NAME = {stage.name: stage for stage in STAGES}
+
+# Named stage sets for the profile request option. "summary" answers in
+# parse time; "standard" leaves out the two slowest text models (topics and
+# TextBlob); "full" is the complete analysis and the default.
+PROFILES = {
+    "summary": ["summary", "trends"],
+    "standard": ["summary", "trends", "keywords", "samples", "vader", "categorize", "aspects"],
+    "full": ["summary", "trends", "keywords", "samples", "vader", "topics", "textblob", "categorize", "aspects"],
+}
+
+# Response blocks in the order the payload has always listed them
+RESPONSE_KEYS = [
+    "summary", "scoreDistribution", "locationBreakdown", "locationVolumes", "topLocations",
+    "bottomLocations", "highVolumeLocations", "keywordAnalysis", "promoterKeywords",
+    "detractorKeywords", "feedbackSentiment", "feedbackSamples",
+    # Original new components
+    "topics", "advancedSentiment",
+    # Additional analysis from feedback_analysis.py
+    "categoryDistribution", "categorizedFeedback", "aspectSentiment",
+    # Per-period and rolling NPS (None without a response-date column)
+    "trends",
+]
+
+
+def resolve_stages(profile=None, stages=None):
+    """
+    Stage names to run for a profile and/or an explicit stage list.
+
+    Args:
+        profile: Name in PROFILES (defaults to "full" when no stages are given)
+        stages: Iterable of stage names from PROFILES["full"], added to the profile
+
+    Returns:
+        Requested stage names in execution order; "summary" is always included
+        and dependencies are added when the run is planned
+
+    Raises:
+        ValueError: For an unknown profile or stage name
+    """
+    stages = list(stages or [])
+    if profile is None and not stages:
+        profile = "full"
+    if profile is not None and profile not in PROFILES:
+        raise ValueError(f"profile must be one of: {', '.join(PROFILES)}")
+    unknown = [name for name in stages if name not in PROFILES["full"]]
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(unknown)} (choose from {', '.join(PROFILES['full'])})")
+    wanted = set(PROFILES[profile] if profile else []) | set(stages) | {"summary"}
+    return [name for name in PROFILES["full"] if name in wanted]
+
+
+def _plan(names):
+    """Stages to run for the given names plus their dependencies, in STAGES order."""
+    wanted = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in wanted:
+            wanted.add(name)
+            pending.extend(STAGES_BY_NAME[name].requires)
+    return [stage for stage in STAGES if stage.name in wanted]
+
+
+def _run_stages(plan, ctx):
+    """
+    Run the planned stages, each as soon as the stages it waits for are done.
+
+    Returns:
+        Dict merging the response blocks of every stage
+    """
+    timings = ctx["timings"]
+    planned = {stage.name for stage in plan}
+    waits_for = {stage.name: {name for name in stage.requires + stage.after if name in planned}
+                 for stage in plan}
+
+    def run(stage):
+        timings.stage(stage.name)
+        try:
+            return stage.run(ctx) or {}
+        finally:
+            timings.end()
+
+    blocks = {}
+    if config.STAGE_THREADS <= 1 or len(plan) <= 1:
+        for stage in plan:
+            blocks.update(run(stage))
+        return blocks
+
+    pending = list(plan)
+    done = set()
+    running = {}
+    executor = ThreadPoolExecutor(max_workers=config.STAGE_THREADS, thread_name_prefix="analysis-stage")
+    try:
+        while pending or running:
+            # STAGES order means every dependency is planned before its dependants
+            for stage in [stage for stage in pending if waits_for[stage.name] <= done]:
+                pending.remove(stage)
+                running[executor.submit(run, stage)] = stage
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                blocks.update(future.result())
+                done.add(running.pop(future).name)
+    finally:
+        # On failure, stages not yet started are dropped
+        executor.shutdown(wait=False, cancel_futures=True)
+    return blocks
+
+
+def run_analysis(path, filename, options=None, progress=None):
+    """
+    Run the NPS analysis on an uploaded CSV.
+
+    Args:
+        path: Path of the CSV file on disk
+        filename: Original upload name, used for logging
+        options: Optional dict of per-request settings ("topic_mode",
+            "stages" from resolve_stages() (defaults to the full profile),
+            "columns" overriding the detected CSV columns (see
+            ingestion.find_columns),
+            "estimate" to run the text stages on a stratified sample (see
+            estimation.py), "sentiment" for the VADER engine (one of
+            sentiment_service.ENGINES, defaults to config.SENTIMENT_ENGINE),
+            "cube" to build a ResponseCube of the requested text stages'
+            results, returned under "cube" (only when a stage it aggregates
+            runs), "feedback" to return the CategorizedFeedback of the
+            categorize stage under "feedback", "trends" to return the
+            TrendBuckets under "trend_buckets", and "store_upload_id" to
+            append the rows to the response store)
+        progress: Optional picklable callable receiving stage events as they
+            happen (see metrics.StageTimings); it may raise AnalysisCancelled
+
+    Returns:
+        Dictionary with the response blocks of the stages that ran, plus the
+        per-stage breakdown from metrics.StageTimings under "timings"
+
+    Raises:
+        AnalysisError: With the HTTP status and detail to return to the client
+    """
+    options = options or {}
+    names = list(options.get("stages") or PROFILES["full"])
+    # Kept state is built only when the caller keeps it, and the cube only on
+    # top of the text stages it aggregates: a scores-only run keeps no rows
+    if options.get("cube") and set(names) & set(STAGES_BY_NAME["cube"].after):
+        names.append("cube")
+    if options.get("store_upload_id"):
+        names.append("store")
+    plan = _plan(names)
+    inputs = {name for stage in plan for name in stage.inputs}
+    # Estimates preprocess only the sampled feedback, after parsing
+    estimate = bool(options.get("estimate")) and "corpus" in inputs
+
+    timings = metrics.StageTimings(listener=progress)
+    try:
+        timings.stage("parse")
+        with open(path, 'rb') as upload:
+            # Stream the file through the chunked parser instead of reading,
+            # decoding and re-wrapping the whole file in memory
+            upload.seek(0, io.SEEK_END)
+            print(f"Received file: {filename}, size: {upload.tell()} bytes")
+
+            # Parse CSV, preprocessing feedback only for stages that read it
+            try:
+                ingest = ingestion.read_nps_csv(upload, on_chunk=timings.rows,
+                                                corpus="corpus" in inputs and not estimate,
+                                                tokenize="tokens" in inputs and not estimate,
+                                                columns=options.get("columns"),
+                                                rows="rows" in inputs or estimate)
+                print(f"Successfully parsed CSV with {ingest.rows_read} rows and columns: {ingest.columns}")
+            except Exception as e:
+                print(f"Error parsing CSV: {str(e)}")
+                raise AnalysisError(status_code=400, detail=f"Error parsing CSV: {str(e)}")
+        timings.end()
+
+        print(f"Found columns - Score: {ingest.score_col}, Location: {ingest.location_col}, Feedback: {ingest.feedback_col}, "
+              f"Date: {ingest.date_col}, Id: {ingest.id_col}")
+
+        if not ingest.score_col:
+            raise AnalysisError(status_code=400, detail="Could not find NPS score column in the CSV")
+
+        if ingest.scores.total == 0:
+            raise AnalysisError(status_code=400, detail="No valid scores found in the data (must be between 0-10)")
+
+        sample = None
+        if estimate and ingest.feedback_col:
+            timings.stage("sample")
+            sample = estimation.sample_feedback(ingest, tokenize="tokens" in inputs)
+            timings.rows(sample["sampledRows"])
+            timings.end()
+
+        ctx = {
+            "ingest": ingest,
+            "options": options,
+            "timings": timings,
+            # Per-row fields kept for the response store and cube, filled in as stages succeed
+            "derived": {},
+            "mentions": {},
+            # Raw sample counts behind the percentage blocks, for estimate intervals
+            "counts": {},
+        }
+        blocks = _run_stages(plan, ctx)
+
+        # Return analysis results with enhanced insights
+        result = {key: blocks[key] for key in RESPONSE_KEYS if key in blocks}
+        if sample is not None:
+            result["estimate"] = {**sample, "intervals": estimation.intervals(result, ctx["counts"], sample,
+                                                                              ctx["mentions"])}
+            # Text counts are reported for the whole file, like the score counts
+            result["estimate"]["countScale"] = round(estimation.scale_counts(result, sample), 4)
+        for key in ("feedback", "cube", "trend_buckets", "store"):
+            if blocks.get(key) is not None:
+                result[key] = blocks[key]
+
+        result["timings"] = timings.finish()
+        return result
+
+    except AnalysisError:
+        raise
+    except Exception as e:
+        print(f"ERROR processing file: {str(e)}")
+        print(traceback.format_exc())
+        raise AnalysisError(status_code=500, detail=f"Error processing file: {str(e)}")
+    finally:
+        # Detach from the thread even when the analysis failed
+        timings.detach()
@@ -0,0 +1,9 @@
+# benchmarks
+#
+# Performance harness for the analysis backend. Run from the backend directory:
+#
+#   python -m benchmarks.generate_nps_csv --rows 100000 -o /tmp/nps_100k.csv
+#   python -m benchmarks.bench --sizes 10k 100k --output results.json
+#   python -m benchmarks.loadtest --mix 10k:0.8,100k:0.2 --concurrency 8 --requests 50 \
+#       --config one:NPS_ANALYSIS_WORKERS=1 --config four:NPS_ANALYSIS_WORKERS=4
+#   python -m benchmarks.vader_parity --input export.csv
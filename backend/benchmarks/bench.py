@@ -0,0 +1,285 @@
+# bench.py
+#
+# Stage-by-stage benchmark of the analysis pipeline. Each dataset is generated
+# deterministically (see generate_nps_csv.py) and benchmarked in a fresh
+# process, so peak RSS is per dataset and warm caches never leak between
+# cases. Stages run in the same order and on the same inputs as
+# analysis.run_analysis(); the memo caches are cleared before every repeat
+# (text scoring shard processes, used for large inputs, keep their own).
+#
+# Results are written as JSON; pass --compare with an earlier results file to
+# see per-stage ratios and fail on regressions beyond --threshold.
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - peak RSS is not reported on Windows
+    resource = None
+
+from benchmarks import generate_nps_csv
+
+STAGES = ["parse", "summary", "keywords", "vader", "textblob", "lda",
+          "categorize", "aspects", "end_to_end"]
+
+# Stages faster than this are reported by --compare but never flagged (timer noise)
+NOISE_FLOOR_SECONDS = 0.05
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def peak_rss_mb():
+    """High-water resident set size of this process in MB, or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform == "darwin":
+        return round(peak / (1024 * 1024), 1)
+    return round(peak / 1024, 1)
+
+
+def _stage_functions(path):
+    """
+    Build the stage callables for one CSV. Each takes and returns a state dict.
+    """
+    import pandas as pd
+
+    import accumulators
+    import analysis
+    import feedback_analysis
+    import ingestion
+    import sentiment_service
+    import text_scoring
+    import topic_model
+    from text_corpus import FeedbackCorpus
+
+    def parse(state):
+        with open(path, 'rb') as f:
+            state["ingest"] = ingestion.read_nps_csv(f)
+        state["rows"] = int(state["ingest"].scores.total)
+        corpus = state["ingest"].corpus
+        state["feedback_rows"] = len(corpus) if corpus is not None else 0
+
+    def summary(state):
+        scores = state["ingest"].scores
+        scores.summary()
+        scores.score_distribution()
+        scores.location_volumes(10)
+        scores.location_breakdown(min_responses=10)
+
+    def keywords(state):
+        # Ingestion tokenizes while streaming; redo it here to isolate the cost
+        ingest = state["ingest"]
+        segments = pd.Series(accumulators.SEGMENT_BY_CODE[ingest.score_codes], index=ingest.df.index)
+        corpus = FeedbackCorpus.from_series(ingest.df[ingest.feedback_col], segments)
+        counts = accumulators.KeywordAccumulator()
+        counts.add_corpus(corpus)
+        counts.top_keywords(10)
+        counts.promoter_keywords(5)
+        counts.detractor_keywords(5)
+
+    def vader(state):
+        text_scoring.vader_counts(text_scoring.vader_scores(state["ingest"].corpus))
+
+    def textblob(state):
+        corpus = state["ingest"].corpus
+        hits = feedback_analysis.keyword_hits(corpus)
+        text_scoring.textblob_counts(text_scoring.textblob_scores(corpus), [row["emotions"] for row in hits],
+                                     feedback_analysis.EMOTION_KEYWORDS)
+
+    def lda(state):
+        corpus = state["ingest"].corpus
+        if len(corpus) >= 20:
+            topic_model.batch_topics(corpus.frame["lower"])
+
+    def categorize(state):
+        corpus = state["ingest"].corpus
+        # Drop the keyword scan cached by an earlier repeat
+        corpus.keyword_hits = None
+        feedback_analysis.categorize_columns(corpus).distribution()
+
+    def aspects(state):
+        feedback_analysis.analyze_aspect_sentiment(state["ingest"].corpus)
+
+    def end_to_end(state):
+        sentiment_service.clear_caches()
+        analysis.run_analysis(path, os.path.basename(path), {"topic_mode": "batch"})
+
+    stages = dict(parse=parse, summary=summary, keywords=keywords, vader=vader,
+                  textblob=textblob, lda=lda, categorize=categorize, aspects=aspects,
+                  end_to_end=end_to_end)
+    return stages
+
+
+def run_case(case):
+    """
+    Benchmark one dataset; runs in its own process.
+
+    Args:
+        case: Dict with the generator options, "repeat", "stages" and "workdir"
+
+    Returns:
+        Dict with per-stage timings and peak RSS
+    """
+    os.chdir(BACKEND_DIR)
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+    import nlp_resources
+    import sentiment_service
+
+    path = case.get("input")
+    if not path:
+        path = os.path.join(case["workdir"], f"nps_{case['rows']}.csv")
+        started = time.perf_counter()
+        generate_nps_csv.write_csv(path, case["rows"], **case["generator"])
+        print(f"Generated {case['rows']} rows in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    started = time.perf_counter()
+    nlp_resources.warm_up()
+    warm_up_seconds = time.perf_counter() - started
+    baseline_rss = peak_rss_mb()
+
+    stages = _stage_functions(path)
+    timings = {name: [] for name in case["stages"]}
+    rss = {}
+    state = {}
+    for _ in range(case["repeat"]):
+        sentiment_service.clear_caches()
+        for name in case["stages"]:
+            started = time.perf_counter()
+            stages[name](state)
+            timings[name].append(time.perf_counter() - started)
+            rss[name] = peak_rss_mb()
+        print(f"  {case['name']}: " + ", ".join(f"{n}={timings[n][-1]:.2f}s" for n in case["stages"]),
+              file=sys.stderr)
+
+    return {
+        "name": case["name"],
+        "rows": state.get("rows"),
+        "feedback_rows": state.get("feedback_rows"),
+        "file_bytes": os.path.getsize(path),
+        "generator": case["generator"],
+        "warm_up_seconds": round(warm_up_seconds, 3),
+        "baseline_rss_mb": baseline_rss,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": {
+            name: {
+                "median_seconds": round(statistics.median(runs), 4),
+                "min_seconds": round(min(runs), 4),
+                "runs": [round(run, 4) for run in runs],
+                # High-water mark once this stage had run
+                "peak_rss_mb": rss.get(name),
+            }
+            for name, runs in timings.items()
+        },
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    Print per-stage ratios against a baseline results file.
+
+    Returns:
+        List of (case, stage, ratio) tuples slower than 1 + threshold
+    """
+    regressions = []
+    old_cases = {case["name"]: case for case in baseline.get("cases", [])}
+    for case in results["cases"]:
+        old = old_cases.get(case["name"])
+        if old is None:
+            continue
+        print(f"\n{case['name']} vs {baseline.get('revision') or 'baseline'}")
+        for stage, new in case["stages"].items():
+            before = old["stages"].get(stage)
+            if not before or not before["median_seconds"]:
+                continue
+            ratio = new["median_seconds"] / before["median_seconds"]
+            slow = ratio > 1 + threshold and new["median_seconds"] >= NOISE_FLOOR_SECONDS
+            flag = "  REGRESSION" if slow else ""
+            print(f"  {stage:<12} {before['median_seconds']:>9.3f}s -> {new['median_seconds']:>9.3f}s  x{ratio:.2f}{flag}")
+            if flag:
+                regressions.append((case["name"], stage, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the NPS analysis pipeline")
+    parser.add_argument("--sizes", nargs="+", default=["10k"], help="row counts, e.g. 10k 100k 1m")
+    parser.add_argument("--input", nargs="+", help="benchmark existing CSV files instead of generated ones")
+    parser.add_argument("--locations", type=int, default=50)
+    parser.add_argument("--sentences", type=float, default=2.0, help="mean sentences per answer")
+    parser.add_argument("--duplicate-rate", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES,
+                        help="stages to time (parse always runs first)")
+    parser.add_argument("--output", help="write JSON results here (default: stdout)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="slowdown ratio above which --compare fails (default 0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    stages = ["parse"] + [stage for stage in STAGES if stage in args.stages and stage != "parse"]
+    generator = {"locations": args.locations, "sentences": args.sentences,
+                 "duplicate_rate": args.duplicate_rate, "seed": args.seed}
+
+    results = {
+        "revision": _git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeat": args.repeat,
+        "cases": [],
+    }
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.input:
+            cases = [{"name": os.path.basename(path), "input": os.path.abspath(path), "rows": None}
+                     for path in args.input]
+        else:
+            cases = [{"name": size, "rows": generate_nps_csv.parse_count(size)} for size in args.sizes]
+        for case in cases:
+            case.update(generator=generator, repeat=args.repeat, stages=stages, workdir=workdir)
+            print(f"Benchmarking {case['name']}", file=sys.stderr)
+            # A fresh process per case keeps peak RSS and caches independent
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                results["cases"].append(pool.submit(run_case, case).result())
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# generate_nps_csv.py
+#
+# Deterministic generator for realistic NPS survey exports. The headers are
+# the kind ingestion.find_columns() detects ("How likely ... recommend",
+# "Area Manager", "What could we improve? Any suggestions"), scores follow a
+# typical promoter-heavy distribution, location volumes are skewed, and the
+# feedback text is assembled from score-dependent phrases that exercise the
+# keyword, category, aspect and emotion tables.
+#
+# The same arguments and seed always produce byte-identical files.
+import argparse
+import csv
+import datetime
+import random
+import sys
+
+SCORE_HEADER = "How likely are you to recommend us to a friend? (0-10)"
+LOCATION_HEADER = "Area Manager"
+FEEDBACK_HEADER = "What could we improve? Any suggestions?"
+DATE_HEADER = "Response Date"
+
+# Probability of each score 0-10: about 20% detractors, 25% passives, 55% promoters
+SCORE_WEIGHTS = [2, 1, 1, 2, 2, 3, 9, 11, 14, 20, 35]
+
+POSITIVE_PHRASES = [
+    "Great service, {staff} was very helpful",
+    "Quick shipping and the package arrived early",
+    "Love the {item}, excellent quality and fit",
+    "The team was friendly and knowledgeable",
+    "Checkout on the website was easy",
+    "Wow, what an amazing surprise in the box",
+    "Good value for the price",
+    "Customer support solved my issue with the {item} quickly",
+    "The new app is fast and simple to use",
+    "Happy with the delivery and the communication",
+]
+NEUTRAL_PHRASES = [
+    "Delivery took {days} days, longer than expected",
+    "The {item} was okay but nothing special",
+    "Prices are a bit high compared to other stores",
+    "The website could be easier to navigate",
+    "Sizes run a little small",
+    "Communication from the manager could improve",
+    "{staff} was polite but the queue was long",
+    "The app works but the login is slow",
+]
+NEGATIVE_PHRASES = [
+    "Delivery was {days} days late and the {item} arrived damaged",
+    "The {item} broke after {days} days, poor quality",
+    "Rude representative on the phone, unacceptable",
+    "Refund policy is terrible and I am worried about returns",
+    "Too expensive for what you get",
+    "The website checkout kept failing, very frustrating",
+    "Nobody answered my emails for {days} days, terrible support",
+    "I'm sad and disappointed with the service",
+    "The app crashes every time I try to pay",
+    "Wrong {item} shipped and the return process was a nightmare",
+]
+ITEMS = ["jacket", "sofa", "laptop", "parcel", "order", "kettle", "phone case", "desk",
+         "headphones", "mattress", "printer", "backpack", "lamp", "blender", "monitor",
+         "running shoes", "coffee machine", "rug", "tent", "vacuum"]
+STAFF = ["Alex", "Sam", "Priya", "Jordan", "Mei", "Carlos", "Fatima", "Liam", "Noah",
+         "Aisha", "Tom", "Grace", "Ivan", "Zoe", "Omar", "the store manager", "the driver"]
+SHORT_ANSWERS = ["Nothing", "N/A", "no", "ok thanks", "good", "-", "All good"]
+ENDINGS = [".", ".", ".", "!", "!!", "?"]
+
+
+def parse_count(value):
+    """Parse row counts such as 10000, 100k or 1m."""
+    value = str(value).strip().lower()
+    scale = {"k": 1000, "m": 1000000}.get(value[-1:], 1)
+    if scale > 1:
+        value = value[:-1]
+    return int(float(value) * scale)
+
+
+def _phrases_for(score):
+    if score <= 6:
+        return NEGATIVE_PHRASES, NEUTRAL_PHRASES
+    if score <= 8:
+        return NEUTRAL_PHRASES, POSITIVE_PHRASES + NEGATIVE_PHRASES
+    return POSITIVE_PHRASES, NEUTRAL_PHRASES
+
+
+def _comment(rng, score, sentences):
+    main, other = _phrases_for(score)
+    count = max(1, int(rng.expovariate(1 / sentences) + 0.5))
+    parts = []
+    for _ in range(count):
+        phrase = rng.choice(main if rng.random() < 0.8 else other)
+        phrase = phrase.format(item=rng.choice(ITEMS), staff=rng.choice(STAFF), days=rng.randint(2, 21))
+        parts.append(phrase + rng.choice(ENDINGS))
+    return " ".join(parts)
+
+
+def generate_rows(rows, locations=50, sentences=2.0, duplicate_rate=0.2,
+                  blank_rate=0.1, days=365, seed=42):
+    """
+    Yield generated survey rows (header first).
+
+    Args:
+        rows: Number of data rows
+        locations: Number of distinct area managers (volumes are Zipf-like)
+        sentences: Mean number of sentences per free-text answer
+        duplicate_rate: Share of answers copied verbatim from an earlier answer,
+            on top of short answers and one-liners that recur naturally
+        blank_rate: Share of rows with no free-text answer
+        days: Length of the response date window, ending 2024-12-31
+        seed: Random seed
+
+    Returns:
+        Generator of CSV rows (lists of strings)
+    """
+    rng = random.Random(seed)
+    managers = [f"Manager {i:05d}" for i in range(max(locations, 1))]
+    location_weights = [1 / (rank + 1) for rank in range(len(managers))]
+    end = datetime.date(2024, 12, 31)
+    dates = [(end - datetime.timedelta(days=d)).isoformat() for d in range(max(days, 1))]
+    # Previously written answers that duplicates are drawn from, per segment
+    seen = {"low": [], "mid": [], "high": []}
+
+    yield ["Response ID", SCORE_HEADER, LOCATION_HEADER, FEEDBACK_HEADER, DATE_HEADER]
+    for row_id in range(rows):
+        score = rng.choices(range(11), weights=SCORE_WEIGHTS)[0]
+        location = rng.choices(managers, weights=location_weights)[0]
+
+        r = rng.random()
+        if r < blank_rate:
+            feedback = ""
+        elif r < blank_rate + 0.05:
+            feedback = rng.choice(SHORT_ANSWERS)
+        else:
+            pool = seen["low" if score <= 6 else "mid" if score <= 8 else "high"]
+            if pool and rng.random() < duplicate_rate:
+                feedback = rng.choice(pool)
+            else:
+                feedback = _comment(rng, score, sentences)
+                if len(pool) < 10000:
+                    pool.append(feedback)
+
+        yield [str(row_id + 1), str(score), location, feedback, rng.choice(dates)]
+
+
+def write_csv(path, rows, **options):
+    """
+    Write a generated NPS export to path ("-" for stdout).
+
+    Args:
+        path: Output file path
+        rows: Number of data rows
+        **options: Passed through to generate_rows()
+    """
+    if path == "-":
+        csv.writer(sys.stdout).writerows(generate_rows(rows, **options))
+        return
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(generate_rows(rows, **options))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic NPS survey export")
+    parser.add_argument("--rows", default="10k", help="number of rows, e.g. 10k, 100k, 1m")
+    parser.add_argument("--locations", type=int, default=50, help="distinct area managers")
+    parser.add_argument("--sentences", type=float, default=2.0, help="mean sentences per answer")
+    parser.add_argument("--duplicate-rate", type=float, default=0.2, help="share of repeated answers")
+    parser.add_argument("--blank-rate", type=float, default=0.1, help="share of empty answers")
+    parser.add_argument("--days", type=int, default=365, help="response date window in days")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("-o", "--output", default="-", help="output path (default: stdout)")
+    args = parser.parse_args(argv)
+
+    write_csv(args.output, parse_count(args.rows), locations=args.locations,
+              sentences=args.sentences, duplicate_rate=args.duplicate_rate,
+              blank_rate=args.blank_rate, days=args.days, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,508 @@
+# loadtest.py
+#
+# Concurrent-upload load test for POST /analyze-nps. Requests are sent from a
+# thread pool, either closed-loop (--concurrency uploads in flight, each
+# thread sending the next as soon as its last one returns) or open-loop at a
+# fixed --rate, where latency is measured from each request's scheduled start
+# so a server that falls behind is charged for the queueing it causes.
+#
+# The app is driven in-process through the ASGI test client (one event loop,
+# as under a single uvicorn worker), against a uvicorn started per
+# configuration (--uvicorn), or against a server that is already running
+# (--url). Each --config runs the same load with its own NPS_* environment,
+# so two settings can be compared side by side; in-process and --uvicorn
+# runs start from a fresh process each time.
+#
+# Reported per configuration: throughput, latency percentiles, status and
+# error counts, and CPU time and peak RSS of the server process and each of
+# its worker processes (sampled from /proc, or psutil when installed).
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    import psutil
+except ImportError:  # pragma: no cover - /proc is read directly instead
+    psutil = None
+
+from benchmarks import generate_nps_csv
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values, q):
+    """Linear-interpolated q-th percentile of a list of numbers, or None when empty."""
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def parse_mix(text):
+    """
+    Parse a file-size mix such as "10k:0.8,100k:0.2".
+
+    Returns:
+        List of (row count, weight) pairs; a size without a weight counts 1
+    """
+    mix = []
+    for part in text.split(","):
+        size, _, weight = part.strip().partition(":")
+        mix.append((generate_nps_csv.parse_count(size), float(weight) if weight else 1.0))
+    return mix
+
+
+def parse_config(text):
+    """
+    Parse a --config value "name:NPS_A=1,NPS_B=2" (or just "name").
+
+    Returns:
+        Tuple of (name, dict of environment overrides)
+    """
+    name, _, assignments = text.partition(":")
+    env = {}
+    for assignment in filter(None, (part.strip() for part in assignments.split(","))):
+        key, _, value = assignment.partition("=")
+        env[key.strip()] = value.strip()
+    return name, env
+
+
+class _ProcReader:
+    """CPU seconds, RSS and child processes of a pid, from /proc (Linux)."""
+
+    ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def children(self, pid):
+        found = []
+        pending = [pid]
+        while pending:
+            parent = pending.pop()
+            # Each thread lists the children it started (pools fork from helper threads)
+            kids = []
+            try:
+                for task in os.listdir(f"/proc/{parent}/task"):
+                    with open(f"/proc/{parent}/task/{task}/children") as f:
+                        kids.extend(int(kid) for kid in f.read().split())
+            except OSError:
+                pass
+            found.extend(kids)
+            pending.extend(kids)
+        return found
+
+    def sample(self, pid):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                # The command name may contain spaces; fields resume after its ")"
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{pid}/comm") as f:
+                name = f.read().strip()
+            rss_pages = int(fields[21])
+        except (OSError, IndexError, ValueError):
+            return None
+        return {
+            "name": name,
+            "cpu_seconds": (int(fields[11]) + int(fields[12])) / self.ticks,
+            "rss_mb": rss_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024),
+        }
+
+
+class _PsutilReader:
+    """Same interface as _ProcReader, backed by psutil."""
+
+    def children(self, pid):
+        try:
+            return [child.pid for child in psutil.Process(pid).children(recursive=True)]
+        except psutil.Error:
+            return []
+
+    def sample(self, pid):
+        try:
+            process = psutil.Process(pid)
+            with process.oneshot():
+                times = process.cpu_times()
+                return {
+                    "name": process.name(),
+                    "cpu_seconds": times.user + times.system,
+                    "rss_mb": process.memory_info().rss / (1024 * 1024),
+                }
+        except psutil.Error:
+            return None
+
+
+class ProcessSampler:
+    """
+    Background sampler of a server process and its descendants.
+
+    Args:
+        pid: Server process id
+        interval: Seconds between samples
+    """
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.reader = _PsutilReader() if psutil is not None else _ProcReader()
+        self.first = {}
+        self.last = {}
+        self.peak_rss = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="loadtest-sampler", daemon=True)
+
+    def available(self):
+        return self.reader.sample(self.pid) is not None
+
+    def start(self):
+        self._sample()
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def _sample(self):
+        for pid in [self.pid] + self.reader.children(self.pid):
+            sample = self.reader.sample(pid)
+            if sample is None:
+                continue
+            self.first.setdefault(pid, sample)
+            self.last[pid] = sample
+            self.peak_rss[pid] = max(self.peak_rss.get(pid, 0.0), sample["rss_mb"])
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def stop(self):
+        """
+        Stop sampling.
+
+        Returns:
+            List of dicts per process (server first): pid, role, name, CPU
+            seconds used during the run, average CPU percent and peak RSS in MB
+        """
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        processes = []
+        for pid, last in self.last.items():
+            cpu = last["cpu_seconds"] - self.first[pid]["cpu_seconds"]
+            processes.append({
+                "pid": pid,
+                "role": "server" if pid == self.pid else "worker",
+                "name": last["name"],
+                "cpu_seconds": round(cpu, 2),
+                "cpu_percent": round(cpu / elapsed * 100, 1),
+                "peak_rss_mb": round(self.peak_rss[pid], 1),
+            })
+        return processes
+
+
+def _multipart(path, body):
+    """Encode one CSV upload as a multipart/form-data request body."""
+    boundary = uuid.uuid4().hex
+    head = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; '
+            f'filename="{os.path.basename(path)}"\r\nContent-Type: text/csv\r\n\r\n').encode('utf-8')
+    return head + body + f"\r\n--{boundary}--\r\n".encode('utf-8'), f"multipart/form-data; boundary={boundary}"
+
+
+def _url_sender(base_url, params, timeout):
+    """send(path, body) for a server over HTTP (stdlib only)."""
+    endpoint = base_url.rstrip("/") + "/analyze-nps" + ("?" + urllib.parse.urlencode(params) if params else "")
+
+    def send(path, body):
+        data, content_type = _multipart(path, body)
+        request = urllib.request.Request(endpoint, data=data, method="POST", headers={"Content-Type": content_type})
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return response.status, len(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, len(e.read())
+    return send
+
+
+def _client_sender(client, params):
+    """send(path, body) for an in-process TestClient."""
+    def send(path, body):
+        response = client.post("/analyze-nps", params=params,
+                               files={"file": (os.path.basename(path), body, "text/csv")})
+        return response.status_code, len(response.content)
+    return send
+
+
+def _bust(body, columns, n):
+    # One extra row without a score: dropped by the analysis, but it gives
+    # every upload its own digest so the result cache cannot answer it
+    return body + (b"" if body.endswith(b"\n") else b"\n") + (f"loadtest-{n}" + "," * (columns - 1)).encode() + b"\n"
+
+
+def run_load(send, files, load):
+    """
+    Send the planned uploads and time each one.
+
+    Args:
+        send: Callable (path, body) -> (status code, response bytes)
+        files: List of (path, weight) to draw uploads from
+        load: Dict with "requests", "concurrency", "rate" (None = closed
+            loop), "seed" and "distinct"
+
+    Returns:
+        Dict with the wall time and one record per request
+    """
+    rng = random.Random(load["seed"])
+    paths = [path for path, _ in files]
+    weights = [weight for _, weight in files]
+    bodies = {}
+    columns = {}
+    for path in paths:
+        with open(path, 'rb') as f:
+            bodies[path] = f.read()
+        columns[path] = bodies[path].split(b"\n", 1)[0].count(b",") + 1
+    plan = [rng.choices(paths, weights)[0] for _ in range(load["requests"])]
+
+    records = []
+    lock = threading.Lock()
+
+    def one(n, path, scheduled):
+        body = _bust(bodies[path], columns[path], n) if load["distinct"] else bodies[path]
+        sent = time.perf_counter()
+        try:
+            status, size = send(path, body)
+            error = None
+        except Exception as e:
+            status, size, error = None, 0, f"{type(e).__name__}: {e}"
+        finished = time.perf_counter()
+        record = {
+            "file": os.path.basename(path),
+            "status": status,
+            "bytes": size,
+            "error": error,
+            # Open loop: from the scheduled start, so client-side queueing counts
+            "latency": finished - (scheduled if scheduled is not None else sent),
+            "finished": finished,
+        }
+        with lock:
+            records.append(record)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=load["concurrency"], thread_name_prefix="loadtest") as pool:
+        for n, path in enumerate(plan):
+            scheduled = None
+            if load["rate"]:
+                scheduled = started + n / load["rate"]
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(one, n, path, scheduled)
+    return {"wall_seconds": time.perf_counter() - started, "records": records}
+
+
+def summarize(run, processes):
+    """Throughput, latency percentiles, status counts and process stats of one load run."""
+    records = run["records"]
+    ok = [record for record in records if record["status"] == 200]
+    statuses = {}
+    for record in records:
+        key = str(record["status"]) if record["status"] is not None else "error"
+        statuses[key] = statuses.get(key, 0) + 1
+    latencies = [record["latency"] for record in ok]
+    wall = run["wall_seconds"]
+    summary = {
+        "requests": len(records),
+        "succeeded": len(ok),
+        "error_rate": round(1 - len(ok) / len(records), 4) if records else 0.0,
+        "statuses": statuses,
+        "errors": sorted({record["error"] for record in records if record["error"]})[:5],
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(ok) / wall, 3) if wall else None,
+        "latency_seconds": {
+            f"p{q}": round(percentile(latencies, q), 3) if latencies else None for q in PERCENTILES
+        },
+        "processes": processes,
+    }
+    summary["latency_seconds"]["mean"] = round(sum(latencies) / len(latencies), 3) if latencies else None
+    summary["latency_seconds"]["max"] = round(max(latencies), 3) if latencies else None
+    return summary
+
+
+def _in_process(case):
+    """Run one configuration against the app in this (fresh) process."""
+    os.environ.update(case["env"])
+    os.chdir(BACKEND_DIR)
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    from fastapi.testclient import TestClient
+
+    import main
+
+    # Entering the client runs the startup hooks (analysis pool, warm-up)
+    with TestClient(main.app) as client:
+        _wait_ready(lambda: client.get("/ready").status_code)
+        sampler = ProcessSampler(os.getpid())
+        sampler.start()
+        run = run_load(_client_sender(client, case["params"]), case["files"], case["load"])
+        return summarize(run, sampler.stop())
+
+
+def _wait_ready(probe, timeout=300):
+    # /ready answers 503 until the analysis workers have loaded the NLP models
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if probe() == 200:
+                return
+        except Exception:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("server did not become ready")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _with_uvicorn(case):
+    """Run one configuration against a uvicorn server started for it."""
+    port = _free_port()
+    env = {**os.environ, **case["env"]}
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                               "--port", str(port), "--log-level", "warning"],
+                              cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        _wait_ready(lambda: urllib.request.urlopen(base_url + "/ready", timeout=5).status)
+        return _against_url(base_url, case, server.pid)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def _against_url(base_url, case, pid=None):
+    sampler = ProcessSampler(pid) if pid else None
+    if sampler is not None and not sampler.available():
+        print(f"Cannot read process {pid}; CPU and RSS are not reported", file=sys.stderr)
+        sampler = None
+    if sampler is not None:
+        sampler.start()
+    run = run_load(_url_sender(base_url, case["params"], case["timeout"]), case["files"], case["load"])
+    return summarize(run, sampler.stop() if sampler is not None else [])
+
+
+def compare_table(results):
+    """Side-by-side text table of the configurations' summaries."""
+    names = [result["name"] for result in results]
+    rows = [
+        ("requests", lambda s: s["requests"]),
+        ("succeeded", lambda s: s["succeeded"]),
+        ("error rate", lambda s: f"{s['error_rate']:.1%}"),
+        ("statuses", lambda s: " ".join(f"{k}:{v}" for k, v in sorted(s["statuses"].items()))),
+        ("throughput/s", lambda s: s["throughput_rps"]),
+    ]
+    rows += [(f"p{q} latency s", lambda s, q=q: s["latency_seconds"][f"p{q}"]) for q in PERCENTILES]
+    rows += [
+        ("max latency s", lambda s: s["latency_seconds"]["max"]),
+        ("server cpu %", lambda s: sum(p["cpu_percent"] for p in s["processes"] if p["role"] == "server")),
+        ("workers", lambda s: sum(1 for p in s["processes"] if p["role"] == "worker")),
+        ("worker cpu %", lambda s: round(sum(p["cpu_percent"] for p in s["processes"] if p["role"] == "worker"), 1)),
+        ("max worker rss MB", lambda s: max((p["peak_rss_mb"] for p in s["processes"] if p["role"] == "worker"),
+                                            default=None)),
+        ("server rss MB", lambda s: next((p["peak_rss_mb"] for p in s["processes"] if p["role"] == "server"), None)),
+    ]
+    width = max(14, *(len(name) + 2 for name in names))
+    lines = [f"{'':<20}" + "".join(f"{name:>{width}}" for name in names)]
+    for label, value in rows:
+        lines.append(f"{label:<20}" + "".join(f"{str(value(result['summary'])):>{width}}" for result in results))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test concurrent /analyze-nps uploads")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", help="send to a running server (e.g. http://127.0.0.1:8000)")
+    target.add_argument("--uvicorn", action="store_true", help="start a local uvicorn per configuration")
+    parser.add_argument("--server-pid", type=int, help="with --url: server process to report CPU/RSS for")
+    parser.add_argument("--config", action="append", default=[],
+                        help='configuration to run, "name:NPS_VAR=value,..." (repeat to compare)')
+    parser.add_argument("--mix", default="10k", help='file sizes and weights, e.g. "10k:0.8,100k:0.2"')
+    parser.add_argument("--input", nargs="+", help="upload these CSV files (equal weights) instead of generated ones")
+    parser.add_argument("--requests", type=int, default=20, help="uploads per configuration")
+    parser.add_argument("--concurrency", type=int, default=4, help="uploads in flight at most")
+    parser.add_argument("--rate", type=float, help="open loop: start this many uploads per second")
+    parser.add_argument("--query", default="", help='analysis query string, e.g. "profile=summary"')
+    parser.add_argument("--cached", action="store_true",
+                        help="send identical bytes for repeated files (default: every upload is distinct)")
+    parser.add_argument("--timeout", type=float, default=600, help="per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write JSON results here")
+    args = parser.parse_args(argv)
+
+    configs = [parse_config(text) for text in args.config] or [("default", {})]
+    if args.url and any(env for _, env in configs):
+        parser.error("--config environment overrides need an in-process or --uvicorn run")
+    load = {"requests": args.requests, "concurrency": args.concurrency, "rate": args.rate,
+            "seed": args.seed, "distinct": not args.cached}
+    params = dict(urllib.parse.parse_qsl(args.query))
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.input:
+            files = [(os.path.abspath(path), 1.0) for path in args.input]
+        else:
+            files = []
+            for rows, weight in parse_mix(args.mix):
+                path = os.path.join(workdir, f"nps_{rows}.csv")
+                generate_nps_csv.write_csv(path, rows, seed=args.seed)
+                files.append((path, weight))
+
+        for name, env in configs:
+            case = {"env": env, "files": files, "load": load, "params": params, "timeout": args.timeout}
+            print(f"Running {name}: {args.requests} uploads, concurrency {args.concurrency}"
+                  + (f", {args.rate}/s" if args.rate else ""), file=sys.stderr)
+            if args.url:
+                summary = _against_url(args.url, case, args.server_pid)
+            elif args.uvicorn:
+                summary = _with_uvicorn(case)
+            else:
+                # A fresh process per configuration, so its NPS_* settings apply from import
+                context = multiprocessing.get_context("spawn")
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    summary = pool.submit(_in_process, case).result()
+            results.append({"name": name, "env": env, "summary": summary})
+
+    print(compare_table(results))
+    if args.output:
+        report = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "target": args.url or ("uvicorn" if args.uvicorn else "in-process"),
+            "mix": args.input or args.mix,
+            "query": args.query,
+            "load": load,
+            "configs": results,
+        }
+        with open(args.output, "w") as f:
+            f.write(json.dumps(report, indent=2) + "\n")
+        print(f"Wrote {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# vader_parity.py
+#
+# Parity check of the batch VADER engine (vader_batch.py) against NLTK's
+# SentimentIntensityAnalyzer. Every distinct feedback text (as the VADER
+# stage scores them) and every distinct sentence (as the aspect stage scores
+# them) is scored both ways; the report gives the positive/neutral/negative
+# label agreement with its confusion matrix, how many compound scores differ
+# and by how much, the first disagreeing texts, and the time each engine took.
+#
+# Exits 1 when any compound score differs (more than --max-differences texts
+# per level) or the label agreement is below --min-agreement, so it gates a
+# change to the batch rules like bench.py --compare gates slowdowns. Runs as
+# `python -m benchmarks.vader_parity` from the backend directory or as
+# `python backend/benchmarks/vader_parity.py` from anywhere.
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Run as a script, only this file's directory is on the path
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks import generate_nps_csv  # noqa: E402
+
+LABELS = ("positive", "neutral", "negative")
+
+
+def _texts(path):
+    """Distinct scored documents and distinct sentences of one CSV export."""
+    import ingestion
+    import text_corpus
+
+    with open(path, 'rb') as f:
+        ingest = ingestion.read_nps_csv(f)
+    if ingest.corpus is None:
+        return [], []
+    frame = ingest.corpus.frame
+    documents = list(dict.fromkeys(text for text, ok in zip(frame["text"], frame["is_str"])
+                                   if ok and len(text) > 5))
+    sentences = list(dict.fromkeys(sentence for text in documents
+                                   for sentence in text_corpus.SENTENCE_SPLIT.split(text)))
+    return documents, sentences
+
+
+def compare(texts, examples=5):
+    """
+    Score texts with both engines and compare them.
+
+    Args:
+        texts: List of strings
+        examples: Texts with differing compound scores to include
+
+    Returns:
+        Dict with counts, agreement, confusion matrix (exact label -> batch
+        label -> texts), compound differences, examples and timings
+    """
+    import sentiment_service
+
+    sentiment_service.clear_caches()
+    started = time.perf_counter()
+    exact = sentiment_service.vader_compounds(texts, "exact")
+    exact_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batch = sentiment_service.vader_compounds(texts, "batch")
+    batch_seconds = time.perf_counter() - started
+
+    confusion = {label: {other: 0 for other in LABELS} for label in LABELS}
+    disagreements = []
+    differing = 0
+    max_difference = 0.0
+    for text, expected, actual in zip(texts, exact, batch):
+        expected_label = sentiment_service.vader_label(expected)
+        actual_label = sentiment_service.vader_label(actual)
+        confusion[expected_label][actual_label] += 1
+        if expected != actual:
+            differing += 1
+            max_difference = max(max_difference, abs(expected - actual))
+        if expected != actual and len(disagreements) < examples:
+            disagreements.append({"text": text, "exact": expected, "batch": actual})
+
+    agreeing = sum(confusion[label][label] for label in LABELS)
+    return {
+        "texts": len(texts),
+        "label_agreement": round(agreeing / len(texts), 6) if texts else 1.0,
+        "confusion": confusion,
+        "compound_differs": differing,
+        "max_compound_difference": round(max_difference, 4),
+        "examples": disagreements,
+        "exact_seconds": round(exact_seconds, 3),
+        "batch_seconds": round(batch_seconds, 3),
+        "speedup": round(exact_seconds / batch_seconds, 1) if batch_seconds else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare batch VADER scores with NLTK's analyzer")
+    parser.add_argument("--input", nargs="+", help="CSV exports to check (default: a generated one)")
+    parser.add_argument("--rows", default="100k", help="rows of the generated export, e.g. 50k")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--examples", type=int, default=5, help="disagreeing texts to show per level")
+    parser.add_argument("--max-differences", type=int, default=0,
+                        help="exit 1 when more compound scores of either level differ")
+    parser.add_argument("--min-agreement", type=float, default=0.999,
+                        help="exit 1 when the label agreement of either level is lower")
+    parser.add_argument("--output", help="write JSON results here")
+    args = parser.parse_args(argv)
+
+    os.chdir(BACKEND_DIR)
+    import nlp_resources
+
+    nlp_resources.vader()
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = [os.path.abspath(path) for path in args.input or []]
+        if not paths:
+            path = os.path.join(workdir, f"nps_{args.rows}.csv")
+            generate_nps_csv.write_csv(path, generate_nps_csv.parse_count(args.rows), seed=args.seed)
+            paths = [path]
+        documents, sentences = [], []
+        for path in paths:
+            print(f"Reading {os.path.basename(path)}", file=sys.stderr)
+            file_documents, file_sentences = _texts(path)
+            documents += file_documents
+            sentences += file_sentences
+
+    results = {
+        "documents": compare(list(dict.fromkeys(documents)), args.examples),
+        "sentences": compare(list(dict.fromkeys(sentences)), args.examples),
+    }
+    failures = []
+    for level, result in results.items():
+        print(f"{level}: {result['texts']} distinct, label agreement {result['label_agreement']:.4%}, "
+              f"{result['compound_differs']} compound scores differ (max {result['max_compound_difference']}), "
+              f"exact {result['exact_seconds']}s, batch {result['batch_seconds']}s ({result['speedup']}x)")
+        print(f"  exact \\ batch  " + "".join(f"{label:>10}" for label in LABELS))
+        for label in LABELS:
+            print(f"  {label:<14}" + "".join(f"{result['confusion'][label][other]:>10}" for other in LABELS))
+        for example in result["examples"]:
+            print(f"  {example['exact']:+.4f} vs {example['batch']:+.4f}  {example['text'][:100]!r}")
+        if result["compound_differs"] > args.max_differences:
+            failures.append(f"{level}: {result['compound_differs']} compound scores differ "
+                            f"(allowed {args.max_differences})")
+        if result["label_agreement"] < args.min_agreement:
+            failures.append(f"{level}: label agreement below {args.min_agreement}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(json.dumps({"inputs": args.input or [args.rows], **results}, indent=2) + "\n")
+        print(f"Wrote {args.output}", file=sys.stderr)
+    if failures:
+        print("\n".join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
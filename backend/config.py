@@ -0,0 +1,108 @@
+# config.py
+#
+# Tunables for the analysis backend. Every value can be overridden with an
+# environment variable so deployments can size workers without code changes.
+import os
+
+# Number of CSV rows parsed per chunk when streaming an upload
+CSV_CHUNK_SIZE = int(os.environ.get("NPS_CSV_CHUNK_SIZE", 50000))
+
+# CSV parser: "pyarrow" (multi-threaded, used when installed) or "c" (pandas)
+CSV_ENGINE = os.environ.get("NPS_CSV_ENGINE", "pyarrow")
+
+# Number of leading bytes inspected to pick the upload's text encoding
+ENCODING_SNIFF_BYTES = int(os.environ.get("NPS_ENCODING_SNIFF_BYTES", 64 * 1024))
+
+# Worker processes running the analysis pipeline (0 runs it on a thread instead)
+ANALYSIS_WORKERS = int(os.environ.get("NPS_ANALYSIS_WORKERS", os.cpu_count() or 1))
+
+# Analyses allowed to wait for a free worker before uploads are rejected with 429
+ANALYSIS_QUEUE_SIZE = int(os.environ.get("NPS_ANALYSIS_QUEUE_SIZE", 4))
+
+# Directory for uploads handed to worker processes (None uses the system default)
+UPLOAD_TMP_DIR = os.environ.get("NPS_UPLOAD_TMP_DIR") or None
+
+# In-memory budget for cached analysis responses, in bytes (0 disables the cache)
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("NPS_RESULT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# Optional directory for the on-disk result cache tier (entries go under its
+# nps-result-cache/<analysis version>/; directories of older versions are kept)
+RESULT_CACHE_DIR = os.environ.get("NPS_RESULT_CACHE_DIR") or None
+
+# Entries kept in each process-wide sentiment memo (VADER and TextBlob)
+SENTIMENT_CACHE_SIZE = int(os.environ.get("NPS_SENTIMENT_CACHE_SIZE", 200000))
+
+# VADER scoring engine when a request does not pick one (?sentiment=): "exact"
+# scores text by text with NLTK's analyzer (memoized), "batch" scores each
+# batch of texts at once with vectorized lexicon lookups (see vader_batch.py)
+SENTIMENT_ENGINE = os.environ.get("NPS_SENTIMENT_ENGINE", "exact")
+
+# Allow fetching missing NLTK data from the network at warm-up (off by default;
+# bake the packages listed in nltk.txt into the image instead)
+NLTK_DOWNLOAD = os.environ.get("NPS_NLTK_DOWNLOAD", "0") == "1"
+
+# File holding the persisted online topic model (unset keeps per-upload batch LDA)
+TOPIC_MODEL_PATH = os.environ.get("NPS_TOPIC_MODEL_PATH") or None
+
+# Default topic mode: batch, update or assign (unset: update when a model path is set)
+TOPIC_MODE = os.environ.get("NPS_TOPIC_MODE") or None
+
+# Uploads the persisted topic model remembers having trained on (older ones
+# are forgotten, and would be trained on again if re-uploaded)
+TOPIC_SEEN_CORPORA = int(os.environ.get("NPS_TOPIC_SEEN_CORPORA", 1000))
+
+# Background analysis jobs (POST /jobs): how many run at once, how many may
+# wait for a slot before submissions get a 429, and how long finished jobs
+# and their results are kept
+JOB_CONCURRENCY = int(os.environ.get("NPS_JOB_CONCURRENCY", max(ANALYSIS_WORKERS, 1)))
+JOB_QUEUE_SIZE = int(os.environ.get("NPS_JOB_QUEUE_SIZE", 16))
+JOB_TTL_SECONDS = int(os.environ.get("NPS_JOB_TTL_SECONDS", 3600))
+
+# Sharded text scoring (VADER, TextBlob, aspects): processes per analysis, rows
+# per shard, and the feedback row count below which scoring stays serial.
+# Every analysis worker starts its own shard pool, so by default the cores are
+# split between them rather than each worker getting all of them
+TEXT_WORKERS = int(os.environ.get("NPS_TEXT_WORKERS", max(1, (os.cpu_count() or 1) // max(ANALYSIS_WORKERS, 1))))
+TEXT_SHARD_ROWS = int(os.environ.get("NPS_TEXT_SHARD_ROWS", 5000))
+TEXT_PARALLEL_MIN_ROWS = int(os.environ.get("NPS_TEXT_PARALLEL_MIN_ROWS", 20000))
+
+# Threads running independent analysis stages concurrently within one analysis
+# (1 runs them one after another)
+STAGE_THREADS = int(os.environ.get("NPS_STAGE_THREADS", 4))
+
+# Distinct keywords counted per segment (and per cube cell) before the keyword
+# counts switch from exact to a bounded approximation (see heavy_hitters.py)
+KEYWORD_SKETCH_SIZE = int(os.environ.get("NPS_KEYWORD_SKETCH_SIZE", 50000))
+
+# Estimate mode (?estimate=true): target margin of error for the sampled text
+# percentages (0.02 = +/- 2 points) and the confidence level of their intervals
+ESTIMATE_MARGIN = float(os.environ.get("NPS_ESTIMATE_MARGIN", 0.02))
+ESTIMATE_CONFIDENCE = float(os.environ.get("NPS_ESTIMATE_CONFIDENCE", 0.95))
+
+# NPS trends over a response-date column: the period of the response's trend
+# series (day, week or month) and the rolling window length in days
+TREND_PERIOD = os.environ.get("NPS_TREND_PERIOD", "week")
+TREND_WINDOW_DAYS = int(os.environ.get("NPS_TREND_WINDOW_DAYS", 30))
+
+# Response dates trends accept: from this date to this many days past today.
+# Dates outside (typos like 0204-05-01 or 2204-05-01) count as undated
+TREND_FIRST_DATE = os.environ.get("NPS_TREND_FIRST_DATE", "1990-01-01")
+TREND_FUTURE_DAYS = int(os.environ.get("NPS_TREND_FUTURE_DAYS", 366))
+
+# Most periods x (locations + 1) values one trend series may report; larger
+# requests are rejected (the analysis reports no trends block for them)
+TREND_MAX_CELLS = int(os.environ.get("NPS_TREND_MAX_CELLS", 2000000))
+
+# Responses at least this large are compressed (brotli or gzip) when the
+# client's Accept-Encoding allows it (0 compresses every response)
+COMPRESS_MIN_BYTES = int(os.environ.get("NPS_COMPRESS_MIN_BYTES", 1024))
+
+# Directory of the persistent Parquet response store (unset disables ?persist=true
+# and the /store query endpoints)
+STORE_DIR = os.environ.get("NPS_STORE_DIR") or None
+
+# Analyses run with ?keep=true whose pre-aggregated cube, categorized rows and
+# trend buckets are kept in memory for /cube, /feedback and /trends (0 rejects
+# ?keep=true), and the keywords each cube cell keeps for the top-keyword sketches
+CUBE_CACHE_SIZE = int(os.environ.get("NPS_CUBE_CACHE_SIZE", 8))
+CUBE_SKETCH_SIZE = int(os.environ.get("NPS_CUBE_SKETCH_SIZE", 20))
@@ -0,0 +1,289 @@
+# estimation.py
+#
+# Estimate mode for very large exports. The score summary stays exact (it is
+# computed from every row during parsing), but the text stages run on a
+# stratified random sample of the feedback rows: strata are segment x
+# location, each allocated in proportion to its size, so the sample is
+# self-weighting and plain sample percentages estimate the full-file ones.
+# The sample size is chosen for a target margin of error on a proportion and
+# does not grow with the file, which keeps response time roughly flat.
+#
+# Every text percentage is reported with a Wilson score interval. Intervals
+# use the simple-random-sampling variance with the finite population
+# correction, which is conservative for a proportionally stratified sample.
+# Shares of mentions (emotions, aspect sentiment) are inflated by a design
+# effect, since the sampled unit is the row and one row can mention several.
+# Counts in the text blocks are scaled from the sample to the whole file, like
+# the exact score counts.
+import math
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+import config
+from accumulators import KeywordAccumulator, SEGMENT_BY_CODE
+from text_corpus import FeedbackCorpus
+
+# Fixed so repeated estimates of the same upload agree (and can be cached)
+SAMPLE_SEED = 0
+
+
+def _z(confidence):
+    return NormalDist().inv_cdf(0.5 + confidence / 2)
+
+
+def sample_size(population, margin=None, confidence=None):
+    """
+    Rows needed to estimate any proportion within +/- margin.
+
+    Uses the worst case p = 0.5 and the finite population correction.
+
+    Args:
+        population: Number of rows sampled from
+        margin: Target margin of error as a fraction (defaults to config.ESTIMATE_MARGIN)
+        confidence: Confidence level (defaults to config.ESTIMATE_CONFIDENCE)
+
+    Returns:
+        Sample size, at most population
+    """
+    margin = margin or config.ESTIMATE_MARGIN
+    confidence = confidence or config.ESTIMATE_CONFIDENCE
+    if population <= 0:
+        return 0
+    n0 = _z(confidence) ** 2 * 0.25 / margin ** 2
+    return min(population, math.ceil(n0 / (1 + (n0 - 1) / population)))
+
+
+def stratified_sample(strata, n, seed=SAMPLE_SEED):
+    """
+    Positions of a proportionally allocated stratified random sample.
+
+    Args:
+        strata: Integer stratum id per row
+        n: Total sample size
+        seed: Random seed
+
+    Returns:
+        Sorted numpy array of sampled row positions
+    """
+    strata = np.asarray(strata, dtype=np.int64)
+    if n >= len(strata):
+        return np.arange(len(strata))
+    sizes = np.bincount(strata)
+    # Largest-remainder rounding keeps the allocation summing to n
+    quotas = sizes * n / len(strata)
+    allocation = np.floor(quotas).astype(np.int64)
+    short = n - allocation.sum()
+    allocation[np.argsort(-(quotas - allocation), kind="stable")[:short]] += 1
+
+    # Random order within each stratum; keep the first allocation[h] rows
+    rng = np.random.default_rng(seed)
+    order = np.lexsort((rng.random(len(strata)), strata))
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    rank = np.arange(len(strata)) - starts[strata[order]]
+    return np.sort(order[rank < allocation[strata[order]]])
+
+
+def sample_feedback(ingest, tokenize=True, margin=None):
+    """
+    Replace an ingest's (unbuilt) corpus with a stratified sample.
+
+    Args:
+        ingest: IngestResult parsed with corpus=False
+        tokenize: Whether to compute keyword tokens and counts for the sample
+        margin: Target margin of error (defaults to config.ESTIMATE_MARGIN)
+
+    Returns:
+        Dict with the feedback row count, the sampled row count, the margin
+        and the confidence level
+    """
+    df = ingest.df
+    has_feedback = df[ingest.feedback_col].notna().to_numpy()
+    codes = ingest.score_codes[has_feedback]
+    segments = SEGMENT_BY_CODE[codes]
+
+    # Strata: segment x location (a missing location is a location of its own)
+    segment_ids = pd.factorize(segments)[0]
+    location_ids = (pd.factorize(df[ingest.location_col][has_feedback])[0] + 1 if ingest.location_col
+                    else np.zeros(len(codes), dtype=np.int64))
+    strata = location_ids * 3 + segment_ids
+
+    population = int(has_feedback.sum())
+    n = sample_size(population, margin)
+    positions = stratified_sample(strata, n)
+
+    rows = df[ingest.feedback_col][has_feedback].iloc[positions]
+    corpus = FeedbackCorpus.from_series(rows, pd.Series(segments[positions], index=rows.index), tokenize=tokenize)
+    ingest.corpus = corpus
+    if tokenize:
+        ingest.keywords = KeywordAccumulator()
+        ingest.keywords.add_corpus(corpus)
+    print(f"Estimate mode: sampled {n} of {population} feedback rows")
+    return {
+        "feedbackRows": population,
+        "sampledRows": n,
+        "margin": margin or config.ESTIMATE_MARGIN,
+        "confidence": config.ESTIMATE_CONFIDENCE,
+    }
+
+
+def design_effects(rows, labels, label_names):
+    """
+    Design effect of each label's share of mentions in a sample of rows.
+
+    Mentions of one row are not independent draws (a row naming two emotions
+    counts towards both), so each row is treated as a cluster of mentions and
+    a label's share as a ratio estimate, whose linearized variance is compared
+    with the variance if every mention had been sampled on its own.
+
+    Args:
+        rows: Row position of each mention
+        labels: Index into label_names of each mention
+        label_names: Labels, in index order
+
+    Returns:
+        Dict of label -> design effect (at least 1)
+    """
+    effects = {label: 1.0 for label in label_names}
+    rows = np.asarray(rows, dtype=np.int64)
+    labels = np.asarray(labels, dtype=np.int64)
+    row_index = np.unique(rows, return_inverse=True)[1]
+    clusters = int(row_index.max()) + 1 if len(rows) else 0
+    if clusters < 2:
+        return effects
+    mentions = np.bincount(row_index, minlength=clusters).astype(float)
+    total = mentions.sum()
+    for index, label in enumerate(label_names):
+        hits = np.bincount(row_index, weights=(labels == index).astype(float), minlength=clusters)
+        p = hits.sum() / total
+        if p <= 0 or p >= 1:
+            continue
+        residuals = hits - p * mentions
+        cluster_variance = clusters * (residuals ** 2).sum() / (clusters - 1) / total ** 2
+        effects[label] = max(1.0, cluster_variance / (p * (1 - p) / total))
+    return effects
+
+
+def proportion_intervals(counts, population_fraction=0.0, confidence=None, effects=None):
+    """
+    Wilson score intervals for the shares of a set of sample counts.
+
+    Args:
+        counts: Dict of label -> count in the sample
+        population_fraction: Sampling fraction n/N, for the finite population
+            correction (1.0 means the sample was the whole population)
+        confidence: Confidence level (defaults to config.ESTIMATE_CONFIDENCE)
+        effects: Optional dict of label -> design effect (see design_effects())
+            for counts of mentions rather than of sampled rows
+
+    Returns:
+        Dict of label -> [low, high] in percent, rounded to one decimal
+    """
+    confidence = confidence or config.ESTIMATE_CONFIDENCE
+    labels = list(counts)
+    values = np.array([counts[label] for label in labels], dtype=float)
+    n = values.sum()
+    if n == 0:
+        return {label: [0.0, 100.0] for label in labels}
+    p = values / n
+    if population_fraction >= 1:
+        low = high = p
+    else:
+        # The correction shrinks the variance, i.e. grows the effective
+        # sample; clustered mentions grow it, i.e. shrink the sample
+        deff = np.array([(effects or {}).get(label, 1.0) for label in labels])
+        n_eff = n / deff / (1 - population_fraction)
+        z = _z(confidence)
+        centre = (p + z * z / (2 * n_eff)) / (1 + z * z / n_eff)
+        half = z * np.sqrt(p * (1 - p) / n_eff + z * z / (4 * n_eff * n_eff)) / (1 + z * z / n_eff)
+        low, high = centre - half, centre + half
+    low = np.clip(np.round(low * 100, 1), 0, 100)
+    high = np.clip(np.round(high * 100, 1), 0, 100)
+    return {label: [float(lo), float(hi)] for label, lo, hi in zip(labels, low, high)}
+
+
+def intervals(result, counts, sample, mentions=None):
+    """
+    Confidence intervals for the text percentages of an estimated result.
+
+    Args:
+        result: Analysis result built from the sampled corpus
+        counts: Raw sample counts recorded by the stages ("feedbackSentiment",
+            "emotions", "intensity"), plus "emotionHits" with the "rows" and
+            "labels" (index into the emotions) of every emotion counted
+        sample: Dict returned by sample_feedback()
+        mentions: Aspect mentions from analyze_aspect_sentiment() ("rows",
+            "aspects" and "labels" arrays)
+
+    Returns:
+        Dict of response block -> label -> [low, high] percent
+    """
+    fraction = sample["sampledRows"] / sample["feedbackRows"] if sample["feedbackRows"] else 1.0
+    found = {}
+    for key in ("feedbackSentiment", "emotions", "intensity"):
+        if key in counts:
+            effects = None
+            if key == "emotions" and "emotionHits" in counts:
+                effects = design_effects(counts["emotionHits"]["rows"], counts["emotionHits"]["labels"],
+                                         list(counts[key]))
+            found[key] = proportion_intervals(counts[key], fraction, effects=effects)
+    if result.get("categoryDistribution"):
+        found["categoryDistribution"] = proportion_intervals(
+            {item["name"]: item["count"] for item in result["categoryDistribution"]}, fraction)
+    aspects = result.get("aspectSentiment", {}).get("aspect_sentiments")
+    if aspects:
+        labels = ("positive", "neutral", "negative")
+        found["aspectSentiment"] = {}
+        for index, (aspect, tally) in enumerate(aspects.items()):
+            if tally["total"] == 0:
+                continue
+            effects = None
+            if mentions and "rows" in mentions:
+                # Aspect indexes follow ASPECT_KEYWORDS, the order of aspect_sentiments
+                of_aspect = mentions["aspects"] == index
+                effects = design_effects(mentions["rows"][of_aspect], mentions["labels"][of_aspect], labels)
+            found["aspectSentiment"][aspect] = proportion_intervals({label: tally[label] for label in labels},
+                                                                    fraction, effects=effects)
+    return found
+
+
+def scale_counts(result, sample):
+    """
+    Scale the sample counts of an estimated result to the whole file.
+
+    The sample is self-weighting, so every count is multiplied by the same
+    factor N/n (feedback rows over sampled rows) and rounded: the "count"
+    of each categoryDistribution, keywordAnalysis, promoterKeywords,
+    detractorKeywords and topics entry (and keyword max_error), and the
+    aspectSentiment tallies and aspect_mentions. Shares, weights and
+    intervals are unchanged; categorizedFeedback and the samples list
+    sampled rows as they are.
+
+    Args:
+        result: Analysis result built from the sampled corpus (updated in place)
+        sample: Dict returned by sample_feedback()
+
+    Returns:
+        The scale factor applied
+    """
+    scale = sample["feedbackRows"] / sample["sampledRows"] if sample["sampledRows"] else 1.0
+
+    def scaled(count):
+        return int(round(count * scale))
+
+    for key in ("categoryDistribution", "topics"):
+        for item in result.get(key) or []:
+            item["count"] = scaled(item["count"])
+    for key in ("keywordAnalysis", "promoterKeywords", "detractorKeywords"):
+        for item in result.get(key) or []:
+            item["count"] = scaled(item["count"])
+            if "max_error" in item:
+                item["max_error"] = scaled(item["max_error"])
+    aspects = result.get("aspectSentiment") or {}
+    for tally in (aspects.get("aspect_sentiments") or {}).values():
+        for label in ("positive", "neutral", "negative", "total"):
+            tally[label] = scaled(tally[label])
+    for aspect, count in (aspects.get("aspect_mentions") or {}).items():
+        aspects["aspect_mentions"][aspect] = scaled(count)
+    return scale
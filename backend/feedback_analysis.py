@@ -1,106 +1,332 @@
 # feedback_analysis.py
+import numpy as np
 
-def categorize_feedback(feedback_texts):
-    """
-    Categorize feedback into predefined categories using a rule-based approach.
-    
-    Args:
-        feedback_texts: List of feedback text strings to categorize
-        
-    Returns:
-        List of dictionaries with categorized feedback
-    """
-    # Define categories and their associated keywords
-    categories = {
-        "Product Quality": ["quality", "material", "fabric", "broke", "damaged", "poor", "excellent", 
+import metrics
+import sentiment_service
+import text_scoring
+from keyword_matcher import KeywordMatcher
+from text_corpus import as_corpus
+
+# Define categories and their associated keywords
+CATEGORY_KEYWORDS = {
+    "Product Quality": ["quality", "material", "fabric", "broke", "damaged", "poor", "excellent", 
                           "great", "terrible", "durability", "durable", "flimsy", "sturdy", "well made"],
-        
-        "Customer Service": ["service", "staff", "helpful", "rude", "polite", "responsive", "assistance",
+
+    "Customer Service": ["service", "staff", "helpful", "rude", "polite", "responsive", "assistance",
                            "support", "representative", "agent", "manager", "helped", "call", "center", 
                            "phone", "email", "chat", "contact"],
-        
-        "Delivery & Shipping": ["delivery", "shipping", "late", "delay", "arrived", "package", "box", 
+
+    "Delivery & Shipping": ["delivery", "shipping", "late", "delay", "arrived", "package", "box", 
                               "damaged", "courier", "shipment", "tracking", "waiting", "received", 
                               "dispatched", "post", "mail", "quick", "slow", "fast"],
-        
-        "Price & Value": ["price", "expensive", "cheap", "value", "worth", "cost", "affordable", 
+
+    "Price & Value": ["price", "expensive", "cheap", "value", "worth", "cost", "affordable", 
                         "overpriced", "discount", "sale", "deal", "bargain", "money", "paid", 
                         "refund", "return", "policy"],
-        
-        "Product Fit & Size": ["size", "fit", "tight", "loose", "large", "small", "big", "petite", 
+
+    "Product Fit & Size": ["size", "fit", "tight", "loose", "large", "small", "big", "petite", 
                              "measurement", "dimension", "length", "width", "height", "tall", "short"],
-        
-        "Website & App": ["website", "app", "site", "online", "login", "account", "password", "interface", 
+
+    "Website & App": ["website", "app", "site", "online", "login", "account", "password", "interface", 
                         "navigate", "search", "filter", "checkout", "cart", "payment", "transaction", 
                         "user", "experience"]
-    }
+}
+
+# Define common aspects for retail/product feedback
+ASPECT_KEYWORDS = {
+    "product": ["product", "item", "quality", "material", "fabric"],
+    "price": ["price", "cost", "expensive", "cheap", "value", "worth", "affordable"],
+    "service": ["service", "staff", "support", "representative", "helpful", "assistance"],
+    "delivery": ["delivery", "shipping", "arrive", "arrived", "package", "shipment"],
+    "website": ["website", "app", "online", "site", "checkout", "cart"],
+    "returns": ["return", "refund", "exchange", "policy"]
+}
+
+# Simple emotion detection with keyword approach
+EMOTION_KEYWORDS = {
+    "joy": ["happy", "love", "great", "excellent", "amazing", "awesome", "perfect", "wonderful", "delighted"],
+    "sadness": ["sad", "disappointed", "unhappy", "regret", "missing", "unfortunate", "sorry"],
+    "anger": ["angry", "frustrat", "annoy", "terrible", "awful", "horrible", "bad", "unacceptable"],
+    "surprise": ["wow", "surprise", "unexpected", "amazed", "astonished"],
+    "fear": ["afraid", "worried", "concern", "fear", "anxious", "scared"]
+}
+
+# All keyword tables compiled once into a single matcher shared by the stages
+KEYWORD_MATCHER = KeywordMatcher({
+    "categories": CATEGORY_KEYWORDS,
+    "aspects": ASPECT_KEYWORDS,
+    "emotions": EMOTION_KEYWORDS,
+})
+
+
+def keyword_hits(corpus):
+    """
+    Category, aspect and emotion keyword hits for every row of a corpus.
+
+    Computed in one matcher pass per distinct text (rows with the same text
+    share one dict) and cached on the corpus (not in its frame, which
+    concurrent stages are reading), so the categorization and emotion stages
+    (and the response store's per-row aspect hits) share the same scan.
+
+    Args:
+        corpus: FeedbackCorpus
+
+    Returns:
+        List of {"categories": {...}, "aspects": {...}, "emotions": {...}}
+        dicts aligned with the corpus
+    """
+    if corpus.keyword_hits is None:
+        first, inverse = corpus.unique()
+        hits = [KEYWORD_MATCHER.match(text_lower, ("categories", "aspects", "emotions"))
+                for text_lower in corpus.frame["lower"].to_numpy()[first]]
+        corpus.keyword_hits = [hits[i] for i in inverse]
+    return corpus.keyword_hits
+
+
+# Primary category codes: the keyword categories in table order, then the two fallbacks
+CATEGORY_LABELS = list(CATEGORY_KEYWORDS) + ["General Feedback", "Uncategorized"]
+GENERAL_FEEDBACK = len(CATEGORY_KEYWORDS)
+UNCATEGORIZED = GENERAL_FEEDBACK + 1
+
+
+class CategorizedFeedback:
+    """
+    Columnar categorization of a corpus.
+
+    Rows are kept as arrays (a primary and secondary category code per row,
+    plus the keyword hit matrix); the per-row dicts of the response shape are
+    only built for the rows actually served.
+
+    Attributes:
+        texts: Feedback texts, one per corpus row
+        scores: int16 matrix of keyword hits, rows x CATEGORY_KEYWORDS
+        primary: int8 index into CATEGORY_LABELS per row
+        secondary: int8 index into CATEGORY_LABELS per row, -1 for none
+    """
+
+    def __init__(self, texts, scores, primary, secondary):
+        self.texts = texts
+        self.scores = scores
+        self.primary = primary
+        self.secondary = secondary
+
+    def __len__(self):
+        return len(self.primary)
+
+    def counts(self):
+        """Rows per primary category, indexed like CATEGORY_LABELS."""
+        return np.bincount(self.primary, minlength=len(CATEGORY_LABELS))
+
+    def distribution(self):
+        """Primary category counts, most frequent first (ties in order of first appearance)."""
+        counts = self.counts()
+        codes, first_rows = np.unique(self.primary, return_index=True)
+        return sorted(
+            ({"name": CATEGORY_LABELS[code], "count": int(counts[code])}
+             for code in codes[np.argsort(first_rows)]),
+            key=lambda x: x["count"], reverse=True)
+
+    def primary_names(self):
+        """Primary category label per row, as an object array."""
+        return np.array(CATEGORY_LABELS, dtype=object)[self.primary]
+
+    def row(self, i):
+        """The categorization of row i as a response dict."""
+        row_scores = self.scores[i]
+        # Categories by hit count; ties keep the table order
+        ranked = [c for c in np.argsort(-row_scores, kind="stable") if row_scores[c] > 0]
+        secondary = self.secondary[i]
+        return {
+            "text": self.texts[i],
+            "primary_category": CATEGORY_LABELS[self.primary[i]],
+            "secondary_category": CATEGORY_LABELS[secondary] if secondary >= 0 else None,
+            "categories": [CATEGORY_LABELS[c] for c in ranked],
+            "category_scores": {CATEGORY_LABELS[c]: int(row_scores[c]) for c in np.flatnonzero(row_scores)},
+        }
+
+    def rows(self, start=0, stop=None):
+        """Response dicts for rows[start:stop]."""
+        return [self.row(i) for i in range(*slice(start, stop).indices(len(self)))]
+
+    def page(self, category=None, cursor=0, limit=50):
+        """
+        One page of categorized rows in corpus order.
+
+        Args:
+            category: Optional primary category label to keep
+            cursor: Row position to resume from (0 for the first page)
+            limit: Rows per page
+
+        Returns:
+            Dict with the page's response dicts ("items"), the cursor of the
+            next page ("next_cursor", None on the last page) and the number of
+            matching rows ("total")
+        """
+        if category is None:
+            positions = np.arange(len(self))
+        else:
+            positions = np.flatnonzero(self.primary == CATEGORY_LABELS.index(category))
+        start = np.searchsorted(positions, cursor)
+        chosen = positions[start:start + limit]
+        more = start + limit < len(positions)
+        return {
+            "items": [self.row(i) for i in chosen],
+            "next_cursor": int(positions[start + limit]) if more else None,
+            "total": len(positions),
+        }
+
+
+def categorize_columns(feedback_texts):
+    """
+    Categorize feedback into predefined categories using a rule-based approach.
+
+    Each row's primary category is the keyword category with the most
+    matching keywords (ties go to the earlier category in CATEGORY_KEYWORDS),
+    "General Feedback" when none matches and "Uncategorized" for texts under
+    5 characters.
+
+    Args:
+        feedback_texts: List of feedback text strings to categorize, or a
+            FeedbackCorpus whose keyword scan is reused
+
+    Returns:
+        CategorizedFeedback
+    """
+    corpus = as_corpus(feedback_texts)
+    frame = corpus.frame
+    hits = keyword_hits(corpus)
+    # Categorize each distinct text once, then map back to the rows
+    first, inverse = corpus.unique()
+    column = {category: i for i, category in enumerate(CATEGORY_KEYWORDS)}
+
+    # Category keyword matches: 1 for each matching keyword
+    scores = np.zeros((len(first), len(CATEGORY_KEYWORDS)), dtype=np.int16)
+    for i, row in enumerate(first):
+        for category, count in hits[row]["categories"].items():
+            scores[i, column[category]] = count
+    # Skip invalid texts
+    valid = np.fromiter((isinstance(text, str) and len(text) >= 5 for text in frame["text"].to_numpy()[first]),
+                        dtype=bool, count=len(first))
+    scores[~valid] = 0
+
+    ranked = np.argsort(-scores, axis=1, kind="stable")
+    matched = np.count_nonzero(scores, axis=1)
+    primary = np.where(matched > 0, ranked[:, 0], GENERAL_FEEDBACK).astype(np.int8)
+    primary[~valid] = UNCATEGORIZED
+    secondary = np.where(matched > 1, ranked[:, 1], -1).astype(np.int8)
+    return CategorizedFeedback(frame["text"].tolist(), scores[inverse], primary[inverse], secondary[inverse])
+
+
+def categorize_feedback(feedback_texts):
+    """
+    Categorize feedback into predefined categories using a rule-based approach.
     
-    # Process and categorize each feedback
-    results = []
+    Args:
+        feedback_texts: List of feedback text strings to categorize, or a
+            FeedbackCorpus whose lowercased text is reused
+        
+    Returns:
+        List of dictionaries with categorized feedback (one per row; prefer
+        categorize_columns() for large inputs)
+    """
+    return categorize_columns(feedback_texts).rows()
+
+# Sentiment labels in the order used by per-mention codes
+SENTIMENT_LABELS = ("positive", "neutral", "negative")
+
+
+def _aspect_block(texts, sentences_by_row, sentences_lower_by_row, engine="exact"):
+    """Aspect mentions of a block of rows, with their sentence and its sentiment."""
+    aspects = ASPECT_KEYWORDS
+    # One (row in block, aspect index, sentiment index, sentence index,
+    # compound score) entry per mention
+    found = {"mentions": ([], [], [], [], []), "rows": len(texts)}
+    mention_rows, mention_aspects, mention_labels, mention_sentences, mention_scores = found["mentions"]
+    # Sentence of every mention, scored once the block's mentions are known
+    mentioned_sentences = []
     
-    for text in feedback_texts:
+    # Process each feedback text, using the corpus' sentence split for
+    # more accurate aspect-level sentiment
+    for row, (text, sentences, sentences_lower) in enumerate(zip(texts, sentences_by_row, sentences_lower_by_row)):
         if not isinstance(text, str) or len(text) < 5:
-            # Skip invalid texts
-            results.append({"text": text, "primary_category": "Uncategorized", "secondary_category": None, 
-                        "categories": [], "category_scores": {}})
             continue
-            
-        # Convert to lowercase
-        processed_text = text.lower()
-        
-        # Count category keyword matches
-        category_scores = {}
-        for category, keywords in categories.items():
-            score = 0
-            for keyword in keywords:
-                if keyword in processed_text:
-                    # Add 1 for each matching keyword
-                    score += 1
-            
-            if score > 0:
-                category_scores[category] = score
-        
-        # Sort categories by score
-        sorted_categories = sorted(category_scores.items(), key=lambda x: x[1], reverse=True)
-        all_categories = [cat for cat, score in sorted_categories]
         
-        # Determine primary and secondary categories
-        primary_category = all_categories[0] if all_categories else "General Feedback"
-        secondary_category = all_categories[1] if len(all_categories) > 1 else None
+        # Find the aspects each sentence mentions with one matcher pass per sentence
+        sentence_aspects = [KEYWORD_MATCHER.match(sentence_lower, ("aspects",))["aspects"]
+                            for sentence_lower in sentences_lower]
         
-        # Add result
-        results.append({
-            "text": text,
-            "primary_category": primary_category,
-            "secondary_category": secondary_category,
-            "categories": all_categories,
-            "category_scores": category_scores
-        })
+        # Check each aspect in each sentence
+        for aspect_index, aspect in enumerate(aspects):
+            for sentence_index, (sentence, mentioned) in enumerate(zip(sentences, sentence_aspects)):
+                # Check if any aspect keyword is in the sentence
+                if aspect in mentioned:
+                    mention_rows.append(row)
+                    mention_aspects.append(aspect_index)
+                    mention_sentences.append(sentence_index)
+                    mentioned_sentences.append(sentence)
+                    break  # Count each aspect only once per sentence
     
-    return results
+    # Analyze sentiment of the mentioned sentences (shared, memoized scorer,
+    # or one batch for the block)
+    for compound in sentiment_service.vader_compounds(mentioned_sentences, engine):
+        mention_labels.append(SENTIMENT_LABELS.index(sentiment_service.vader_label(compound)))
+        mention_scores.append(compound)
+    return found
 
-def analyze_aspect_sentiment(feedback_texts):
+
+def summarize_aspects(results):
+    """
+    Add sentiment percentages, net sentiment and sorted_aspects to aspect tallies.
+    
+    Args:
+        results: Dict with "aspect_sentiments" (positive/neutral/negative/total
+            counts per aspect) and "aspect_mentions"; updated in place
+    """
+    # Calculate sentiment percentages for each aspect
+    for aspect, counts in results["aspect_sentiments"].items():
+        total = counts["total"]
+        if total > 0:
+            counts["positive_pct"] = round((counts["positive"] / total) * 100)
+            counts["neutral_pct"] = round((counts["neutral"] / total) * 100)
+            counts["negative_pct"] = round((counts["negative"] / total) * 100)
+            # Calculate net sentiment (-100 to 100 scale)
+            counts["net_sentiment"] = round(((counts["positive"] - counts["negative"]) / total) * 100)
+        else:
+            counts["positive_pct"] = 0
+            counts["neutral_pct"] = 0
+            counts["negative_pct"] = 0
+            counts["net_sentiment"] = 0
+    
+    # Sort aspects by mention count for presentation
+    results["sorted_aspects"] = sorted(
+        results["aspect_sentiments"].keys(),
+        key=lambda x: results["aspect_mentions"][x],
+        reverse=True
+    )
+
+
+def analyze_aspect_sentiment(feedback_texts, mentions=None, engine="exact"):
     """
     Extract sentiment related to specific aspects in customer feedback.
     
+    Each distinct text is scored once, in row blocks on the text scoring pool
+    for large inputs; its mentions are then repeated for every row with that
+    text, in row order, so the result (samples included) is the same as a
+    serial pass over every row.
+    
     Args:
-        feedback_texts: List of feedback text strings
+        feedback_texts: List of feedback text strings, or a FeedbackCorpus
+            whose sentence split is reused
+        mentions: Optional dict that receives one entry per aspect mention as
+            numpy arrays "rows" (corpus row position), "aspects" (index into
+            ASPECT_KEYWORDS) and "labels" (index into SENTIMENT_LABELS)
+        engine: VADER engine for the mentioned sentences, one of
+            sentiment_service.ENGINES
         
     Returns:
         Dictionary with aspect-based sentiment analysis results
     """
-    import re
-    from nltk.sentiment import SentimentIntensityAnalyzer
-    
-    # Define common aspects for retail/product feedback
-    aspects = {
-        "product": ["product", "item", "quality", "material", "fabric"],
-        "price": ["price", "cost", "expensive", "cheap", "value", "worth", "affordable"],
-        "service": ["service", "staff", "support", "representative", "helpful", "assistance"],
-        "delivery": ["delivery", "shipping", "arrive", "arrived", "package", "shipment"],
-        "website": ["website", "app", "online", "site", "checkout", "cart"],
-        "returns": ["return", "refund", "exchange", "policy"]
-    }
+    aspects = ASPECT_KEYWORDS
     
     # Initialize results structure
     results = {
@@ -112,76 +338,66 @@ def analyze_aspect_sentiment(feedback_texts):
     }
     
     try:
-        # Initialize sentiment analyzer
-        sid = SentimentIntensityAnalyzer()
+        corpus = as_corpus(feedback_texts)
+        frame = corpus.frame
+        first, inverse = corpus.unique()
+        sentences = frame["sentences"].to_numpy()[first]
+        blocks = text_scoring.map_blocks(_aspect_block, (frame["text"].to_numpy()[first], sentences,
+                                                         frame["sentences_lower"].to_numpy()[first]),
+                                         (engine,))
         
-        # Process each feedback text
-        for text in feedback_texts:
-            if not isinstance(text, str) or len(text) < 5:
-                continue
-                
-            # Convert to lowercase for analysis
-            text_lower = text.lower()
-            
-            # Split into sentences for more accurate aspect-level sentiment
-            sentences = re.split(r'(?<=[.!?])\s+', text)
+        # Mentions of the distinct texts, in order (block rows offset to distinct positions)
+        offset = 0
+        parts = []
+        for found in blocks:
+            block_rows, block_aspects, block_labels, block_sentences, block_scores = found["mentions"]
+            parts.append((np.asarray(block_rows, dtype=np.int64) + offset,
+                          np.asarray(block_aspects, dtype=np.int8),
+                          np.asarray(block_labels, dtype=np.int8),
+                          np.asarray(block_sentences, dtype=np.int64),
+                          np.asarray(block_scores, dtype=float)))
+            offset += found["rows"]
+        distinct_rows, distinct_aspects, distinct_labels, distinct_sentences, distinct_scores = (
+            np.concatenate(column) for column in zip(*parts))
+        
+        # Repeat each distinct text's mentions for every row with that text:
+        # row r takes the slice ptr[inverse[r]]:ptr[inverse[r] + 1]
+        per_text = np.bincount(distinct_rows, minlength=len(first))
+        ptr = np.concatenate([[0], np.cumsum(per_text)])
+        lengths = per_text[inverse]
+        starts = np.cumsum(lengths) - lengths
+        picks = (np.repeat(ptr[:-1][inverse] - starts, lengths) + np.arange(lengths.sum())).astype(np.int64)
+        picked_aspects = distinct_aspects[picks]
+        picked_labels = distinct_labels[picks]
+        
+        # Tallies (as codes aspect * 3 + label)
+        tallies = np.bincount(picked_aspects.astype(np.int64) * len(SENTIMENT_LABELS) + picked_labels,
+                              minlength=len(aspects) * len(SENTIMENT_LABELS)).reshape(len(aspects), -1)
+        for aspect_index, aspect in enumerate(aspects):
+            counts = results["aspect_sentiments"][aspect]
+            for label_index, label in enumerate(SENTIMENT_LABELS):
+                counts[label] = int(tallies[aspect_index, label_index])
+            counts["total"] = int(tallies[aspect_index].sum())
+            results["aspect_mentions"][aspect] = counts["total"]
             
-            # Check each aspect in each sentence
-            for aspect, keywords in aspects.items():
-                for sentence in sentences:
-                    # Check if any aspect keyword is in the sentence
-                    if any(keyword in sentence.lower() for keyword in keywords):
-                        # Analyze sentiment of this sentence
-                        sentiment = sid.polarity_scores(sentence)
-                        
-                        # Classify sentiment
-                        if sentiment['compound'] >= 0.05:
-                            sentiment_category = "positive"
-                        elif sentiment['compound'] <= -0.05:
-                            sentiment_category = "negative"
-                        else:
-                            sentiment_category = "neutral"
-                        
-                        # Update counts
-                        results["aspect_mentions"][aspect] += 1
-                        results["aspect_sentiments"][aspect][sentiment_category] += 1
-                        results["aspect_sentiments"][aspect]["total"] += 1
-                        
-                        # Store sample (up to 3 per aspect)
-                        if len(results["samples"][aspect]) < 3:
-                            results["samples"][aspect].append({
-                                "text": sentence,
-                                "sentiment": sentiment_category,
-                                "score": sentiment['compound']
-                            })
-                        break  # Count each aspect only once per sentence
+            # Samples: the first 3 mentions of the aspect in row order
+            for pick in picks[picked_aspects == aspect_index][:3]:
+                results["samples"][aspect].append({
+                    "text": sentences[distinct_rows[pick]][distinct_sentences[pick]],
+                    "sentiment": SENTIMENT_LABELS[distinct_labels[pick]],
+                    "score": float(distinct_scores[pick])
+                })
         
-        # Calculate sentiment percentages for each aspect
-        for aspect, counts in results["aspect_sentiments"].items():
-            total = counts["total"]
-            if total > 0:
-                results["aspect_sentiments"][aspect]["positive_pct"] = round((counts["positive"] / total) * 100)
-                results["aspect_sentiments"][aspect]["neutral_pct"] = round((counts["neutral"] / total) * 100)
-                results["aspect_sentiments"][aspect]["negative_pct"] = round((counts["negative"] / total) * 100)
-                # Calculate net sentiment (-100 to 100 scale)
-                results["aspect_sentiments"][aspect]["net_sentiment"] = round(
-                    ((counts["positive"] - counts["negative"]) / total) * 100
-                )
-            else:
-                results["aspect_sentiments"][aspect]["positive_pct"] = 0
-                results["aspect_sentiments"][aspect]["neutral_pct"] = 0
-                results["aspect_sentiments"][aspect]["negative_pct"] = 0
-                results["aspect_sentiments"][aspect]["net_sentiment"] = 0
+        if mentions is not None:
+            mentions["rows"] = np.repeat(np.arange(len(inverse), dtype=np.int64), lengths)
+            mentions["aspects"] = picked_aspects
+            mentions["labels"] = picked_labels
         
-        # Sort aspects by mention count for presentation
-        results["sorted_aspects"] = sorted(
-            aspects.keys(), 
-            key=lambda x: results["aspect_mentions"][x], 
-            reverse=True
-        )
+        summarize_aspects(results)
         
     except Exception as e:
         print(f"Error in aspect-based sentiment analysis: {str(e)}")
+        metrics.report_fallback(str(e))
     
     return results
 
@@ -0,0 +1,34 @@
+# file_lock.py
+#
+# Exclusive inter-process lock on a file next to shared on-disk state (the
+# persisted topic model, the response store), so concurrent worker processes
+# serialize their read-modify-write cycles.
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms run without the lock
+    fcntl = None
+
+
+class FileLock:
+    """
+    Exclusive lock held for the duration of a with-block.
+
+    Args:
+        path: Path of the protected file or directory; the lock file is
+            path + ".lock"
+    """
+
+    def __init__(self, path):
+        self.path = path + ".lock"
+        self.handle = None
+
+    def __enter__(self):
+        self.handle = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+        self.handle.close()
@@ -0,0 +1,93 @@
+# heavy_hitters.py
+#
+# Bounded-memory frequent-item counting: the Misra-Gries summary, the
+# mergeable counterpart of Space-Saving. A sketch holds at most a budget of
+# counters. While fewer distinct items than that have been seen it is an exact
+# Counter; past the budget every counter is lowered by the same amount to make
+# room, so reported counts undercount by at most `error`, which never exceeds
+# (total - stored) / (capacity + 1). Every item whose true count is above
+# `error` is still tracked. Sketches built on separate chunks, shards or
+# workers merge into one with the same guarantee.
+from collections import Counter
+
+import numpy as np
+
+import config
+
+
+class HeavyHitters:
+    """
+    Top-k counter with a fixed memory budget.
+
+    Args:
+        capacity: Counters kept after a reduction (defaults to
+            config.KEYWORD_SKETCH_SIZE); up to twice as many are buffered
+            between reductions
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = max(capacity or config.KEYWORD_SKETCH_SIZE, 1)
+        self.counts = Counter()
+        # Items counted, and the most any stored count falls short by
+        self.total = 0
+        self.error = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    @property
+    def exact(self):
+        """Whether no counts have been dropped (every count is exact)."""
+        return self.error == 0
+
+    def update(self, items, weight=1):
+        """Count every item of a sequence weight times (once by default)."""
+        if weight == 1:
+            self.counts.update(items)
+        else:
+            counts = self.counts
+            for item in items:
+                counts[item] += weight
+        self.total += len(items) * weight
+        self._maybe_reduce()
+
+    def merge(self, other):
+        """
+        Fold another sketch (e.g. from a different chunk or worker) into this one.
+
+        Args:
+            other: HeavyHitters over disjoint input
+        """
+        self.counts.update(other.counts)
+        self.total += other.total
+        self.error += other.error
+        self._maybe_reduce()
+
+    def _maybe_reduce(self):
+        # Buffering up to twice the budget keeps reductions rare
+        if len(self.counts) > 2 * self.capacity:
+            self._reduce()
+
+    def _reduce(self):
+        # Lower every counter by the (capacity + 1)-th largest count, which
+        # leaves at most `capacity` positive counters
+        values = np.fromiter(self.counts.values(), dtype=np.int64, count=len(self.counts))
+        threshold = int(np.partition(values, -(self.capacity + 1))[-(self.capacity + 1)])
+        self.counts = Counter({item: count - threshold for item, count in self.counts.items() if count > threshold})
+        self.error += threshold
+
+    def most_common(self, n):
+        """
+        The n items with the highest counts, like Counter.most_common (ties
+        keep first-seen order while the sketch is exact).
+
+        Returns:
+            List of (item, count) pairs; each count is a lower bound on the
+            true count and at most `error` below it
+        """
+        return self.counts.most_common(n)
+
+    def bounds(self, item):
+        """(lower, upper) bounds on the true count of item."""
+        count = self.counts.get(item, 0)
+        return count, count + self.error
@@ -0,0 +1,367 @@
+# ingestion.py
+#
+# Streaming CSV ingestion for NPS exports. Uploads are parsed in fixed-size
+# chunks and folded into the score, keyword and trend accumulators one chunk
+# at a time. The projected rows and the feedback corpus are only kept when a
+# stage reads them, so a scores-only analysis holds one chunk at a time and
+# its peak memory is bounded by the chunk size rather than the file size.
+# Columns are detected from the header alone and only those are parsed, so
+# exports with many unrelated columns cost no more than narrow ones.
+import codecs
+import re
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # pragma: no cover - the pandas parser is used instead
+    pa = pa_csv = None
+
+import config
+from accumulators import ScoreAccumulator, KeywordAccumulator, SEGMENT_BY_CODE, score_codes
+from text_corpus import FeedbackCorpus
+from trends import MISSING_DAY, TrendBuckets, response_days
+
+FALLBACK_ENCODING = 'cp1252'
+
+# Header words (lowercased, split on anything but letters and digits) that mark
+# a response-date column; whole words only, so "Candidate" or "Validated" do not
+DATE_COLUMN_WORDS = {"date", "datetime", "timestamp", "submitted"}
+
+# Rows read from the top of the file to choose between several date columns
+DATE_SNIFF_ROWS = 200
+
+# Header names (lowercased, "_"/"-" read as spaces) of a per-response id column
+ID_COLUMN_NAMES = {"id", "response id", "responseid", "respondent id", "respondentid", "submission id",
+                   "submissionid", "record id"}
+
+
+def detect_encoding(prefix):
+    """
+    Pick the text encoding of an upload from its first bytes.
+
+    Args:
+        prefix: Leading bytes of the file
+
+    Returns:
+        'utf-8' if the prefix is valid UTF-8, otherwise the cp1252 fallback
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        # final=False tolerates a multi-byte character cut off at the end of the prefix
+        decoder.decode(prefix, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING
+
+
+def date_columns(columns):
+    """Column names that look like a response date, in header order."""
+    return [col for col in columns if DATE_COLUMN_WORDS & set(re.findall(r"[a-z0-9]+", col.lower()))]
+
+
+def find_columns(columns, overrides=None):
+    """
+    Detect the score, location, feedback, response-date and response-id columns from the column names.
+
+    Args:
+        columns: Iterable of column names from the CSV header
+        overrides: Optional dict of "score"/"location"/"feedback"/"date"/"id"
+            -> column name, used instead of the name heuristics for those roles
+
+    Returns:
+        Tuple of (score_col, location_col, feedback_col, date_col, id_col);
+        missing columns are None
+
+    Raises:
+        ValueError: When an override names a column the header does not have
+    """
+    columns = list(columns)
+    score_col = next((col for col in columns if 'recommend' in col.lower() or 'likely' in col.lower()), None)
+    location_col = next((col for col in columns if 'area' in col.lower() or 'manager' in col.lower()), None)
+    feedback_col = next((col for col in columns if 'suggest' in col.lower() or 'improve' in col.lower()), None)
+    date_col = next(iter(date_columns(columns)), None)
+    id_col = next((col for col in columns
+                   if " ".join(col.lower().replace("_", " ").replace("-", " ").split()) in ID_COLUMN_NAMES), None)
+
+    overrides = overrides or {}
+    for name in overrides.values():
+        if name not in columns:
+            raise ValueError(f"Column '{name}' not found in the CSV header")
+    return (overrides.get("score", score_col), overrides.get("location", location_col),
+            overrides.get("feedback", feedback_col), overrides.get("date", date_col), overrides.get("id", id_col))
+
+
+class IngestResult:
+    """Everything the analysis needs from one pass over the uploaded CSV."""
+
+    def __init__(self):
+        self.columns = []
+        self.score_col = None
+        self.location_col = None
+        self.feedback_col = None
+        self.date_col = None
+        # Source response id, kept as text for the response store's dedup key
+        self.id_col = None
+        self.rows_read = 0
+        # Valid-score rows, projected down to the score/location/feedback/date/id
+        # columns (None unless the rows were kept, see read_nps_csv)
+        self.df = None
+        # int8 score codes aligned with df (see accumulators.score_codes)
+        self.score_codes = None
+        # Day numbers aligned with df (see trends.response_days), with a date column
+        self.response_days = None
+        self.scores = None
+        # Per-day TrendBuckets (None without a date column)
+        self.trends = None
+        self.keywords = None
+        # Shared FeedbackCorpus for the text stages (None without a feedback column)
+        self.corpus = None
+
+
+def _typed_locations(locations):
+    """
+    Give a chunk's text-categorical locations numeric categories when every
+    one is a number, so numeric location ids (store numbers) sort and
+    serialize as numbers, as the pandas parser would infer them.
+    """
+    categories = locations.cat.categories
+    numbers = pd.to_numeric(categories, errors="coerce")
+    if len(categories) == 0 or numbers.isna().any() or numbers.has_duplicates:
+        return locations
+    return locations.cat.rename_categories(numbers)
+
+
+def _compact_scores(chunk, score_col):
+    """
+    The chunk with in-range scores as int8 when they are all whole numbers
+    (the usual 0-10 export); fractional scores keep their float type.
+    """
+    scores = chunk[score_col]
+    if len(scores) and (scores % 1 == 0).all():
+        return chunk.astype({score_col: np.int8})
+    return chunk
+
+
+def read_header(fileobj, encoding):
+    """Column names from the header row alone; leaves fileobj at the start."""
+    fileobj.seek(0)
+    columns = pd.read_csv(fileobj, encoding=encoding, nrows=0).columns.tolist()
+    fileobj.seek(0)
+    return columns
+
+
+def pick_date_column(fileobj, encoding, candidates):
+    """
+    The candidate date column whose leading values parse as dates most often.
+
+    Args:
+        fileobj: Seekable binary file object; left at the start
+        encoding: Text encoding of the file
+        candidates: Column names from date_columns(), in header order
+
+    Returns:
+        Column name (the first candidate on ties, or when none parse)
+    """
+    fileobj.seek(0)
+    try:
+        sample = pd.read_csv(fileobj, encoding=encoding, nrows=DATE_SNIFF_ROWS, usecols=candidates, dtype=str)
+    except (ValueError, UnicodeDecodeError):
+        return candidates[0]
+    finally:
+        fileobj.seek(0)
+    parsed = [int((response_days(sample[col]) != MISSING_DAY).sum()) for col in candidates]
+    return candidates[parsed.index(max(parsed))]
+
+
+def _pandas_chunks(fileobj, encoding, chunksize, usecols, dtype):
+    reader = pd.read_csv(fileobj, encoding=encoding, chunksize=chunksize, usecols=usecols, dtype=dtype)
+    with reader:
+        yield from reader
+
+
+def _pyarrow_chunks(fileobj, encoding, chunksize, usecols, location_col, feedback_col, id_col):
+    # pandas' default NA markers, so both engines agree on what is missing
+    null_values = pa_csv.ConvertOptions().null_values + ["<NA>", "None"]
+    column_types = {}
+    if location_col:
+        column_types[location_col] = pa.dictionary(pa.int32(), pa.string())
+    if feedback_col:
+        column_types[feedback_col] = pa.string()
+    if id_col:
+        column_types[id_col] = pa.string()
+    reader = pa_csv.open_csv(
+        fileobj,
+        read_options=pa_csv.ReadOptions(encoding=encoding),
+        convert_options=pa_csv.ConvertOptions(include_columns=usecols, column_types=column_types,
+                                              null_values=null_values, strings_can_be_null=True),
+    )
+    # Regroup the parser's blocks into chunks of about chunksize rows,
+    # numbered like the pandas parser numbers them
+    offset = 0
+    batches = []
+    rows = 0
+    for batch in reader:
+        batches.append(batch)
+        rows += batch.num_rows
+        if rows >= chunksize:
+            chunk = pa.Table.from_batches(batches).to_pandas()
+            chunk.index = pd.RangeIndex(offset, offset + rows)
+            offset += rows
+            batches, rows = [], 0
+            yield chunk
+    if rows:
+        chunk = pa.Table.from_batches(batches).to_pandas()
+        chunk.index = pd.RangeIndex(offset, offset + rows)
+        yield chunk
+
+
+def _stream(fileobj, encoding, chunksize, on_chunk, corpus, tokenize, overrides, engine, keep_rows):
+    result = IngestResult()
+    result.columns = read_header(fileobj, encoding)
+    (result.score_col, result.location_col, result.feedback_col, result.date_col,
+     result.id_col) = find_columns(result.columns, overrides)
+    candidates = date_columns(result.columns)
+    if len(candidates) > 1 and "date" not in (overrides or {}):
+        result.date_col = pick_date_column(fileobj, encoding, candidates)
+    if not result.score_col:
+        return result
+    result.scores = ScoreAccumulator()
+    if result.date_col:
+        result.trends = TrendBuckets()
+    if corpus and tokenize:
+        result.keywords = KeywordAccumulator()
+
+    # Only the detected columns are parsed. Scores are parsed with the
+    # parser's inferred type, since a typed column would reject stray text
+    # that to_numeric below coerces away, then narrowed to int8 once in
+    # range (see _compact_scores); locations are categorical,
+    # feedback and ids are text and dates are parsed per chunk (see
+    # trends.response_days)
+    used = list(dict.fromkeys(col for col in (result.score_col, result.location_col, result.feedback_col,
+                                              result.date_col, result.id_col) if col))
+    if engine == "pyarrow":
+        chunks = _pyarrow_chunks(fileobj, encoding, chunksize, used, result.location_col, result.feedback_col,
+                                 result.id_col)
+    else:
+        dtype = {}
+        if result.location_col:
+            dtype[result.location_col] = "category"
+        if result.feedback_col:
+            dtype[result.feedback_col] = str
+        if result.id_col:
+            dtype[result.id_col] = str
+        chunks = _pandas_chunks(fileobj, encoding, chunksize, used, dtype)
+
+    kept = []
+    kept_codes = []
+    kept_days = []
+    corpora = []
+    for chunk in chunks:
+        result.rows_read += len(chunk)
+        chunk = chunk[used].copy()
+        if result.location_col:
+            chunk[result.location_col] = _typed_locations(chunk[result.location_col])
+
+        # Clean and convert scores to numbers
+        chunk[result.score_col] = pd.to_numeric(chunk[result.score_col], errors='coerce')
+        chunk = chunk[(chunk[result.score_col] >= 0) & (chunk[result.score_col] <= 10)]
+        chunk = _compact_scores(chunk, result.score_col)
+
+        # One small integer code per row drives every segment count downstream
+        codes = score_codes(chunk[result.score_col])
+        result.scores.add_chunk(codes, chunk[result.location_col] if result.location_col else None)
+        if result.trends is not None:
+            days = response_days(chunk[result.date_col])
+            result.trends.add(days, codes, chunk[result.location_col] if result.location_col else None)
+            if keep_rows:
+                kept_days.append(days)
+        if result.feedback_col and corpus:
+            # Tokenize and sentence-split each feedback row once, here
+            segments = pd.Series(SEGMENT_BY_CODE[codes], index=chunk.index)
+            chunk_corpus = FeedbackCorpus.from_series(chunk[result.feedback_col], segments, tokenize=tokenize)
+            if result.keywords is not None:
+                result.keywords.add_corpus(chunk_corpus)
+            corpora.append(chunk_corpus)
+
+        # Otherwise the chunk is fully folded into the accumulators and dropped
+        if keep_rows:
+            kept.append(chunk)
+            kept_codes.append(codes)
+        if on_chunk is not None:
+            on_chunk(result.rows_read)
+
+    if kept:
+        result.df = pd.concat(kept)
+        result.score_codes = np.concatenate(kept_codes)
+        if kept_days:
+            result.response_days = np.concatenate(kept_days)
+        if result.location_col:
+            # Chunks have their own categories; concat would fall back to object.
+            # Chunks whose categories were typed differently are unioned as objects
+            parts = [chunk[result.location_col] for chunk in kept]
+            if len({part.cat.categories.dtype for part in parts}) > 1:
+                parts = [part.cat.rename_categories(part.cat.categories.astype(object)) for part in parts]
+            locations = union_categoricals(parts)
+            result.df[result.location_col] = pd.Series(locations, index=result.df.index)
+    if result.feedback_col and corpus:
+        result.corpus = FeedbackCorpus.concat(corpora)
+    return result
+
+
+def read_nps_csv(fileobj, chunksize=None, on_chunk=None, corpus=True, tokenize=True, columns=None, engine=None,
+                 rows=True):
+    """
+    Stream an NPS export through the chunk accumulators.
+
+    The header is read first and only the detected columns are parsed. The
+    encoding is sniffed from a small prefix. If a later chunk turns out not
+    to be UTF-8 the stream is restarted once with the cp1252 fallback; if
+    the pyarrow parser rejects the file it is re-read with the pandas one.
+
+    Args:
+        fileobj: Seekable binary file object positioned anywhere
+        chunksize: Rows per chunk (defaults to config.CSV_CHUNK_SIZE)
+        on_chunk: Optional callable receiving the running row count after each chunk
+        corpus: Whether to build the FeedbackCorpus; without it only the
+            score accumulators run and result.corpus stays None
+        tokenize: Whether to compute keyword tokens and counts (result.keywords
+            is None without them)
+        columns: Optional column overrides for find_columns()
+        engine: "pyarrow" or "c" (defaults to config.CSV_ENGINE; pyarrow
+            falls back to "c" when it is not installed)
+        rows: Whether to keep the projected rows (result.df, score_codes and
+            response_days); without them each chunk is dropped once folded
+            into the accumulators
+
+    Returns:
+        IngestResult with the detected columns, accumulators and, if kept, the projected rows
+    """
+    chunksize = chunksize or config.CSV_CHUNK_SIZE
+    engine = engine or config.CSV_ENGINE
+    if engine == "pyarrow" and pa_csv is None:
+        engine = "c"
+
+    fileobj.seek(0)
+    encoding = detect_encoding(fileobj.read(config.ENCODING_SNIFF_BYTES))
+    fileobj.seek(0)
+
+    while True:
+        if engine == "pyarrow":
+            try:
+                return _stream(fileobj, encoding, chunksize, on_chunk, corpus, tokenize, columns, engine, rows)
+            except (pa.ArrowException, UnicodeDecodeError) as e:
+                # The pandas parser has the final say (and triggers the encoding fallback)
+                print(f"pyarrow could not parse the upload ({str(e)}), retrying with the pandas parser")
+                fileobj.seek(0)
+        try:
+            return _stream(fileobj, encoding, chunksize, on_chunk, corpus, tokenize, columns, "c", rows)
+        except UnicodeDecodeError:
+            if encoding == FALLBACK_ENCODING:
+                raise
+            print(f"Input is not valid {encoding} past the sniffed prefix, retrying with {FALLBACK_ENCODING}")
+            encoding = FALLBACK_ENCODING
+            fileobj.seek(0)
@@ -0,0 +1,280 @@
+# jobs.py
+#
+# Background analysis jobs. POST /jobs answers immediately with a job id while
+# the analysis runs on the worker pool. The analysis reports stage events
+# through a queue (a multiprocessing.Manager queue when workers are separate
+# processes); a relay thread feeds them into each job's event log, which
+# /jobs/{id}/events streams as server-sent events. Finished jobs, results
+# included, are dropped once they are older than the configured TTL.
+import asyncio
+import json
+import queue
+import threading
+import time
+import uuid
+
+from analysis import AnalysisCancelled, AnalysisError
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+class JobQueueFull(Exception):
+    """Raised when too many jobs are already waiting for a slot."""
+
+
+class ProgressReporter:
+    """
+    Picklable progress listener handed to run_analysis() for one job.
+
+    Forwards stage events to the relay queue, and raises AnalysisCancelled at
+    the next event once the job has been cancelled.
+    """
+
+    def __init__(self, job_id, events, cancelled):
+        self.job_id = job_id
+        self.events = events
+        self.cancelled = cancelled
+
+    def __call__(self, event):
+        if self.cancelled.get(self.job_id):
+            raise AnalysisCancelled(self.job_id)
+        self.events.put((self.job_id, event))
+
+
+class Job:
+    """State and event log of one background analysis."""
+
+    def __init__(self, job_id, filename):
+        self.id = job_id
+        self.filename = filename
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.events = []
+        self.task = None
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self):
+        return self.status in TERMINAL_STATUSES
+
+    def publish(self, event):
+        """Append an event to the log and wake up every stream waiting on it."""
+        self.events.append({"seq": len(self.events), "time": round(time.time(), 3), **event})
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def set_status(self, status, **details):
+        self.status = status
+        if status == "running":
+            self.started_at = time.time()
+        elif status in TERMINAL_STATUSES:
+            self.finished_at = time.time()
+        self.publish({"type": "status", "status": status, **details})
+
+    def progress(self):
+        """The latest stage the analysis reported, with its row count."""
+        for event in reversed(self.events):
+            if event["type"] in ("stage_started", "progress", "stage_completed"):
+                return {key: event[key] for key in ("type", "stage", "rows") if key in event}
+        return None
+
+    def describe(self):
+        """Status document for GET /jobs/{id}; includes the payload once completed."""
+        body = {
+            "id": self.id,
+            "status": self.status,
+            "filename": self.filename,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.progress(),
+        }
+        if self.error:
+            body["error"] = self.error
+        if self.status == "completed":
+            body["result"] = self.result
+        return body
+
+    async def stream(self, after=-1, heartbeat=15):
+        """
+        Yield the event log as server-sent events until the job finishes.
+
+        Args:
+            after: Last event sequence number the client already has
+            heartbeat: Seconds between keep-alive comments while idle
+        """
+        sent = after + 1
+        while True:
+            # Grab the wake-up event before reading the log so nothing is missed
+            changed = self._changed
+            while sent < len(self.events):
+                event = self.events[sent]
+                yield f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+                sent += 1
+            if self.finished:
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+
+
+class JobManager:
+    """
+    Runs jobs with bounded concurrency and keeps them until their TTL expires.
+
+    Args:
+        concurrency: Jobs allowed to run at the same time
+        queue_size: Jobs allowed to wait for a slot before submit() refuses more
+        ttl_seconds: How long finished jobs and their results are kept
+    """
+
+    def __init__(self, concurrency, queue_size, ttl_seconds):
+        self.queue_size = queue_size
+        self.ttl_seconds = ttl_seconds
+        self._jobs = {}
+        self._slots = asyncio.Semaphore(max(concurrency, 1))
+        self._events = None
+        self._cancelled = None
+        self._manager = None
+        self._loop = None
+
+    def _open_channel(self, process_pool):
+        """Create the event queue, cancel flags and relay thread on first use."""
+        if self._events is not None:
+            return
+        if process_pool:
+            # Proxies to a manager process can be pickled into pool tasks
+            import multiprocessing
+            self._manager = multiprocessing.Manager()
+            self._events = self._manager.Queue()
+            self._cancelled = self._manager.dict()
+        else:
+            self._events = queue.Queue()
+            self._cancelled = {}
+        self._loop = asyncio.get_running_loop()
+        threading.Thread(target=self._relay_events, daemon=True).start()
+
+    def _relay_events(self):
+        events = self._events
+        while True:
+            try:
+                item = events.get()
+            except (EOFError, OSError):
+                # The manager process went away during shutdown
+                return
+            if item is None:
+                return
+            job_id, event = item
+            self._loop.call_soon_threadsafe(self._deliver, job_id, event)
+
+    def _deliver(self, job_id, event):
+        job = self._jobs.get(job_id)
+        # Events relayed after the final status are already in its timings
+        if job is not None and not job.finished:
+            job.publish(event)
+
+    def submit(self, filename, runner, process_pool, cleanup=None):
+        """
+        Queue a job.
+
+        Args:
+            filename: Upload name, for display
+            runner: Coroutine function taking a ProgressReporter and returning
+                (result payload, dict of details for the "completed" event)
+            process_pool: Whether the runner hands the reporter to another process
+            cleanup: Optional callable run once the job is done, however it ends
+
+        Returns:
+            The new Job
+
+        Raises:
+            JobQueueFull: When queue_size jobs are already waiting
+        """
+        self.purge()
+        waiting = sum(1 for job in self._jobs.values() if job.status == "queued")
+        if waiting >= self.queue_size:
+            raise JobQueueFull()
+
+        self._open_channel(process_pool)
+        job = Job(uuid.uuid4().hex, filename)
+        self._jobs[job.id] = job
+        job.set_status("queued")
+        job.task = asyncio.get_running_loop().create_task(self._run(job, runner))
+        if cleanup is not None:
+            # A done callback also runs for tasks cancelled before they started
+            job.task.add_done_callback(lambda _: cleanup())
+        return job
+
+    async def _run(self, job, runner):
+        try:
+            async with self._slots:
+                job.set_status("running")
+                job.result, details = await runner(ProgressReporter(job.id, self._events, self._cancelled))
+            job.set_status("completed", **details)
+        except (AnalysisCancelled, asyncio.CancelledError):
+            if not job.finished:
+                job.set_status("cancelled")
+        except AnalysisError as e:
+            job.error = {"status_code": e.status_code, "detail": e.detail}
+            job.set_status("failed", **job.error)
+        except Exception as e:
+            job.error = {"status_code": 500, "detail": f"Error processing file: {str(e)}"}
+            job.set_status("failed", **job.error)
+        finally:
+            self._cancelled.pop(job.id, None)
+
+    def get(self, job_id):
+        self.purge()
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancel a job. Queued jobs stop immediately; running ones at the next
+        stage boundary or parsed chunk.
+
+        Returns:
+            The Job, or None if it does not exist
+        """
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return job
+        if job.status == "queued":
+            job.task.cancel()
+            job.set_status("cancelled")
+        else:
+            self._cancelled[job.id] = True
+            job.publish({"type": "cancel_requested"})
+        return job
+
+    def purge(self):
+        """Drop finished jobs older than the TTL."""
+        cutoff = time.time() - self.ttl_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self):
+        """Number of retained jobs in each status (zero for unused statuses)."""
+        self.purge()
+        counts = dict.fromkeys(("queued", "running") + TERMINAL_STATUSES, 0)
+        for job in self._jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def shutdown(self):
+        for job in self._jobs.values():
+            if job.task is not None and not job.task.done():
+                job.task.cancel()
+        if self._events is not None:
+            try:
+                self._events.put(None)
+            except (EOFError, OSError):
+                pass
+        if self._manager is not None:
+            self._manager.shutdown()
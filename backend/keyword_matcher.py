@@ -0,0 +1,98 @@
+# keyword_matcher.py
+#
+# Multi-table keyword matching in one pass over the text. All keyword tables
+# (categories, aspects, emotions) are compiled into a single trie-shaped regex,
+# so per-text cost depends on the text length rather than on how many keywords
+# the tables hold. Matching keeps the original `keyword in text` substring
+# semantics: "frustrat" matches "frustrated" and "app" matches "happy".
+import re
+
+
+def _trie_regex(words):
+    """Build a regex alternation shaped like a trie of the given words."""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = True
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch != '']
+        if not branches:
+            return ''
+        body = '|'.join(branches)
+        if '' in node:
+            # Greedy optional group: prefer the longer keyword at this position
+            return f'(?:{body})?'
+        return f'(?:{body})' if len(branches) > 1 else body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """
+    Compiled matcher over named keyword tables.
+
+    Args:
+        tables: Dict of table name -> {label: [keywords]}; keywords must be lowercase
+    """
+
+    def __init__(self, tables):
+        self.labels = {table: list(labels) for table, labels in tables.items()}
+
+        # keyword -> [(table, label), ...], one entry per occurrence in the tables
+        self._owners = {}
+        for table, labels in tables.items():
+            for label, keywords in labels.items():
+                for keyword in keywords:
+                    self._owners.setdefault(keyword, []).append((table, label))
+
+        # All keywords that match at a position are prefixes of the longest
+        # one there, so each longest match expands to its prefix keywords
+        keywords = sorted(self._owners)
+        self._prefixes = {
+            keyword: [other for other in keywords if keyword.startswith(other)]
+            for keyword in keywords
+        }
+
+        # A zero-width lookahead finds the longest keyword at every position,
+        # including positions inside other matches
+        self._pattern = re.compile('(?=(' + _trie_regex(keywords) + '))')
+
+    def matched_keywords(self, text):
+        """Set of keywords occurring anywhere in text (as substrings)."""
+        found = set()
+        for match in self._pattern.finditer(text):
+            longest = match.group(1)
+            if longest not in found:
+                found.update(self._prefixes[longest])
+        return found
+
+    def match(self, text, tables=None):
+        """
+        Count keyword hits per (table, label) in one pass.
+
+        Args:
+            text: Lowercased text to scan
+            tables: Optional iterable of table names to report (default: all)
+
+        Returns:
+            Dict of table -> {label: number of distinct matching keywords},
+            with labels in table order and only labels that matched
+        """
+        tables = self.labels if tables is None else tables
+        counts = {table: {} for table in tables}
+        if not text:
+            return counts
+
+        for keyword in self.matched_keywords(text):
+            for table, label in self._owners[keyword]:
+                if table in counts:
+                    counts[table][label] = counts[table].get(label, 0) + 1
+
+        # Re-emit in table order so callers see labels as they were defined
+        return {
+            table: {label: hits[label] for label in self.labels[table] if label in hits}
+            for table, hits in counts.items()
+        }
@@ -1,20 +1,30 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import Depends, FastAPI, UploadFile, File, Header, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-import pandas as pd
-import numpy as np
-import io
-from collections import Counter
-import nltk
-from nltk.sentiment import SentimentIntensityAnalyzer
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-import traceback
-# New imports for topic modeling and advanced sentiment
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.decomposition import LatentDirichletAllocation
-from textblob import TextBlob
-# Import the new feedback analysis module
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+import config
+import metrics
+import nlp_resources
+import serialization
+# The analysis pipeline runs in worker processes (see analysis.py)
+import analysis
 import feedback_analysis
+import response_store
+import sentiment_service
+import text_scoring
+import topic_model
+from analysis import AnalysisCancelled, AnalysisError
+from jobs import JobManager, JobQueueFull
+from result_cache import ObjectCache, ResultCache
 
 app = FastAPI()
 
@@ -27,422 +37,516 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Try to download NLTK resources safely
-try:
-    nltk.download('vader_lexicon', quiet=True)
-    nltk.download('punkt', quiet=True)
-    nltk.download('stopwords', quiet=True)
-    print("NLTK resources downloaded successfully")
-except Exception as e:
-    print(f"Warning: Failed to download NLTK resources: {str(e)}")
-    print("Will proceed without NLP features")
+# NLTK data is no longer downloaded at import time: NLP components are loaded
+# lazily (see nlp_resources.py) and warmed up in the background after startup
 
-@app.post("/analyze-nps")
-async def analyze_nps(file: UploadFile = File(...)):
-    if not file.filename.endswith('.csv'):
+# Worker pool for the CPU-bound analysis. Analyses that are running or
+# waiting share a fixed number of slots; uploads beyond that get a 429.
+_executor = None
+# One status future per worker submitted at startup; see /ready
+_warm_up_futures = []
+_analysis_slots = asyncio.Semaphore(max(config.ANALYSIS_WORKERS, 1) + config.ANALYSIS_QUEUE_SIZE)
+
+
+# Background analyses submitted through POST /jobs
+job_manager = JobManager(config.JOB_CONCURRENCY, config.JOB_QUEUE_SIZE, config.JOB_TTL_SECONDS)
+
+# Stage timings of every analysis served by this process; see /metrics
+metrics_registry = metrics.MetricsRegistry()
+
+
+# Cubes, categorized rows and trend buckets of recent analyses, by id; see
+# /cube, /feedback and /trends
+analysis_state = ObjectCache(config.CUBE_CACHE_SIZE)
+
+
+# Rendered responses keyed by upload digest (see result_cache.py)
+result_cache = None
+if config.RESULT_CACHE_MAX_BYTES > 0:
+    result_cache = ResultCache(analysis.analysis_version(), config.RESULT_CACHE_MAX_BYTES,
+                               config.RESULT_CACHE_DIR)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None and config.ANALYSIS_WORKERS > 0:
+        _executor = ProcessPoolExecutor(max_workers=config.ANALYSIS_WORKERS,
+                                        initializer=nlp_resources.warm_up)
+    return _executor
+
+
+@app.on_event("startup")
+def start_analysis_pool():
+    executor = _get_executor()
+    if executor is not None:
+        # Workers start on demand; submit one task per worker so they boot and
+        # run the warm-up initializer now rather than during the first uploads
+        for _ in range(config.ANALYSIS_WORKERS):
+            _warm_up_futures.append(executor.submit(nlp_resources.status))
+        print(f"Started analysis pool with {config.ANALYSIS_WORKERS} workers")
+    else:
+        # Analyses run in this process: warm up without delaying startup
+        threading.Thread(target=nlp_resources.warm_up, daemon=True).start()
+
+
+@app.on_event("shutdown")
+def stop_analysis_pool():
+    global _executor
+    job_manager.shutdown()
+    # Only started here when analyses run on a thread (NPS_ANALYSIS_WORKERS=0)
+    text_scoring.shutdown()
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+def _save_upload(upload):
+    """
+    Copy the spooled upload to a named temp file a worker process can open.
+
+    Returns:
+        Tuple of (path, hex SHA-256 of the uploaded bytes)
+    """
+    upload.seek(0)
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(suffix=".csv", dir=config.UPLOAD_TMP_DIR, delete=False) as tmp:
+        while True:
+            block = upload.read(1024 * 1024)
+            if not block:
+                break
+            digest.update(block)
+            tmp.write(block)
+        return tmp.name, digest.hexdigest()
+
+
+def response_format(layout: str = Query("records"), accept_encoding: str = Header(None)):
+    """Requested payload layout (see serialization.LAYOUTS) and accepted compressions."""
+    if layout not in serialization.LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"layout must be one of: {', '.join(serialization.LAYOUTS)}")
+    return {"layout": layout, "accept_encoding": accept_encoding}
+
+
+def _render(body, response_fmt, headers=None):
+    """Response for a rendered JSON body, compressed when it is large and the client accepts it."""
+    headers = {**(headers or {}), "Vary": "Accept-Encoding"}
+    encoding = serialization.negotiate(response_fmt["accept_encoding"])
+    if encoding and len(body) >= config.COMPRESS_MIN_BYTES:
+        body = serialization.compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _json_response(body, cache_status, response_fmt):
+    metrics_registry.observe_cache(cache_status)
+    body = serialization.reshape(body, response_fmt["layout"])
+    return _render(body, response_fmt, {"X-Cache": cache_status})
+
+
+def _payload_response(payload, response_fmt):
+    """Response for a payload shaped like the analysis response (e.g. a cube slice)."""
+    if response_fmt["layout"] == "columnar":
+        payload = serialization.to_columnar(payload)
+    return _render(serialization.dumps(payload), response_fmt)
+
+
+async def _run_in_worker(func, *args):
+    """Run func on the process pool, or on a thread when pooling is disabled."""
+    executor = _get_executor()
+    if executor is None:
+        return await run_in_threadpool(func, *args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, func, *args)
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+def ready():
+    """Readiness probe: 200 once analyses can run without cold-loading models."""
+    if _executor is not None:
+        reports = [f.result() for f in _warm_up_futures if f.done() and f.exception() is None]
+        body = {
+            "mode": "process",
+            "workers": config.ANALYSIS_WORKERS,
+            "warm_workers": len({report["pid"] for report in reports}),
+            "worker_status": reports[0] if reports else None,
+        }
+        is_ready = bool(reports)
+    else:
+        local = nlp_resources.status()
+        body = {"mode": "thread", "status": local}
+        is_ready = local["warmed_up"]
+    body["ready"] = is_ready
+    return JSONResponse(content=body, status_code=200 if is_ready else 503)
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    if result_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **result_cache.stats()}
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Stage latency histograms, fallback counters and job counts in Prometheus text format."""
+    return PlainTextResponse(metrics_registry.render(jobs=job_manager.stats()), media_type="text/plain; version=0.0.4")
+
+
+def column_overrides(score_column: str = Query(None), location_column: str = Query(None),
+                     feedback_column: str = Query(None), date_column: str = Query(None),
+                     id_column: str = Query(None)):
+    """Explicit CSV column names, used instead of the header heuristics for those roles."""
+    columns = {"score": score_column, "location": location_column, "feedback": feedback_column,
+               "date": date_column, "id": id_column}
+    return {role: name for role, name in columns.items() if name}
+
+
+def _analysis_options(filename, topic_mode, persist=False, profile=None, stages=None, estimate=False,
+                      columns=None, sentiment=None, keep=False):
+    """
+    Validate an analysis request.
+
+    Returns:
+        Tuple of (options for run_analysis, result cache to use or None)
+    """
+    if not filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="Only CSV files are supported")
     
     try:
-        # Read file content
-        content = await file.read()
-        print(f"Successfully read file: {file.filename}, size: {len(content)} bytes")
-        
-        # Parse CSV
-        try:
-            # Try different encodings if needed
-            try:
-                df = pd.read_csv(io.StringIO(content.decode('utf-8')))
-            except UnicodeDecodeError:
-                df = pd.read_csv(io.StringIO(content.decode('cp1252')))
-                
-            print(f"Successfully parsed CSV with {len(df)} rows and columns: {df.columns.tolist()}")
-        except Exception as e:
-            print(f"Error parsing CSV: {str(e)}")
-            raise HTTPException(status_code=400, detail=f"Error parsing CSV: {str(e)}")
-        
-        # Specifically look for the known column names from your CSV
-        score_col = next((col for col in df.columns if 'recommend' in col.lower() or 'likely' in col.lower()), None)
-        location_col = next((col for col in df.columns if 'area' in col.lower() or 'manager' in col.lower()), None)
-        feedback_col = next((col for col in df.columns if 'suggest' in col.lower() or 'improve' in col.lower()), None)
-        
-        print(f"Found columns - Score: {score_col}, Location: {location_col}, Feedback: {feedback_col}")
-        
-        if not score_col:
-            raise HTTPException(status_code=400, detail="Could not find NPS score column in the CSV")
-        
-        # Clean and convert scores to numbers
-        df[score_col] = pd.to_numeric(df[score_col], errors='coerce')
-        df = df[(df[score_col] >= 0) & (df[score_col] <= 10)]
-        
-        total_responses = len(df)
-        if total_responses == 0:
-            raise HTTPException(status_code=400, detail="No valid scores found in the data (must be between 0-10)")
-        
-        # Calculate NPS
-        promoters = len(df[df[score_col] >= 9])
-        detractors = len(df[df[score_col] <= 6])
-        passives = total_responses - promoters - detractors
-        
-        promoters_pct = round(promoters / total_responses * 100)
-        detractors_pct = round(detractors / total_responses * 100)
-        passives_pct = round(passives / total_responses * 100)
-        
-        nps_score = promoters_pct - detractors_pct
-        print(f"NPS Score: {nps_score}, Total Responses: {total_responses}")
-        
-        # Score distribution
-        score_distribution = []
-        for score in range(11):
-            count = len(df[df[score_col] == score])
-            score_distribution.append({"score": score, "count": count})
-            print(f"Score {score}: {count} responses")
-        
-        # 1. Response Volume by Location
-        location_volumes = []
-        if location_col:
-            loc_counts = df[location_col].value_counts().reset_index()
-            loc_counts.columns = ['name', 'responses']
-            # Convert to list of dicts for JSON response
-            location_volumes = loc_counts.head(10).to_dict('records')
-            print(f"Location volumes: {location_volumes}")
-        
-        # 2. Enhanced location breakdown with promoter/passive/detractor percentages
-        location_breakdown = []
-        if location_col:
-            location_groups = df.groupby(location_col)
-            for location, group in location_groups:
-                if len(group) < 10:  # Skip locations with too few responses
-                    continue
-                    
-                location_total = len(group)
-                loc_promoters = len(group[group[score_col] >= 9])
-                loc_passives = len(group[(group[score_col] >= 7) & (group[score_col] <= 8)])
-                loc_detractors = len(group[group[score_col] <= 6])
-                
-                loc_nps = round((loc_promoters / location_total * 100) - (loc_detractors / location_total * 100))
-                
-                location_breakdown.append({
-                    "name": str(location),
-                    "nps": loc_nps,
-                    "responses": location_total,
-                    "promoters_pct": round(loc_promoters / location_total * 100),
-                    "passives_pct": round(loc_passives / location_total * 100),
-                    "detractors_pct": round(loc_detractors / location_total * 100)
-                })
-        
-        # 3. Get top and bottom locations (if enough locations)
-        top_locations = sorted(location_breakdown, key=lambda x: x["nps"], reverse=True)[:3]
-        bottom_locations = sorted(location_breakdown, key=lambda x: x["nps"])[:3]
-        
-        # 4. Analyze NPS by response volume (to see if high-volume locations differ)
-        high_volume_locations = sorted(location_breakdown, key=lambda x: x["responses"], reverse=True)[:5]
-        
-        # Keyword analysis from feedback
-        keyword_analysis = []
-        
-        try:
-            if feedback_col:
-                # Extract keywords from feedback
-                stop_words = set(stopwords.words('english'))
-                additional_stops = {'would', 'could', 'should', 'also', 'one', 'etc', 'need', 'make', 'much', 'want', 'like'}
-                stop_words.update(additional_stops)
-                
-                all_words = []
-                for text in df[feedback_col].dropna():
-                    if isinstance(text, str) and len(text) > 5:
-                        words = word_tokenize(text.lower())
-                        words = [word for word in words if word.isalpha() and word not in stop_words and len(word) > 3]
-                        all_words.extend(words)
-                
-                # Get top keywords
-                keyword_counts = Counter(all_words).most_common(10)
-                keyword_analysis = [{"keyword": k, "count": c} for k, c in keyword_counts]
-                print(f"Top keywords: {keyword_counts}")
-                
-                # 5. Keywords by promoter vs detractor
-                promoter_keywords = []
-                for _, row in df[df[score_col] >= 9].iterrows():
-                    if pd.notna(row[feedback_col]) and isinstance(row[feedback_col], str):
-                        words = word_tokenize(row[feedback_col].lower())
-                        words = [word for word in words if word.isalpha() and word not in stop_words and len(word) > 3]
-                        promoter_keywords.extend(words)
-                
-                detractor_keywords = []
-                for _, row in df[df[score_col] <= 6].iterrows():
-                    if pd.notna(row[feedback_col]) and isinstance(row[feedback_col], str):
-                        words = word_tokenize(row[feedback_col].lower())
-                        words = [word for word in words if word.isalpha() and word not in stop_words and len(word) > 3]
-                        detractor_keywords.extend(words)
-                
-                promoter_top = Counter(promoter_keywords).most_common(5)
-                detractor_top = Counter(detractor_keywords).most_common(5)
-                
-                promoter_keywords_analysis = [{"keyword": k, "count": c} for k, c in promoter_top]
-                detractor_keywords_analysis = [{"keyword": k, "count": c} for k, c in detractor_top]
-                
-        except Exception as e:
-            print(f"Error in keyword analysis: {str(e)}")
-            promoter_keywords_analysis = []
-            detractor_keywords_analysis = []
-        
-        # Sentiment analysis
-        sentiment_counts = {"positive": 0, "neutral": 0, "negative": 0}
-        feedback_samples = []
-        
-        try:
-            if feedback_col:
-                sid = SentimentIntensityAnalyzer()
-                
-                # Get representative samples from different score ranges
-                detractor_samples = df[df[score_col] <= 6].sample(min(2, len(df[df[score_col] <= 6]))) if len(df[df[score_col] <= 6]) > 0 else pd.DataFrame()
-                passive_samples = df[(df[score_col] >= 7) & (df[score_col] <= 8)].sample(min(1, len(df[(df[score_col] >= 7) & (df[score_col] <= 8)]))) if len(df[(df[score_col] >= 7) & (df[score_col] <= 8)]) > 0 else pd.DataFrame()
-                promoter_samples = df[df[score_col] >= 9].sample(min(2, len(df[df[score_col] >= 9]))) if len(df[df[score_col] >= 9]) > 0 else pd.DataFrame()
-                
-                sample_frames = [detractor_samples, passive_samples, promoter_samples]
-                
-                for sample_df in sample_frames:
-                    for _, row in sample_df.iterrows():
-                        if pd.isna(row[feedback_col]) or not isinstance(row[feedback_col], str) or len(row[feedback_col]) < 10:
-                            continue
-                            
-                        feedback = row[feedback_col]
-                        score = row[score_col]
-                        location = str(row[location_col]) if location_col and pd.notna(row[location_col]) else "Unknown"
-                        
-                        feedback_samples.append({
-                            "text": feedback,
-                            "score": int(score),
-                            "location": location
-                        })
-                
-                # Sentiment analysis for all feedback
-                for text in df[feedback_col].dropna():
-                    if isinstance(text, str) and len(text) > 5:
-                        sentiment = sid.polarity_scores(text)
-                        
-                        # Classify sentiment
-                        if sentiment['compound'] >= 0.05:
-                            sentiment_counts["positive"] += 1
-                        elif sentiment['compound'] <= -0.05:
-                            sentiment_counts["negative"] += 1
-                        else:
-                            sentiment_counts["neutral"] += 1
-                
-                # Convert to percentages
-                total_sentiment = sum(sentiment_counts.values())
-                if total_sentiment > 0:
-                    for key in sentiment_counts:
-                        sentiment_counts[key] = round(sentiment_counts[key] / total_sentiment * 100)
-                
-                print(f"Sentiment breakdown: {sentiment_counts}")
-                print(f"Number of feedback samples: {len(feedback_samples)}")
-        except Exception as e:
-            print(f"Error in sentiment analysis: {str(e)}")
-            # Fallback values
-            sentiment_counts = {"positive": 60, "neutral": 30, "negative": 10}
-        
-        # NEW FEATURE 1: Topic Modeling for Customer Feedback
-        topics = []
-        try:
-            if feedback_col and len(df[feedback_col].dropna()) >= 20:
-                # Prepare text data
-                feedback_text = df[feedback_col].dropna().astype(str).tolist()
-                
-                # Use Count Vectorizer to transform text to numerical data
-                vectorizer = CountVectorizer(max_df=0.95, min_df=2, stop_words='english')
-                dtm = vectorizer.fit_transform(feedback_text)
-                
-                # Apply LDA for topic modeling
-                lda = LatentDirichletAllocation(n_components=5, random_state=42)
-                lda.fit(dtm)
-                
-                # Get top words for each topic
-                feature_names = vectorizer.get_feature_names_out()
-                
-                for topic_idx, topic in enumerate(lda.components_):
-                    top_words_idx = topic.argsort()[:-10 - 1:-1]
-                    top_words = [feature_names[i] for i in top_words_idx]
-                    
-                    # Assign a simple name based on top words
-                    topic_name = f"Topic {topic_idx+1}: {top_words[0].title()} & {top_words[1].title()}"
-                    
-                    topics.append({
-                        "id": topic_idx,
-                        "name": topic_name,
-                        "top_words": top_words,
-                        "weight": float(topic.sum() / lda.components_.sum())
-                    })
-                    
-                # For each feedback, find the dominant topic
-                topic_results = lda.transform(dtm)
-                dominant_topics = topic_results.argmax(axis=1)
-                
-                # Count feedback by dominant topic
-                topic_counts = {}
-                for topic_idx in range(len(topics)):
-                    count = (dominant_topics == topic_idx).sum()
-                    topics[topic_idx]["count"] = int(count)
-                    
-        except Exception as e:
-            print(f"Error in topic modeling: {str(e)}")
-        
-        # NEW FEATURE 2: Advanced Sentiment Analysis
-        advanced_sentiment = {
-            "emotions": {"joy": 0, "sadness": 0, "anger": 0, "surprise": 0, "fear": 0},
-            "intensity_distribution": {"strong_positive": 0, "moderate_positive": 0, 
-                                      "neutral": 0, "moderate_negative": 0, "strong_negative": 0}
-        }
+        stage_names = analysis.resolve_stages(profile, [name.strip() for name in stages.split(",") if name.strip()]
+                                              if stages else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    topic_mode = topic_mode or topic_model.default_mode()
+    if topic_mode not in topic_model.TOPIC_MODES:
+        raise HTTPException(status_code=400, detail=f"topic_mode must be one of: {', '.join(topic_model.TOPIC_MODES)}")
+    if topic_mode != "batch" and not config.TOPIC_MODEL_PATH:
+        raise HTTPException(status_code=400, detail="No persistent topic model is configured (NPS_TOPIC_MODEL_PATH)")
+    sentiment = sentiment or config.SENTIMENT_ENGINE
+    if sentiment not in sentiment_service.ENGINES:
+        raise HTTPException(status_code=400, detail=f"sentiment must be one of: {', '.join(sentiment_service.ENGINES)}")
+    # The cube, categorized rows and trend buckets are only built and kept
+    # for /cube, /feedback and /trends when asked for
+    if keep and config.CUBE_CACHE_SIZE <= 0:
+        raise HTTPException(status_code=400, detail="Keeping analysis state is disabled (NPS_CUBE_CACHE_SIZE=0)")
+    # Cubes and stored rows need every row's text results, not a sample's
+    keep_state = keep and not estimate
+    # Trend buckets come from every row's score, so estimates keep them too
+    options = {"topic_mode": topic_mode, "stages": stage_names, "estimate": estimate, "sentiment": sentiment,
+               "columns": columns or {}, "cube": keep_state, "feedback": keep_state, "trends": keep}
+    if persist:
+        if estimate:
+            raise HTTPException(status_code=400, detail="persist cannot be combined with estimate")
+        if not config.STORE_DIR:
+            raise HTTPException(status_code=400, detail="No response store is configured (NPS_STORE_DIR)")
+        options["persist"] = True
+    # Online topics depend on the evolving model, not just the upload, and
+    # persisting needs the pipeline to run
+    cache = result_cache if topic_mode == "batch" and not persist else None
+    return options, cache
 
-        try:
-            if feedback_col:
-                # Simple emotion detection with keyword approach
-                emotion_keywords = {
-                    "joy": ["happy", "love", "great", "excellent", "amazing", "awesome", "perfect", "wonderful", "delighted"],
-                    "sadness": ["sad", "disappointed", "unhappy", "regret", "missing", "unfortunate", "sorry"],
-                    "anger": ["angry", "frustrat", "annoy", "terrible", "awful", "horrible", "bad", "unacceptable"],
-                    "surprise": ["wow", "surprise", "unexpected", "amazed", "astonished"],
-                    "fear": ["afraid", "worried", "concern", "fear", "anxious", "scared"]
-                }
-                
-                emotion_counts = {emotion: 0 for emotion in emotion_keywords}
-                intensity_counts = {"strong_positive": 0, "moderate_positive": 0, 
-                                   "neutral": 0, "moderate_negative": 0, "strong_negative": 0}
-                
-                for text in df[feedback_col].dropna():
-                    if not isinstance(text, str) or len(text) < 5:
-                        continue
-                        
-                    # TextBlob for polarity and subjectivity
-                    blob = TextBlob(text)
-                    polarity = blob.sentiment.polarity
-                    
-                    # Classify intensity
-                    if polarity >= 0.5:
-                        intensity_counts["strong_positive"] += 1
-                    elif polarity >= 0.1:
-                        intensity_counts["moderate_positive"] += 1
-                    elif polarity <= -0.5:
-                        intensity_counts["strong_negative"] += 1
-                    elif polarity <= -0.1:
-                        intensity_counts["moderate_negative"] += 1
-                    else:
-                        intensity_counts["neutral"] += 1
-                    
-                    # Detect emotions
-                    text_lower = text.lower()
-                    for emotion, keywords in emotion_keywords.items():
-                        for keyword in keywords:
-                            if keyword in text_lower:
-                                emotion_counts[emotion] += 1
-                                break
-                
-                # Calculate percentages for emotions
-                total_emotions = sum(emotion_counts.values())
-                if total_emotions > 0:
-                    for emotion, count in emotion_counts.items():
-                        advanced_sentiment["emotions"][emotion] = round((count / total_emotions) * 100)
-                
-                # Calculate percentages for intensity
-                total_intensity = sum(intensity_counts.values())
-                if total_intensity > 0:
-                    for intensity, count in intensity_counts.items():
-                        advanced_sentiment["intensity_distribution"][intensity] = round((count / total_intensity) * 100)
-                
-        except Exception as e:
-            print(f"Error in advanced sentiment analysis: {str(e)}")
-        
-        # NEW ANALYSIS - Use the feedback analysis module
-        # Prepare the feedback texts for analysis
-        if feedback_col:
-            feedback_texts = df[feedback_col].dropna().astype(str).tolist()
-            
-            # Text Categorization
-            categorized_feedback = feedback_analysis.categorize_feedback(feedback_texts)
-            
-            # Get category distribution
-            category_counts = {}
-            for item in categorized_feedback:
-                category = item["primary_category"]
-                if category not in category_counts:
-                    category_counts[category] = 0
-                category_counts[category] += 1
-            
-            # Convert to sorted list for the response
-            category_distribution = [
-                {"name": category, "count": count} 
-                for category, count in sorted(category_counts.items(), key=lambda x: x[1], reverse=True)
-            ]
-            
-            # Aspect-Based Sentiment Analysis
-            aspect_sentiment = feedback_analysis.analyze_aspect_sentiment(feedback_texts)
-            
-            # NPS Drivers Analysis
-            # Extract score-feedback pairs for NPS drivers analysis
-            # if score_col:
-            #     score_feedback_pairs = []
-            #     for _, row in df.iterrows():
-            #         if pd.notna(row[feedback_col]) and isinstance(row[feedback_col], str) and pd.notna(row[score_col]):
-            #             score_feedback_pairs.append({
-            #                 "text": row[feedback_col], 
-            #                 "score": row[score_col]
-            #             })
-                
-            #     nps_drivers = feedback_analysis.analyze_nps_drivers(score_feedback_pairs)
-            # else:
-            #     nps_drivers = {
-            #         "keyword_impact": {"positive": [], "negative": []},
-            #         "high_impact_phrases": {"positive": [], "negative": []}
-            #     }
-        else:
-            # Default empty values if no feedback column
-            category_distribution = []
-            categorized_feedback = []
-            aspect_sentiment = {
-                "aspect_sentiments": {},
-                "aspect_mentions": {},
-                "samples": {},
-                "sorted_aspects": []
-            }
-            # nps_drivers = {
-            #     "keyword_impact": {"positive": [], "negative": []},
-            #     "high_impact_phrases": {"positive": [], "negative": []}
-            # }
+
+def _run_id(digest, options):
+    """
+    Key of an upload analysed with the requested stages: the digest itself for
+    the full exact pipeline with detected columns, with the stage names,
+    "estimate", "keep", the sentiment engine and/or a hash of the column
+    overrides appended otherwise.
+    """
+    suffix = [] if options["stages"] == analysis.PROFILES["full"] else list(options["stages"])
+    if options.get("estimate"):
+        suffix.append("estimate")
+    if options.get("trends"):
+        suffix.append("keep")
+    if options.get("sentiment", "exact") != "exact":
+        suffix.append(options["sentiment"])
+    if options.get("columns"):
+        overrides = json.dumps(options["columns"], sort_keys=True).encode('utf-8')
+        suffix.append("columns" + hashlib.sha256(overrides).hexdigest()[:8])
+    return "-".join([digest] + suffix)
+
+
+async def _cached_body(cache, digest, filename, options):
+    """Identical uploads are answered from the cache without using a worker."""
+    if cache is None:
+        return None
+    if (options["cube"] or options["trends"]) and analysis_state.get(_run_id(digest[:16], options)) is None:
+        # The cached body points at a cube, rows or buckets that are gone; rebuild all
+        cache.record_miss()
+        return None
+    body = await run_in_threadpool(cache.get, _run_id(digest, options))
+    if body is not None:
+        print(f"Result cache hit for {filename} ({digest[:12]})")
+    return body
+
+
+async def _analyze(path, digest, filename, options, cache, progress=None):
+    """
+    Run the pipeline on a saved upload, record its metrics and cache the body.
+
+    Returns:
+        Tuple of (rendered JSON body, result payload, stage timings)
+
+    Raises:
+        AnalysisError: When the analysis fails
+        AnalysisCancelled: When progress cancelled it
+    """
+    if options.get("persist"):
+        # Each upload is its own partition of the response store
+        options = {**options, "store_upload_id": digest[:16]}
+    try:
+        result = await _run_in_worker(analysis.run_analysis, path, filename, options, progress)
+    except AnalysisError:
+        metrics_registry.observe_analysis(None, outcome="error")
+        raise
+    except AnalysisCancelled:
+        metrics_registry.observe_analysis(None, outcome="cancelled")
+        raise
+    
+    # The stage breakdown feeds /metrics and is only returned on request
+    stage_timings = result.pop("timings", None)
+    metrics_registry.observe_analysis(stage_timings)
+    
+    # The cube, categorized rows and trend buckets stay in this process; the
+    # response only carries their id
+    state_id = _run_id(digest[:16], options)
+    cube = result.pop("cube", None)
+    feedback = result.pop("feedback", None)
+    buckets = result.pop("trend_buckets", None)
+    result["cubeId"] = state_id if cube is not None else None
+    result["feedbackId"] = state_id if feedback is not None else None
+    result["trendsId"] = state_id if buckets is not None else None
+    if options["cube"] or options["trends"]:
+        analysis_state.put(state_id, {"cube": cube, "feedback": feedback, "trends": buckets})
+    
+    # Render once; cache hits are served from these bytes
+    body = serialization.dumps(result)
+    if cache is not None:
+        await run_in_threadpool(cache.put, _run_id(digest, options), body)
+    return body, result, stage_timings
+
+
+@app.post("/analyze-nps")
+async def analyze_nps(file: UploadFile = File(...), topic_mode: str = Query(None),
+                      timings: bool = Query(False), persist: bool = Query(False),
+                      profile: str = Query(None), stages: str = Query(None), estimate: bool = Query(False),
+                      sentiment: str = Query(None), keep: bool = Query(False),
+                      columns=Depends(column_overrides), response_fmt=Depends(response_format)):
+    options, cache = _analysis_options(file.filename, topic_mode, persist, profile, stages, estimate, columns,
+                                       sentiment, keep)
+    
+    path, digest = await run_in_threadpool(_save_upload, file.file)
+    try:
+        # Timings describe a pipeline run, so ?timings=true never reads the
+        # cache (the fresh body is still stored)
+        body = None if timings else await _cached_body(cache, digest, file.filename, options)
+        if body is not None:
+            return _json_response(body, "HIT", response_fmt)
         
-        # Return analysis results with enhanced insights
-        return {
-            "summary": {
-                "nps": nps_score,
-                "responses": total_responses,
-                "promoters": promoters_pct,
-                "passives": passives_pct,
-                "detractors": detractors_pct
-            },
-            "scoreDistribution": score_distribution,
-            "locationBreakdown": sorted(location_breakdown, key=lambda x: x["nps"], reverse=True),
-            "locationVolumes": sorted(location_volumes, key=lambda x: x["responses"], reverse=True),
-            "topLocations": top_locations,
-            "bottomLocations": bottom_locations,
-            "highVolumeLocations": high_volume_locations,
-            "keywordAnalysis": keyword_analysis,
-            "promoterKeywords": promoter_keywords_analysis,
-            "detractorKeywords": detractor_keywords_analysis,
-            "feedbackSentiment": sentiment_counts,
-            "feedbackSamples": feedback_samples,
-            
-            # Original new components
-            "topics": topics,
-            "advancedSentiment": advanced_sentiment,
-            
-            # Additional analysis from feedback_analysis.py
-            "categoryDistribution": category_distribution,
-            "categorizedFeedback": categorized_feedback[:20],  # Limit to top 20 for response size
-            "aspectSentiment": aspect_sentiment,
-            # "npsDrivers": nps_drivers
-        }
+        # Backpressure: reject instead of queueing without bound
+        if _analysis_slots.locked():
+            raise HTTPException(status_code=429, detail="Analysis queue is full, please retry shortly")
         
-    except Exception as e:
-        print(f"ERROR processing file: {str(e)}")
-        print(traceback.format_exc())
-        raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
+        async with _analysis_slots:
+            try:
+                body, result, stage_timings = await _analyze(path, digest, file.filename, options, cache)
+            except AnalysisError as e:
+                raise HTTPException(status_code=e.status_code, detail=e.detail)
+    finally:
+        os.remove(path)
+    
+    if timings:
+        body = serialization.dumps({**result, "timings": stage_timings})
+    return _json_response(body, "MISS" if cache is not None and not timings else "BYPASS", response_fmt)
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(file: UploadFile = File(...), topic_mode: str = Query(None),
+                     persist: bool = Query(False), profile: str = Query(None), stages: str = Query(None),
+                     estimate: bool = Query(False), sentiment: str = Query(None), keep: bool = Query(False),
+                     columns=Depends(column_overrides)):
+    """Start an analysis in the background; poll /jobs/{id} or stream /jobs/{id}/events."""
+    options, cache = _analysis_options(file.filename, topic_mode, persist, profile, stages, estimate, columns,
+                                       sentiment, keep)
+    path, digest = await run_in_threadpool(_save_upload, file.file)
+    filename = file.filename
+    
+    async def runner(progress):
+        body = await _cached_body(cache, digest, filename, options)
+        if body is not None:
+            metrics_registry.observe_cache("HIT")
+            return serialization.loads(body), {"cache": "HIT"}
+        cache_status = "MISS" if cache is not None else "BYPASS"
+        metrics_registry.observe_cache(cache_status)
+        _, result, stage_timings = await _analyze(path, digest, filename, options, cache, progress)
+        # Plain JSON types, so job events and /jobs/{id} never touch numpy
+        return serialization.loads(serialization.dumps(result)), {"cache": cache_status, "timings": stage_timings}
+    
+    try:
+        job = job_manager.submit(filename, runner, process_pool=_get_executor() is not None,
+                                 cleanup=lambda: os.remove(path))
+    except JobQueueFull:
+        os.remove(path)
+        raise HTTPException(status_code=429, detail="Too many analysis jobs are waiting, please retry shortly")
+    return {
+        "id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events",
+    }
+
+
+def _find_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found (it may have expired)")
+    return job
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str, response_fmt=Depends(response_format)):
+    """Job status, latest progress and, once completed, the analysis payload."""
+    body = _find_job(job_id).describe()
+    if body.get("result") is not None and response_fmt["layout"] == "columnar":
+        body["result"] = serialization.to_columnar(body["result"])
+    return _render(serialization.dumps(body), response_fmt)
+
+
+@app.get("/jobs/{job_id}/events")
+def job_events(job_id: str, last_event_id: int = Header(-1)):
+    """Server-sent events: status changes, stage starts/completions and rows parsed."""
+    job = _find_job(job_id)
+    return StreamingResponse(job.stream(after=last_event_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found (it may have expired)")
+    body = job.describe()
+    body.pop("result", None)
+    return body
+
+
+def store_filter(location: List[str] = Query(None), segment: List[str] = Query(None),
+                 since: str = Query(None), until: str = Query(None), upload_id: str = Query(None)):
+    """Row predicate shared by the /store endpoints (upload dates are YYYY-MM-DD)."""
+    if not config.STORE_DIR:
+        raise HTTPException(status_code=400, detail="No response store is configured (NPS_STORE_DIR)")
+    if segment and not set(segment) <= {"promoter", "passive", "detractor"}:
+        raise HTTPException(status_code=400, detail="segment must be promoter, passive or detractor")
+    try:
+        return response_store.row_filter(location, segment, since, until, upload_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since and until must be dates in YYYY-MM-DD form")
+
+
+def _store_payload(payload):
+    if payload is None:
+        raise HTTPException(status_code=404, detail="No stored responses match the filters")
+    return payload
+
+
+@app.get("/store/summary")
+def store_summary(predicate=Depends(store_filter), response_fmt=Depends(response_format)):
+    """NPS summary, score distribution and feedback sentiment of the stored responses."""
+    return _payload_response(_store_payload(response_store.query_summary(predicate)), response_fmt)
+
+
+@app.get("/store/locations")
+def store_locations(predicate=Depends(store_filter), min_responses: int = Query(10),
+                    response_fmt=Depends(response_format)):
+    """Per-location NPS breakdown and volumes of the stored responses."""
+    return _payload_response(_store_payload(response_store.query_locations(predicate, min_responses)),
+                             response_fmt)
+
+
+@app.get("/store/categories")
+def store_categories(predicate=Depends(store_filter), response_fmt=Depends(response_format)):
+    """Primary category distribution and aspect mentions of the stored feedback."""
+    return _payload_response(_store_payload(response_store.query_categories(predicate)), response_fmt)
+
+
+def trend_query(period: str = Query(None), window: int = Query(None), since: str = Query(None),
+                until: str = Query(None), location: List[str] = Query(None)):
+    """Window of a trends request, shared by /trends/{id} and /store/trends (dates are YYYY-MM-DD)."""
+    return {"period": period, "window": window, "since": since, "until": until, "locations": location}
+
+
+def _trend_series(buckets, query):
+    try:
+        series = buckets.series(**query)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if series is None:
+        raise HTTPException(status_code=404, detail="No dated responses")
+    return series
+
+
+@app.get("/store/trends")
+def store_trends(query=Depends(trend_query), response_fmt=Depends(response_format)):
+    """Per-period and rolling NPS of the stored responses, from the store's per-day buckets."""
+    if not config.STORE_DIR:
+        raise HTTPException(status_code=400, detail="No response store is configured (NPS_STORE_DIR)")
+    return _payload_response(_trend_series(response_store.load_trends(), query), response_fmt)
+
+
+def _find_state(state_id, kind):
+    state = analysis_state.get(state_id)
+    if state is None or state[kind] is None:
+        raise HTTPException(status_code=404, detail=f"{kind.title()} not found (it may have expired; re-run the analysis)")
+    return state[kind]
+
+
+def _find_cube(cube_id):
+    return _find_state(cube_id, "cube")
+
+
+@app.get("/cube/{cube_id}")
+def cube_dimensions(cube_id: str):
+    """Values that /cube/{id}/filter accepts for each dimension."""
+    return _find_cube(cube_id).dimensions()
+
+
+@app.get("/cube/{cube_id}/filter")
+def cube_filter(cube_id: str, location: List[str] = Query(None), score: List[int] = Query(None),
+                segment: List[str] = Query(None), category: List[str] = Query(None),
+                min_responses: int = Query(10), response_fmt=Depends(response_format)):
+    """Summary, distribution, location, sentiment, category, aspect and keyword blocks for a slice."""
+    cube = _find_cube(cube_id)
+    if score and not all(0 <= value <= 10 for value in score):
+        raise HTTPException(status_code=400, detail="score must be between 0 and 10")
+    if segment and not set(segment) <= {"promoter", "passive", "detractor"}:
+        raise HTTPException(status_code=400, detail="segment must be promoter, passive or detractor")
+    mask = cube.select(locations=location, scores=score, segments=segment, categories=category)
+    payload = cube.payload(mask, min_responses=min_responses)
+    if payload is None:
+        raise HTTPException(status_code=404, detail="No responses match the filters")
+    return _payload_response(payload, response_fmt)
+
+
+@app.get("/trends/{trends_id}")
+def trends_window(trends_id: str, query=Depends(trend_query), response_fmt=Depends(response_format)):
+    """Per-period and rolling NPS of an analysed upload for any window, from its per-day buckets."""
+    return _payload_response(_trend_series(_find_state(trends_id, "trends"), query), response_fmt)
+
+
+@app.get("/feedback/{feedback_id}")
+def feedback_page(feedback_id: str, category: str = Query(None), cursor: int = Query(0),
+                  limit: int = Query(50)):
+    """Categorized feedback rows in upload order, one page per request; pass next_cursor back for more."""
+    categorized = _find_state(feedback_id, "feedback")
+    if category is not None and category not in feedback_analysis.CATEGORY_LABELS:
+        raise HTTPException(status_code=400, detail=f"category must be one of: {', '.join(feedback_analysis.CATEGORY_LABELS)}")
+    if not 1 <= limit <= 500:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 500")
+    return categorized.page(category, max(cursor, 0), limit)
 
 # Run with: uvicorn main:app --reload
\ No newline at end of file
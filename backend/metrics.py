@@ -0,0 +1,247 @@
+# metrics.py
+#
+# Stage-level instrumentation for the analysis pipeline.
+#
+# StageTimings records wall time, row count and status (ok / fallback /
+# error) for each stage of one analysis. It runs wherever the analysis runs
+# (usually a worker process) and travels back with the result as plain data.
+# The API process folds every breakdown into a MetricsRegistry, which keeps
+# Prometheus-style histograms and counters and renders them for /metrics.
+# An optional listener receives stage events as they happen (see jobs.py).
+import bisect
+import threading
+import time
+
+# Histogram bucket upper bounds in seconds (+Inf is implicit)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# The StageTimings of the analysis running on this thread, so helpers deep in
+# the pipeline can report a fallback without threading the object through
+_active = threading.local()
+
+
+class StageTimings:
+    """
+    Stage timer for one analysis run.
+
+    Each call to stage() closes the stage in progress on the calling thread
+    and opens the next one; end() or finish() closes the last. Independent
+    stages can therefore be timed concurrently from different threads.
+    Stages are listed in the order they started and default to status "ok".
+
+    Args:
+        listener: Optional callable receiving an event dict when a stage
+            starts ("stage_started"), reports rows ("progress") or ends
+            ("stage_completed"). Exceptions it raises propagate to the caller.
+    """
+
+    def __init__(self, listener=None):
+        self.listener = listener
+        self.stages = []
+        self._lock = threading.Lock()
+        # The open stage and its start time, per thread
+        self._thread = threading.local()
+        self._run_started = time.perf_counter()
+        _active.timings = self
+
+    @property
+    def _current(self):
+        return getattr(self._thread, "record", None)
+
+    def stage(self, name, rows=None):
+        """Start timing a stage on this thread, ending the one in progress there."""
+        self._close()
+        record = {"stage": name, "seconds": 0.0, "rows": rows, "status": "ok"}
+        with self._lock:
+            self.stages.append(record)
+        self._thread.record = record
+        self._thread.started = time.perf_counter()
+        # report_fallback() calls from this thread now land here
+        _active.timings = self
+        self._emit({"type": "stage_started", "stage": name})
+
+    def rows(self, count):
+        """Set the number of rows the current stage processed."""
+        if self._current is not None:
+            self._current["rows"] = int(count)
+            self._emit({"type": "progress", "stage": self._current["stage"], "rows": int(count)})
+
+    def fallback(self, reason):
+        """Mark the current stage as degraded (it returned fallback values)."""
+        if self._current is not None:
+            self._current["status"] = "fallback"
+            self._current["error"] = reason
+
+    def skip(self):
+        """Mark the current stage as not applicable to this upload."""
+        if self._current is not None:
+            self._current["status"] = "skipped"
+
+    def _emit(self, event):
+        if self.listener is not None:
+            self.listener(event)
+
+    def _close(self):
+        record = self._current
+        if record is not None:
+            record["seconds"] = round(time.perf_counter() - self._thread.started, 4)
+            self._thread.record = None
+            self._emit({"type": "stage_completed", **record})
+
+    def end(self):
+        """End the stage in progress on this thread."""
+        self._close()
+
+    def finish(self):
+        """
+        Close the last stage and detach from the current thread.
+
+        Returns:
+            Dict with the list of stages and the total wall time
+        """
+        self._close()
+        self.detach()
+        return {
+            "stages": list(self.stages),
+            "total_seconds": round(time.perf_counter() - self._run_started, 4),
+        }
+
+    def detach(self):
+        """Stop receiving report_fallback() calls on this thread."""
+        if getattr(_active, "timings", None) is self:
+            _active.timings = None
+
+
+def report_fallback(reason):
+    """Mark the active stage on this thread as degraded, if one is being timed."""
+    timings = getattr(_active, "timings", None)
+    if timings is not None:
+        timings.fallback(reason)
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(DURATION_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(DURATION_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+class MetricsRegistry:
+    """Process-wide aggregate of analysis timings, rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stage_seconds = {}
+        self._stage_runs = {}
+        self._stage_rows = {}
+        self._request_seconds = _Histogram()
+        self._requests = {}
+        self._cache = {}
+
+    def observe_analysis(self, timings, outcome="ok"):
+        """
+        Record one analysis run.
+
+        Args:
+            timings: Breakdown returned by StageTimings.finish(), or None
+            outcome: "ok" or "error"
+        """
+        with self._lock:
+            self._requests[outcome] = self._requests.get(outcome, 0) + 1
+            if not timings:
+                return
+            self._request_seconds.observe(timings["total_seconds"])
+            for stage in timings["stages"]:
+                name = stage["stage"]
+                key = (name, stage["status"])
+                self._stage_runs[key] = self._stage_runs.get(key, 0) + 1
+                if stage["status"] == "skipped":
+                    continue
+                self._stage_seconds.setdefault(name, _Histogram()).observe(stage["seconds"])
+                if stage["rows"] is not None:
+                    self._stage_rows[name] = self._stage_rows.get(name, 0) + stage["rows"]
+
+    def observe_cache(self, result):
+        """Count a result cache lookup outcome (HIT, MISS or BYPASS)."""
+        with self._lock:
+            self._cache[result] = self._cache.get(result, 0) + 1
+
+    def render(self, jobs=None):
+        """
+        The current metrics in Prometheus text exposition format.
+
+        Args:
+            jobs: Optional dict of background job counts by status (JobManager.stats)
+        """
+        lines = []
+        with self._lock:
+            lines += [
+                "# HELP nps_analysis_stage_seconds Wall time of each analysis stage.",
+                "# TYPE nps_analysis_stage_seconds histogram",
+            ]
+            for name, histogram in sorted(self._stage_seconds.items()):
+                lines += _histogram_lines("nps_analysis_stage_seconds", histogram, stage=name)
+
+            lines += [
+                "# HELP nps_analysis_stage_runs_total Stage executions by status (ok, fallback, skipped).",
+                "# TYPE nps_analysis_stage_runs_total counter",
+            ]
+            for (name, status), count in sorted(self._stage_runs.items()):
+                lines.append(f"nps_analysis_stage_runs_total{_labels(stage=name, status=status)} {count}")
+
+            lines += [
+                "# HELP nps_analysis_stage_rows_total Rows processed by each analysis stage.",
+                "# TYPE nps_analysis_stage_rows_total counter",
+            ]
+            for name, count in sorted(self._stage_rows.items()):
+                lines.append(f"nps_analysis_stage_rows_total{_labels(stage=name)} {count}")
+
+            lines += [
+                "# HELP nps_analysis_seconds Wall time of complete analyses.",
+                "# TYPE nps_analysis_seconds histogram",
+            ]
+            lines += _histogram_lines("nps_analysis_seconds", self._request_seconds)
+
+            lines += [
+                "# HELP nps_analysis_requests_total Analyses run, by outcome.",
+                "# TYPE nps_analysis_requests_total counter",
+            ]
+            for outcome, count in sorted(self._requests.items()):
+                lines.append(f"nps_analysis_requests_total{_labels(outcome=outcome)} {count}")
+
+            lines += [
+                "# HELP nps_result_cache_requests_total Result cache lookups, by result.",
+                "# TYPE nps_result_cache_requests_total counter",
+            ]
+            for result, count in sorted(self._cache.items()):
+                lines.append(f"nps_result_cache_requests_total{_labels(result=result)} {count}")
+
+        if jobs is not None:
+            lines += [
+                "# HELP nps_jobs Background analysis jobs currently held, by status.",
+                "# TYPE nps_jobs gauge",
+            ]
+            for status, count in sorted(jobs.items()):
+                lines.append(f"nps_jobs{_labels(status=status)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _histogram_lines(metric, histogram, **labels):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(DURATION_BUCKETS + ("+Inf",), histogram.buckets):
+        cumulative += count
+        lines.append(f"{metric}_bucket{_labels(**labels, le=bound)} {cumulative}")
+    suffix = _labels(**labels) if labels else ""
+    lines.append(f"{metric}_sum{suffix} {round(histogram.sum, 6)}")
+    lines.append(f"{metric}_count{suffix} {histogram.count}")
+    return lines
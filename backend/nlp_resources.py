@@ -0,0 +1,188 @@
+# nlp_resources.py
+#
+# Lazy loading of the heavy NLP dependencies. NLTK, TextBlob and scikit-learn
+# are only imported, and their data only read, the first time a stage needs
+# them (or during a background warm-up), so importing the API is cheap and
+# never touches the network. NLTK data is looked up locally; downloading is an
+# explicit opt-in (NPS_NLTK_DOWNLOAD=1), since it hangs on air-gapped nodes.
+import os
+import threading
+import time
+
+import config
+
+# NLTK packages the pipeline uses and where nltk.data.find() looks for them
+NLTK_RESOURCES = {
+    "vader_lexicon": "sentiment/vader_lexicon.zip",
+    "punkt": "tokenizers/punkt",
+    "stopwords": "corpora/stopwords",
+}
+
+_loaded = {}
+_load_seconds = {}
+_nltk_data = None
+_lock = threading.RLock()
+_warm_up_done = threading.Event()
+
+
+def _load(name, loader):
+    value = _loaded.get(name)
+    if value is None:
+        with _lock:
+            value = _loaded.get(name)
+            if value is None:
+                started = time.perf_counter()
+                value = loader()
+                _load_seconds[name] = round(time.perf_counter() - started, 3)
+                _loaded[name] = value
+    return value
+
+
+def _load_vader():
+    from nltk.sentiment import SentimentIntensityAnalyzer
+    return SentimentIntensityAnalyzer()
+
+
+def _load_word_tokenize():
+    from nltk.tokenize import word_tokenize
+    return word_tokenize
+
+
+def _load_stopwords():
+    from nltk.corpus import stopwords
+    return frozenset(stopwords.words('english'))
+
+
+def _load_textblob():
+    from textblob import TextBlob
+    return TextBlob
+
+
+def _load_topic_model():
+    from sklearn.decomposition import LatentDirichletAllocation
+    from sklearn.feature_extraction.text import CountVectorizer
+    return CountVectorizer, LatentDirichletAllocation
+
+
+def _load_hashing_vectorizer():
+    from sklearn.feature_extraction.text import HashingVectorizer
+    return HashingVectorizer
+
+
+def vader():
+    """Shared SentimentIntensityAnalyzer (reads the VADER lexicon on first use)."""
+    return _load("vader", _load_vader)
+
+
+def word_tokenize():
+    """NLTK's word_tokenize function."""
+    return _load("word_tokenize", _load_word_tokenize)
+
+
+def english_stopwords():
+    """NLTK's English stopword list as a frozenset."""
+    return _load("stopwords", _load_stopwords)
+
+
+def textblob():
+    """The TextBlob class."""
+    return _load("textblob", _load_textblob)
+
+
+def topic_model():
+    """The (CountVectorizer, LatentDirichletAllocation) classes."""
+    return _load("topic_model", _load_topic_model)
+
+
+def hashing_vectorizer():
+    """The HashingVectorizer class used by the online topic model."""
+    return _load("hashing_vectorizer", _load_hashing_vectorizer)
+
+
+def nltk_data_status():
+    """
+    Check which NLTK data packages are available locally, without downloading.
+
+    Returns:
+        Dict of package name -> True/False
+    """
+    # Import under the loader lock: NLTK's circular imports break when two
+    # threads (the warm-up thread and a request) import it concurrently
+    with _lock:
+        import nltk.data
+
+    status = {}
+    for name, resource in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(resource)
+            status[name] = True
+        except LookupError:
+            status[name] = False
+    return status
+
+
+def ensure_nltk_data(download=False):
+    """
+    Report missing NLTK data, downloading it only when explicitly allowed.
+
+    Args:
+        download: Whether missing packages may be fetched from the network
+
+    Returns:
+        Dict of package name -> True/False after any downloads
+    """
+    global _nltk_data
+    status = nltk_data_status()
+    missing = [name for name, present in status.items() if not present]
+    if missing and download:
+        import nltk
+        for name in missing:
+            try:
+                status[name] = bool(nltk.download(name, quiet=True))
+            except Exception as e:
+                print(f"Warning: Failed to download NLTK resource {name}: {str(e)}")
+    _nltk_data = status
+    missing = [name for name, present in status.items() if not present]
+    if missing:
+        print(f"Warning: NLTK data not found locally: {', '.join(missing)}; dependent stages will fall back")
+    return status
+
+
+def warm_up():
+    """
+    Load every NLP component ahead of the first request.
+
+    Used as the worker process initializer and by the API's background
+    warm-up thread. Components that fail to load are reported, not fatal;
+    the stages that need them fall back as usual.
+
+    Returns:
+        status() after warming up
+    """
+    ensure_nltk_data(download=config.NLTK_DOWNLOAD)
+    for name, loader in (("vader", vader), ("word_tokenize", word_tokenize),
+                         ("stopwords", english_stopwords), ("textblob", textblob),
+                         ("topic_model", topic_model)):
+        try:
+            loader()
+        except Exception as e:
+            print(f"Warning: could not load {name}: {str(e)}")
+    try:
+        # The tokenizer and TextBlob read their data lazily on first call
+        word_tokenize()("Warm up the tokenizer.")
+        textblob()("warm up").sentiment
+    except Exception as e:
+        print(f"Warning: analysis warm-up incomplete: {str(e)}")
+    _warm_up_done.set()
+    return status()
+
+
+def status():
+    """What has been loaded in this process and how long each load took."""
+    return {
+        "pid": os.getpid(),
+        "warmed_up": _warm_up_done.is_set(),
+        "nltk_data": _nltk_data,
+        "loaded": sorted(_loaded),
+        "load_seconds": dict(_load_seconds),
+    }
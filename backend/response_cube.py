@@ -0,0 +1,264 @@
+# response_cube.py
+#
+# Pre-aggregated response cube for dashboard filtering. Each analysis reduces
+# its rows to one cell per (location, score code, primary category)
+# combination that occurs, holding additive measures: response count, VADER
+# sentiment buckets, aspect sentiment tallies and a top-k keyword sketch. Any
+# slice (one location, detractors only, one category) is a sum over the
+# matching cells, so /cube/{id}/filter answers it without touching the rows.
+#
+# Summary, score distribution, location breakdown, sentiment, category and
+# aspect figures are exact sums. Keyword counts are approximate: each cell
+# keeps only its NPS_CUBE_SKETCH_SIZE most frequent words.
+import numpy as np
+import pandas as pd
+
+import config
+import sentiment_service
+from accumulators import NUM_SCORE_CODES, SEGMENT_BY_CODE, ScoreAccumulator
+from feedback_analysis import ASPECT_KEYWORDS, SENTIMENT_LABELS, summarize_aspects
+from heavy_hitters import HeavyHitters
+
+
+class ResponseCube:
+    """
+    Sparse cube: parallel arrays with one entry per non-empty cell.
+
+    Dimension arrays index into locations / categories (-1 for rows without
+    a location or without feedback); score codes are accumulators codes.
+    Keyword sketches are stored CSR-style: the entries of cell i are
+    keyword_ids/keyword_counts[keyword_ptr[i]:keyword_ptr[i + 1]].
+    """
+
+    def __init__(self, locations, categories, cell_location, cell_code, cell_category,
+                 responses, sentiment, aspects, vocabulary, keyword_ptr, keyword_ids, keyword_counts):
+        self.locations = locations
+        self.categories = categories
+        self.cell_location = cell_location
+        self.cell_code = cell_code
+        self.cell_category = cell_category
+        self.responses = responses
+        self.sentiment = sentiment
+        self.aspects = aspects
+        self.vocabulary = vocabulary
+        self.keyword_ptr = keyword_ptr
+        self.keyword_ids = keyword_ids
+        self.keyword_counts = keyword_counts
+
+    def __len__(self):
+        return len(self.responses)
+
+    def dimensions(self):
+        """Filterable values of every dimension."""
+        return {
+            "cells": len(self),
+            "locations": sorted(str(location) for location in self.locations),
+            "scores": list(range(11)),
+            "segments": ["promoter", "passive", "detractor"],
+            "categories": list(self.categories),
+        }
+
+    def select(self, locations=None, scores=None, segments=None, categories=None):
+        """
+        Mask of the cells matching a filter. Values within a dimension are
+        alternatives; dimensions are combined with AND.
+
+        Args:
+            locations: Location names
+            scores: Integer scores 0-10
+            segments: promoter/passive/detractor
+            categories: Primary category names
+
+        Returns:
+            Boolean array over the cells
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if locations:
+            wanted = set(locations)
+            ids = [i for i, location in enumerate(self.locations) if str(location) in wanted]
+            mask &= np.isin(self.cell_location, ids)
+        if scores:
+            mask &= np.isin(self.cell_code, list(scores))
+        if segments:
+            mask &= np.isin(SEGMENT_BY_CODE[self.cell_code], list(segments))
+        if categories:
+            ids = [i for i, category in enumerate(self.categories) if category in set(categories)]
+            mask &= np.isin(self.cell_category, ids)
+        return mask
+
+    def payload(self, mask, keywords=10, min_responses=10):
+        """
+        Aggregate the selected cells into analysis-shaped blocks.
+
+        Args:
+            mask: Boolean array over the cells, from select()
+            keywords: Number of top keywords to report
+            min_responses: Minimum responses for a location in locationBreakdown
+
+        Returns:
+            Dict of summary, scoreDistribution, locationBreakdown,
+            locationVolumes, feedbackSentiment, categoryDistribution,
+            aspectSentiment and keywordAnalysis, or None when no rows match
+        """
+        responses = self.responses[mask]
+        codes = self.cell_code[mask].astype(np.int64)
+        if responses.sum() == 0:
+            return None
+
+        # Score codes overall and per location, as ScoreAccumulator keeps them
+        code_counts = np.bincount(codes, weights=responses, minlength=NUM_SCORE_CODES).astype(np.int64)
+        located = self.cell_location[mask] >= 0
+        crosstab = np.bincount(self.cell_location[mask][located].astype(np.int64) * NUM_SCORE_CODES + codes[located],
+                               weights=responses[located],
+                               minlength=len(self.locations) * NUM_SCORE_CODES)
+        crosstab = crosstab.astype(np.int64).reshape(-1, NUM_SCORE_CODES)
+        present = np.flatnonzero(crosstab.sum(axis=1) > 0)
+        scores = ScoreAccumulator.from_counts(code_counts, [self.locations[i] for i in present], crosstab[present])
+        location_breakdown = scores.location_breakdown(min_responses=min_responses)
+
+        sentiment = dict(zip(SENTIMENT_LABELS, self.sentiment[mask].sum(axis=0).tolist()))
+        total_sentiment = sum(sentiment.values())
+        if total_sentiment > 0:
+            sentiment = {label: round(count / total_sentiment * 100) for label, count in sentiment.items()}
+
+        # Categories in order of first appearance, then by count (as the analysis sorts them)
+        with_feedback = self.cell_category[mask] >= 0
+        category_counts = np.bincount(self.cell_category[mask][with_feedback], weights=responses[with_feedback],
+                                      minlength=len(self.categories)).astype(np.int64)
+        category_distribution = sorted(
+            ({"name": name, "count": int(count)} for name, count in zip(self.categories, category_counts) if count),
+            key=lambda x: x["count"], reverse=True)
+
+        aspect_totals = self.aspects[mask].sum(axis=0)
+        aspect_sentiment = {
+            "aspect_sentiments": {},
+            "aspect_mentions": {},
+        }
+        for aspect, counts in zip(ASPECT_KEYWORDS, aspect_totals.tolist()):
+            tally = dict(zip(SENTIMENT_LABELS, counts))
+            tally["total"] = sum(counts)
+            aspect_sentiment["aspect_sentiments"][aspect] = tally
+            aspect_sentiment["aspect_mentions"][aspect] = tally["total"]
+        summarize_aspects(aspect_sentiment)
+
+        return {
+            "summary": scores.summary(),
+            "scoreDistribution": scores.score_distribution(),
+            "locationBreakdown": sorted(location_breakdown, key=lambda x: x["nps"], reverse=True),
+            "locationVolumes": scores.location_volumes(10),
+            "feedbackSentiment": sentiment,
+            "categoryDistribution": category_distribution,
+            "aspectSentiment": aspect_sentiment,
+            "keywordAnalysis": self.top_keywords(mask, keywords),
+        }
+
+    def top_keywords(self, mask, n=10):
+        """Most frequent keywords over the selected cells, from the merged sketches."""
+        entries = np.repeat(mask, np.diff(self.keyword_ptr))
+        counts = np.bincount(self.keyword_ids[entries], weights=self.keyword_counts[entries],
+                             minlength=len(self.vocabulary))
+        # Stable sort keeps tied keywords in a deterministic order
+        top = np.argsort(-counts, kind="stable")[:n]
+        return [{"keyword": self.vocabulary[i], "count": int(counts[i])} for i in top if counts[i] > 0]
+
+
+def build_cube(ingest, derived, mentions, sketch_size=None):
+    """
+    Aggregate an analysed upload into a ResponseCube.
+
+    Args:
+        ingest: IngestResult of the upload
+        derived: Per-corpus-row fields from the analysis ("vader_compound",
+            "primary_category"); missing entries leave those measures empty
+        mentions: Aspect mention arrays filled by analyze_aspect_sentiment(),
+            or an empty dict
+        sketch_size: Keywords kept per cell (defaults to config.CUBE_SKETCH_SIZE)
+
+    Returns:
+        ResponseCube
+    """
+    sketch_size = sketch_size or config.CUBE_SKETCH_SIZE
+    df = ingest.df
+    codes = ingest.score_codes.astype(np.int64)
+
+    if ingest.location_col:
+        # First-appearance order, like ScoreAccumulator; missing locations are -1
+        location_ids, locations = pd.factorize(df[ingest.location_col], sort=False)
+        locations = locations.tolist()
+    else:
+        location_ids, locations = np.full(len(df), -1, dtype=np.int64), []
+
+    category_ids = np.full(len(df), -1, dtype=np.int64)
+    categories = []
+    corpus = ingest.corpus
+    positions = np.zeros(0, dtype=np.int64)
+    if corpus is not None:
+        # Feedback rows are a subset of the scored rows, with the same index
+        positions = df.index.get_indexer(corpus.frame.index)
+        if derived.get("primary_category") is not None:
+            corpus_categories, categories = pd.factorize(pd.Series(derived["primary_category"]), sort=False)
+            category_ids[positions] = corpus_categories
+            categories = categories.tolist()
+
+    # One cell per distinct (location, code, category) triple
+    keys = ((location_ids + 1) * NUM_SCORE_CODES + codes) * (len(categories) + 1) + (category_ids + 1)
+    cells, row_cell = np.unique(keys, return_inverse=True)
+    n_cells = len(cells)
+    cell_category = (cells % (len(categories) + 1) - 1).astype(np.int16)
+    cell_code = (cells // (len(categories) + 1) % NUM_SCORE_CODES).astype(np.int8)
+    cell_location = (cells // (len(categories) + 1) // NUM_SCORE_CODES - 1).astype(np.int32)
+    responses = np.bincount(row_cell, minlength=n_cells).astype(np.int32)
+
+    sentiment = np.zeros((n_cells, len(SENTIMENT_LABELS)), dtype=np.int32)
+    compounds = derived.get("vader_compound")
+    if compounds is not None:
+        scored = [(position, SENTIMENT_LABELS.index(sentiment_service.vader_label(compound)))
+                  for position, compound in zip(positions, compounds) if compound is not None]
+        if scored:
+            rows, labels = np.array(scored, dtype=np.int64).T
+            sentiment += np.bincount(row_cell[rows] * len(SENTIMENT_LABELS) + labels,
+                                     minlength=n_cells * len(SENTIMENT_LABELS)).reshape(n_cells, -1).astype(np.int32)
+
+    aspect_shape = (n_cells, len(ASPECT_KEYWORDS), len(SENTIMENT_LABELS))
+    aspects = np.zeros(aspect_shape, dtype=np.int32)
+    if mentions.get("rows") is not None and len(mentions["rows"]):
+        mention_cells = row_cell[positions[mentions["rows"]]]
+        flat = ((mention_cells * len(ASPECT_KEYWORDS) + mentions["aspects"]) * len(SENTIMENT_LABELS)
+                + mentions["labels"])
+        aspects += np.bincount(flat, minlength=aspects.size).reshape(aspect_shape).astype(np.int32)
+
+    # Keyword sketches over the same rows as the overall keyword counts
+    cell_words = {}
+    if corpus is not None and not corpus.tokenize_error:
+        frame = corpus.frame
+        for position, text, is_str, words in zip(positions, frame["text"], frame["is_str"], frame["tokens"]):
+            if is_str and len(text) > 5 and words:
+                cell_words.setdefault(row_cell[position], HeavyHitters()).update(words)
+
+    vocabulary = {}
+    keyword_ptr = np.zeros(n_cells + 1, dtype=np.int64)
+    keyword_ids = []
+    keyword_counts = []
+    for cell in range(n_cells):
+        words = cell_words.get(cell)
+        if words:
+            for word, count in words.most_common(sketch_size):
+                keyword_ids.append(vocabulary.setdefault(word, len(vocabulary)))
+                keyword_counts.append(count)
+        keyword_ptr[cell + 1] = len(keyword_ids)
+
+    return ResponseCube(
+        locations=locations,
+        categories=categories,
+        cell_location=cell_location,
+        cell_code=cell_code,
+        cell_category=cell_category,
+        responses=responses,
+        sentiment=sentiment,
+        aspects=aspects,
+        vocabulary=list(vocabulary),
+        keyword_ptr=keyword_ptr,
+        keyword_ids=np.asarray(keyword_ids, dtype=np.int32),
+        keyword_counts=np.asarray(keyword_counts, dtype=np.int32),
+    )
+
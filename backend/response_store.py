@@ -0,0 +1,439 @@
+# response_store.py
+#
+# Persistent columnar store of analysed responses. When an upload is analysed
+# with persist=true, its cleaned rows are appended to a Parquet dataset under
+# NPS_STORE_DIR, hive-partitioned by upload date and upload id, together with
+# the per-row fields the pipeline already derived (segment, VADER compound,
+# TextBlob polarity, primary category, aspect hits). Rows are keyed by their
+# source response id when the export has one, otherwise by a hash of their
+# content and response date, so uploading an export that overlaps earlier
+# ones only adds the responses the store has not seen. The keys of stored
+# rows are kept in an index beside the partitions, sharded by their first
+# byte, so an append reads only the index shards its rows fall into rather
+# than every stored row.
+#
+# The query functions rebuild the summary, location and category payloads
+# from the stored columns: each scan reads only the columns it needs and
+# pushes the location/segment/date filters down to the Parquet reader (date
+# and upload filters prune whole partitions), and nothing is re-scored.
+#
+# Uploads with a response-date column also add their new rows to per-day
+# trend buckets kept beside the partitions (see trends.py), which
+# /store/trends reads instead of the rows.
+import datetime
+import functools
+import hashlib
+import operator
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import config
+import text_scoring
+from accumulators import ScoreAccumulator, SEGMENT_BY_CODE
+from feedback_analysis import ASPECT_KEYWORDS
+from file_lock import FileLock
+from trends import TrendBuckets
+
+# Columns written for every row. Feedback-derived fields are null for rows
+# without feedback and for stages that fell back.
+ROW_SCHEMA = pa.schema([
+    ("row_hash", pa.binary(16)),
+    ("response_id", pa.string()),
+    ("score", pa.float64()),
+    ("score_code", pa.int8()),
+    ("segment", pa.string()),
+    ("location", pa.string()),
+    ("response_date", pa.date32()),
+    ("feedback", pa.string()),
+    ("vader_compound", pa.float64()),
+    ("textblob_polarity", pa.float64()),
+    ("primary_category", pa.string()),
+    ("aspects", pa.list_(pa.string())),
+])
+
+# Hive partition keys: <store>/upload_date=YYYY-MM-DD/upload_id=<id>/part-*.parquet
+PARTITION_SCHEMA = pa.schema([
+    ("upload_date", pa.string()),
+    ("upload_id", pa.string()),
+])
+
+# Per-row fields handed over by the analysis, aligned with the corpus rows
+DERIVED_FIELDS = ("vader_compound", "textblob_polarity", "primary_category", "aspects")
+
+# Trend buckets of the stored rows; the underscore keeps the dataset scan off it
+TRENDS_FILE = "_trends.npz"
+
+# Row key index: <store>/_row_index/<first key byte as hex>.npy, one array of
+# 16-byte keys per shard
+INDEX_DIR = "_row_index"
+
+
+def store_dir(directory=None):
+    """The configured store directory; raises ValueError when there is none."""
+    directory = directory or config.STORE_DIR
+    if not directory:
+        raise ValueError("No response store is configured (set NPS_STORE_DIR)")
+    return directory
+
+
+def _dataset(directory):
+    """All stored rows as one dataset, or None before the first append."""
+    if not os.path.isdir(directory):
+        return None
+    # Files being written are dot-prefixed and ignored until renamed
+    return ds.dataset(directory, format="parquet",
+                      schema=pa.unify_schemas([ROW_SCHEMA, PARTITION_SCHEMA]),
+                      partitioning=ds.partitioning(PARTITION_SCHEMA, flavor="hive"))
+
+
+def row_hashes(scores, locations, feedback, dates=None, ids=None):
+    """
+    128-bit dedup key of every row of an upload.
+
+    A row with a source response id is keyed by that id alone, so the same
+    response in two exports is stored once and two different responses never
+    collide. Rows without one are keyed by their content and response date.
+    Identical responses are legitimate (two blank 10s from one store on one
+    day), so the n-th repeat of such a row within the upload hashes
+    differently from the first. An export that overlaps an earlier one
+    therefore maps its old rows to the keys already stored and only its new
+    rows to new keys.
+
+    Args:
+        scores: Numeric scores
+        locations: Location strings or None, aligned with scores
+        feedback: Feedback strings or None, aligned with scores
+        dates: Optional response dates (YYYY-MM-DD strings or None), aligned with scores
+        ids: Optional source response ids (strings or None), aligned with scores
+
+    Returns:
+        List of 16-byte digests
+    """
+    dates = [None] * len(scores) if dates is None else dates
+    ids = [None] * len(scores) if ids is None else ids
+    repeats = {}
+    hashes = []
+    for score, location, text, date, response_id in zip(scores, locations, feedback, dates, ids):
+        if response_id is not None:
+            key = f"id\x1f{response_id}"
+        else:
+            key = "\x1f".join([repr(float(score)),
+                               "\x00" if location is None else location,
+                               "\x00" if text is None else text,
+                               "\x00" if date is None else date])
+            n = repeats.get(key, 0)
+            repeats[key] = n + 1
+            key = f"{key}\x1e{n}"
+        hashes.append(hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest())
+    return hashes
+
+
+def _as_strings(values):
+    """Series of str values with missing entries as None."""
+    return values.astype(str).where(values.notna(), None)
+
+
+def _upload_rows(ingest, derived):
+    """Build the stored rows of an upload as a DataFrame in ROW_SCHEMA order."""
+    df = ingest.df
+    rows = pd.DataFrame(index=df.index)
+    rows["score"] = df[ingest.score_col].astype(float)
+    rows["score_code"] = ingest.score_codes
+    rows["segment"] = SEGMENT_BY_CODE[ingest.score_codes]
+    rows["location"] = _as_strings(df[ingest.location_col]) if ingest.location_col else None
+    rows["response_id"] = _as_strings(df[ingest.id_col]) if ingest.id_col else None
+    dates = None
+    if ingest.response_days is not None:
+        # Day numbers view as dates; unparseable ones (trends.MISSING_DAY) are NaT
+        rows["response_date"] = ingest.response_days.view("datetime64[D]")
+        dates = pd.Series(np.datetime_as_string(rows["response_date"].to_numpy()), index=df.index)
+        dates = dates.where(rows["response_date"].notna(), None)
+    else:
+        rows["response_date"] = None
+
+    if ingest.corpus is not None:
+        # Feedback rows are a subset of the scored rows, with the same index
+        frame = ingest.corpus.frame
+        per_row = pd.DataFrame({"feedback": frame["text"]}, index=frame.index)
+        for field in DERIVED_FIELDS:
+            values = derived.get(field)
+            per_row[field] = values if values is not None else None
+        # Rows without feedback get nulls in every feedback-derived column
+        per_row = per_row.reindex(df.index)
+        for column in per_row.columns:
+            rows[column] = per_row[column].astype(object).where(per_row[column].notna(), None)
+    else:
+        for column in ("feedback",) + DERIVED_FIELDS:
+            rows[column] = None
+
+    rows["row_hash"] = row_hashes(rows["score"], rows["location"], rows["feedback"], dates,
+                                  rows["response_id"] if ingest.id_col else None)
+    return rows[ROW_SCHEMA.names]
+
+
+def _shard_path(directory, shard):
+    return os.path.join(directory, INDEX_DIR, f"{shard:02x}.npy")
+
+
+def _shards(keys):
+    """Index shard (first key byte) of each of an S16 array of keys."""
+    return np.frombuffer(keys.tobytes(), dtype=np.uint8)[::16]
+
+
+def _load_shard(path):
+    if not os.path.exists(path):
+        return np.zeros(0, dtype="S16")
+    return np.load(path)
+
+
+def _save_shard(path, keys):
+    # Written beside and renamed over, like the Parquet parts
+    tmp_path = os.path.join(os.path.dirname(path), "." + os.path.basename(path))
+    with open(tmp_path, "wb") as f:
+        np.save(f, keys)
+    os.replace(tmp_path, path)
+
+
+def _build_index(directory):
+    """Index the rows of a store written before the index existed."""
+    os.makedirs(os.path.join(directory, INDEX_DIR), exist_ok=True)
+    stored = _dataset(directory).to_table(columns=["row_hash"]).column("row_hash").to_pylist()
+    keys = np.array(stored, dtype="S16")
+    shards = _shards(keys)
+    for shard in np.unique(shards):
+        _save_shard(_shard_path(directory, shard), keys[shards == shard])
+
+
+def _new_rows(directory, hashes):
+    """
+    Rows of an upload the store does not hold yet.
+
+    Only the index shards the upload's keys fall into are read.
+
+    Args:
+        directory: Store directory
+        hashes: Row keys from row_hashes()
+
+    Returns:
+        Tuple of (boolean numpy mask of the rows to add: first occurrences
+        within the upload whose key is not stored; dict of shard path ->
+        shard keys including the added rows, to save once they are written)
+    """
+    if not os.path.isdir(os.path.join(directory, INDEX_DIR)):
+        _build_index(directory)
+    keys = np.array(hashes, dtype="S16")
+    added = np.zeros(len(keys), dtype=bool)
+    added[np.unique(keys, return_index=True)[1]] = True
+    shards = _shards(keys)
+    updates = {}
+    for shard in np.unique(shards):
+        path = _shard_path(directory, shard)
+        stored = _load_shard(path)
+        in_shard = added & (shards == shard)
+        added[in_shard] = ~np.isin(keys[in_shard], stored)
+        updates[path] = np.concatenate([stored, keys[added & (shards == shard)]])
+    return added, updates
+
+
+def append_upload(ingest, derived, upload_id, directory=None):
+    """
+    Append an analysed upload's rows, skipping rows the store already holds.
+
+    Args:
+        ingest: IngestResult of the upload
+        derived: Dict of DERIVED_FIELDS -> per-row lists aligned with the
+            corpus rows (a missing or None entry stores nulls)
+        upload_id: Partition name for this upload (e.g. a prefix of its digest)
+        directory: Store directory (defaults to config.STORE_DIR)
+
+    Returns:
+        Dict with the upload id and date, and how many rows were added or
+        skipped as already stored
+    """
+    directory = store_dir(directory)
+    upload_rows = _upload_rows(ingest, derived)
+    table = pa.Table.from_pandas(upload_rows, schema=ROW_SCHEMA, preserve_index=False)
+    upload_date = datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+    rows = table.num_rows
+
+    os.makedirs(directory, exist_ok=True)
+    # One writer at a time, so two uploads of the same rows cannot both add them
+    with FileLock(directory):
+        added, index_updates = _new_rows(directory, upload_rows["row_hash"].tolist())
+        table = table.filter(pa.array(added))
+        if table.num_rows > 0:
+            partition = os.path.join(directory, f"upload_date={upload_date}", f"upload_id={upload_id}")
+            os.makedirs(partition, exist_ok=True)
+            name = f"part-{uuid.uuid4().hex}.parquet"
+            tmp_path = os.path.join(partition, "." + name)
+            pq.write_table(table, tmp_path)
+            os.replace(tmp_path, os.path.join(partition, name))
+            # Keys are indexed only once their rows are stored
+            for path, keys in index_updates.items():
+                _save_shard(path, keys)
+            if ingest.response_days is not None:
+                _add_trends(directory, upload_rows, ingest.response_days, added)
+
+    print(f"Response store: added {table.num_rows} of {rows} rows for upload {upload_id}")
+    return {
+        "upload_id": upload_id,
+        "upload_date": upload_date,
+        "rows": rows,
+        "added": table.num_rows,
+        "skipped": rows - table.num_rows,
+    }
+
+
+def _add_trends(directory, rows, days, added):
+    """Add the newly stored rows (added mask) to the trend buckets."""
+    rows, days = rows[added], days[added]
+    path = os.path.join(directory, TRENDS_FILE)
+    trends = TrendBuckets.load(path)
+    trends.add(days, rows["score_code"].to_numpy(), rows["location"])
+    trends.save(path)
+
+
+def load_trends(directory=None):
+    """
+    Trend buckets of the stored rows with a response date.
+
+    Returns:
+        TrendBuckets (empty before the first dated upload)
+    """
+    return TrendBuckets.load(os.path.join(store_dir(directory), TRENDS_FILE))
+
+
+def _iso_date(value):
+    return datetime.date.fromisoformat(value).isoformat()
+
+
+def row_filter(locations=None, segments=None, since=None, until=None, upload_id=None):
+    """
+    Predicate over stored rows; every argument is optional.
+
+    Args:
+        locations: Location names to keep
+        segments: promoter/passive/detractor values to keep
+        since: First upload date to include (YYYY-MM-DD)
+        until: Last upload date to include (YYYY-MM-DD)
+        upload_id: Restrict to one upload
+
+    Returns:
+        pyarrow dataset expression, or None for all rows
+
+    Raises:
+        ValueError: When a date is not in YYYY-MM-DD form
+    """
+    conditions = []
+    if locations:
+        conditions.append(ds.field("location").isin(list(locations)))
+    if segments:
+        conditions.append(ds.field("segment").isin(list(segments)))
+    # Partition keys: these skip whole directories rather than rows
+    if since:
+        conditions.append(ds.field("upload_date") >= _iso_date(since))
+    if until:
+        conditions.append(ds.field("upload_date") <= _iso_date(until))
+    if upload_id:
+        conditions.append(ds.field("upload_id") == upload_id)
+    return functools.reduce(operator.and_, conditions) if conditions else None
+
+
+def _scan(columns, predicate, directory):
+    """Record batches of the given columns for the rows matching predicate."""
+    dataset = _dataset(store_dir(directory))
+    if dataset is None:
+        return
+    yield from dataset.to_batches(columns=columns, filter=predicate)
+
+
+def _percentages(counts):
+    total = sum(counts.values())
+    if total > 0:
+        return {key: round(count / total * 100) for key, count in counts.items()}
+    return counts
+
+
+def query_summary(predicate=None, directory=None):
+    """
+    NPS summary, score distribution and feedback sentiment of stored rows.
+
+    Returns:
+        Dict with summary, scoreDistribution and feedbackSentiment shaped as
+        in the analysis response, or None when no rows match
+    """
+    scores = ScoreAccumulator()
+    sentiment = {"positive": 0, "neutral": 0, "negative": 0}
+    for batch in _scan(["score_code", "vader_compound"], predicate, directory):
+        scores.add_chunk(batch.column("score_code").to_numpy())
+        compounds = batch.column("vader_compound").drop_null().to_pylist()
+        for label, count in text_scoring.vader_counts(compounds).items():
+            sentiment[label] += count
+    if scores.total == 0:
+        return None
+    return {
+        "summary": scores.summary(),
+        "scoreDistribution": scores.score_distribution(),
+        "feedbackSentiment": _percentages(sentiment),
+    }
+
+
+def query_locations(predicate=None, min_responses=10, directory=None):
+    """
+    Location payloads of stored rows, shaped as in the analysis response.
+
+    Returns:
+        Dict with locationBreakdown, locationVolumes, topLocations,
+        bottomLocations and highVolumeLocations, or None when no rows match
+    """
+    scores = ScoreAccumulator()
+    for batch in _scan(["score_code", "location"], predicate, directory):
+        scores.add_chunk(batch.column("score_code").to_numpy(), batch.column("location").to_pandas())
+    if scores.total == 0:
+        return None
+    location_breakdown = scores.location_breakdown(min_responses=min_responses)
+    return {
+        "locationBreakdown": sorted(location_breakdown, key=lambda x: x["nps"], reverse=True),
+        "locationVolumes": scores.location_volumes(10),
+        "topLocations": sorted(location_breakdown, key=lambda x: x["nps"], reverse=True)[:3],
+        "bottomLocations": sorted(location_breakdown, key=lambda x: x["nps"])[:3],
+        "highVolumeLocations": sorted(location_breakdown, key=lambda x: x["responses"], reverse=True)[:5],
+    }
+
+
+def query_categories(predicate=None, directory=None):
+    """
+    Primary category distribution and aspect mentions of stored feedback.
+
+    Returns:
+        Dict with categoryDistribution (shaped as in the analysis response),
+        aspectMentions (responses mentioning each aspect) and the number of
+        feedback responses, or None when no feedback rows match
+    """
+    has_feedback = ds.field("primary_category").is_valid()
+    predicate = has_feedback if predicate is None else predicate & has_feedback
+    category_counts = {}
+    aspect_counts = {aspect: 0 for aspect in ASPECT_KEYWORDS}
+    for batch in _scan(["primary_category", "aspects"], predicate, directory):
+        # value_counts keeps first-appearance order, like the analysis' dict
+        for item in pc.value_counts(batch.column("primary_category")).to_pylist():
+            category_counts[item["values"]] = category_counts.get(item["values"], 0) + item["counts"]
+        for item in pc.value_counts(pc.list_flatten(batch.column("aspects"))).to_pylist():
+            aspect_counts[item["values"]] = aspect_counts.get(item["values"], 0) + item["counts"]
+    if not category_counts:
+        return None
+    return {
+        "responses": sum(category_counts.values()),
+        "categoryDistribution": [
+            {"name": category, "count": count}
+            for category, count in sorted(category_counts.items(), key=lambda x: x[1], reverse=True)
+        ],
+        "aspectMentions": aspect_counts,
+    }
@@ -0,0 +1,143 @@
+# result_cache.py
+#
+# Content-addressed cache of rendered analysis responses. Entries are keyed by
+# the SHA-256 of the uploaded bytes plus the analysis version, so re-uploading
+# an identical export returns the stored JSON without re-running the pipeline,
+# and changing the keyword tables or model parameters invalidates everything.
+#
+# On disk, entries live in <directory>/nps-result-cache/<version>/. Nothing
+# outside the current version's directory is ever deleted: the configured
+# directory may be shared, and deployments on other versions may still be
+# reading theirs. Stale version directories are left for an operator to remove.
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Child of the configured directory that holds one directory per analysis version
+CACHE_SUBDIR = "nps-result-cache"
+
+
+class ResultCache:
+    """
+    Two-tier cache: an in-memory LRU bounded by total bytes, and an optional
+    directory of JSON files that survives restarts and is shared by workers.
+    """
+
+    def __init__(self, version, max_bytes, directory=None):
+        self.version = version
+        self.max_bytes = max_bytes
+        self.directory = os.path.join(directory, CACHE_SUBDIR, version) if directory else None
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _disk_path(self, digest):
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get(self, digest):
+        """
+        Look up a rendered response by upload digest.
+
+        Args:
+            digest: Hex SHA-256 of the uploaded bytes
+
+        Returns:
+            The cached JSON body as bytes, or None on a miss
+        """
+        with self._lock:
+            body = self._entries.get(digest)
+            if body is not None:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return body
+
+        if self.directory:
+            try:
+                with open(self._disk_path(digest), 'rb') as f:
+                    body = f.read()
+            except OSError:
+                body = None
+            if body is not None:
+                self._remember(digest, body)
+                with self._lock:
+                    self.hits += 1
+                return body
+
+        self.record_miss()
+        return None
+
+    def record_miss(self):
+        """Count a lookup answered without consulting the cache (e.g. its entry is known to be stale)."""
+        with self._lock:
+            self.misses += 1
+
+    def put(self, digest, body):
+        """Store a rendered JSON response in both tiers."""
+        self._remember(digest, body)
+
+        if self.directory:
+            # Write to a temp file first so readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(body)
+                os.replace(tmp_path, self._disk_path(digest))
+            except OSError as e:
+                print(f"Warning: could not write result cache entry: {str(e)}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def _remember(self, digest, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(digest, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[digest] = body
+            self._bytes += len(body)
+            # Evict least recently used entries until under the byte budget
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "version": self.version,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk": self.directory is not None,
+            }
+
+
+class ObjectCache:
+    """In-memory LRU of live objects (e.g. response cubes) by id, bounded by count."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
@@ -0,0 +1,82 @@
+# sentiment_service.py
+#
+# Process-wide sentiment scoring. The VADER analyzer is built once per process
+# (lazily, via nlp_resources) and both VADER and TextBlob results are memoized
+# in bounded LRU caches, so recurring feedback and sentences ("Great service.",
+# "Delivery was late.") are scored once across rows, across the document and
+# sentence passes, and across requests handled by the same worker.
+#
+# The "batch" engine scores a whole list of texts at once instead (see
+# vader_batch.py); it is selected per request for large uploads.
+import functools
+
+import config
+import nlp_resources
+import vader_batch
+
+ENGINES = ("exact", "batch")
+
+
+def normalize(text):
+    """
+    Collapse runs of whitespace.
+
+    VADER splits on whitespace before scoring, so this never changes a score
+    but lets "Great  service." and "Great service." share a cache entry.
+    """
+    return " ".join(text.split())
+
+
+@functools.lru_cache(maxsize=config.SENTIMENT_CACHE_SIZE)
+def _vader_compound(normalized_text):
+    return nlp_resources.vader().polarity_scores(normalized_text)['compound']
+
+
+def vader_compound(text):
+    """VADER compound score of a document or sentence, memoized."""
+    return _vader_compound(normalize(text))
+
+
+def vader_compounds(texts, engine="exact"):
+    """
+    VADER compound scores of many texts.
+
+    Args:
+        texts: List of strings
+        engine: "exact" (per text, memoized) or "batch" (vectorized)
+
+    Returns:
+        List of floats aligned with texts
+    """
+    if engine == "batch":
+        return vader_batch.compounds(list(texts)).tolist()
+    return [vader_compound(text) for text in texts]
+
+
+def vader_label(compound):
+    """Classify a VADER compound score as positive, negative or neutral."""
+    if compound >= 0.05:
+        return "positive"
+    if compound <= -0.05:
+        return "negative"
+    return "neutral"
+
+
+@functools.lru_cache(maxsize=config.SENTIMENT_CACHE_SIZE)
+def textblob_polarity(text):
+    """TextBlob polarity of a text, memoized on the exact text."""
+    return nlp_resources.textblob()(text).sentiment.polarity
+
+
+def cache_info():
+    """Hit/miss counters of the sentiment caches."""
+    return {
+        "vader": _vader_compound.cache_info()._asdict(),
+        "textblob": textblob_polarity.cache_info()._asdict(),
+    }
+
+
+def clear_caches():
+    """Empty both memo caches (used by benchmarks to measure cold scoring)."""
+    _vader_compound.cache_clear()
+    textblob_polarity.cache_clear()
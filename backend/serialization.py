@@ -0,0 +1,136 @@
+# serialization.py
+#
+# Rendering of the large JSON payloads. Bodies are encoded with orjson when
+# it is installed: it writes numpy scalars and arrays natively and skips the
+# recursive copy jsonable_encoder makes of the whole payload. Without it the
+# stdlib encoding that JSONResponse uses is the fallback. Bodies are rendered
+# once (and cached as bytes); per request they may be reshaped to the
+# columnar layout and compressed with brotli or gzip, as the client asks.
+import functools
+import gzip
+import json
+
+from fastapi.encoders import jsonable_encoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - the stdlib encoder is used instead
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - only gzip is offered
+    brotli = None
+
+# "records" is the layout the frontend reads; "columnar" turns the blocks in
+# COLUMNAR_BLOCKS from lists of same-shaped objects into one list per field
+LAYOUTS = ("records", "columnar")
+COLUMNAR_BLOCKS = (
+    "scoreDistribution", "locationBreakdown", "locationVolumes", "topLocations", "bottomLocations",
+    "highVolumeLocations", "keywordAnalysis", "promoterKeywords", "detractorKeywords", "categoryDistribution",
+)
+
+GZIP_LEVEL = 6
+# Brotli's default (11) is meant for static assets and far too slow per request
+BROTLI_QUALITY = 5
+
+
+def _default(obj):
+    # Anything orjson does not know natively (sets, pydantic models, ...)
+    return jsonable_encoder(obj)
+
+
+def dumps(content):
+    """
+    Encode a payload as compact UTF-8 JSON.
+
+    Args:
+        content: JSON-compatible structure; numpy scalars and arrays are allowed
+
+    Returns:
+        bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def loads(body):
+    """Decode a body produced by dumps()."""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def columns(rows):
+    """
+    Columnar form of a list of records.
+
+    Args:
+        rows: List of dicts
+
+    Returns:
+        Dict of field -> list of values, fields in order of first appearance
+        (None where a record lacks the field)
+    """
+    fields = list(dict.fromkeys(field for row in rows for field in row))
+    return {field: [row.get(field) for row in rows] for field in fields}
+
+
+def to_columnar(payload):
+    """Copy of a payload with each block of COLUMNAR_BLOCKS in columnar form."""
+    reshaped = dict(payload)
+    for key in COLUMNAR_BLOCKS:
+        if isinstance(payload.get(key), list):
+            reshaped[key] = columns(payload[key])
+    return reshaped
+
+
+def reshape(body, layout):
+    """A rendered payload body in the requested layout (unchanged for "records")."""
+    if layout != "columnar":
+        return body
+    return dumps(to_columnar(loads(body)))
+
+
+def negotiate(accept_encoding):
+    """
+    Pick a response compression from an Accept-Encoding header.
+
+    Args:
+        accept_encoding: Header value, e.g. "gzip, deflate, br;q=0.9", or None
+
+    Returns:
+        "br", "gzip" or None; brotli wins ties when it is installed
+    """
+    offered = {"gzip": 0.0, "br": 0.0}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if name not in offered:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        offered[name] = quality
+    if brotli is None:
+        offered["br"] = 0.0
+    best = max(("br", "gzip"), key=lambda name: offered[name])
+    return best if offered[best] > 0 else None
+
+
+# Cache hits and repeated slices send the same bytes again; keep the last few
+# compressed bodies instead of compressing them per request
+@functools.lru_cache(maxsize=8)
+def compress(body, encoding):
+    """Compress a body for the Content-Encoding returned by negotiate()."""
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # A fixed mtime keeps the output the same for the same body
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
@@ -0,0 +1,10 @@
+# conftest.py
+#
+# The backend modules import each other as top-level modules (as main.py
+# runs them), so the backend directory goes on the path for the tests.
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
@@ -0,0 +1,91 @@
+# test_vader_batch.py
+#
+# Deterministic parity cases for the batch VADER engine: each one exercises a
+# rule vader_batch.py reimplements and must score exactly what NLTK's
+# SentimentIntensityAnalyzer.polarity_scores()['compound'] gives.
+# benchmarks/vader_parity.py runs the same comparison over whole exports.
+import pytest
+
+import nlp_resources
+import vader_batch
+
+CASES = {
+    "but shift": [
+        "The staff were great but the checkout was slow",
+        "Terrible delivery, but the fit is lovely",
+        "but it was fine",
+        "Good, BUT awful",
+        "great but",
+    ],
+    "never so": [
+        "I have never been so happy with an order",
+        "never so bad",
+        "It was never this good",
+        "never been this disappointed",
+    ],
+    "at least / least": [
+        "At least the staff were friendly",
+        "at least it was not terrible",
+        "the least helpful support ever",
+        "very least helpful",
+    ],
+    "kind of / sort of": [
+        "It was kind of good",
+        "sort of helpful I guess",
+        "kind of terrible but nice staff",
+        "the kind of service I love",
+    ],
+    "ALL-CAPS differential": [
+        "The service was GREAT",
+        "THE SERVICE WAS GREAT",
+        "GREAT service, VERY slow delivery",
+        "I LOVE it but it is NOT good",
+        "EXTREMELY bad",
+    ],
+    "punctuation-attached tokens": [
+        "good!",
+        "great!!! would buy again",
+        "bad?",
+        "I don't, like it",
+        "Terrible... just terrible",
+        ":-) lovely",
+        "(amazing) fabric",
+        "wow!!! really??",
+        "not-good",
+        "great,but slow",
+    ],
+    "repeated words": [
+        "good good good",
+        "not good, good",
+        "great but great",
+        "bad very bad",
+        "The food was not bad. The service was bad",
+        "never so good. good",
+    ],
+    "degenerate": [
+        "",
+        "!!!",
+        "ok",
+    ],
+}
+
+ALL_CASES = [text for texts in CASES.values() for text in texts]
+
+
+@pytest.fixture(scope="module")
+def analyzer():
+    try:
+        return nlp_resources.vader()
+    except LookupError:
+        pytest.skip("VADER lexicon is not installed (python -m nltk.downloader vader_lexicon)")
+
+
+@pytest.mark.parametrize("text", ALL_CASES)
+def test_matches_nltk(analyzer, text):
+    assert vader_batch.compounds([text])[0] == analyzer.polarity_scores(text)["compound"]
+
+
+def test_batch_matches_one_by_one(analyzer):
+    # Rules look back across token positions; none may reach into the previous text
+    expected = [analyzer.polarity_scores(text)["compound"] for text in ALL_CASES]
+    assert vader_batch.compounds(ALL_CASES).tolist() == expected
@@ -0,0 +1,183 @@
+# text_corpus.py
+#
+# Shared preprocessing for the feedback text stages. Every feedback row is
+# lowercased, split into sentences and tokenized exactly once; the keyword,
+# sentiment, emotion, topic, category and aspect stages all read from the
+# resulting corpus instead of re-scanning the raw strings.
+#
+# Feedback is highly repetitive ("N/A", "Nothing", "Good service"), so each
+# distinct text is preprocessed once and its rows share the results; the
+# text stages likewise score FeedbackCorpus.unique() texts once and map the
+# results back to every row (or weight them by multiplicity), which leaves
+# every count and percentage as if each row had been processed on its own.
+import re
+
+import numpy as np
+import pandas as pd
+
+import nlp_resources
+
+ADDITIONAL_STOPWORDS = {'would', 'could', 'should', 'also', 'one', 'etc', 'need', 'make', 'much', 'want', 'like'}
+
+# Sentence boundaries used by the aspect stage
+SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+')
+
+_stop_words = None
+
+
+def keyword_stopwords():
+    """NLTK English stopwords plus the project's extra filler words (loaded once)."""
+    global _stop_words
+    if _stop_words is None:
+        stop_words = set(nlp_resources.english_stopwords())
+        stop_words.update(ADDITIONAL_STOPWORDS)
+        _stop_words = stop_words
+    return _stop_words
+
+
+def keyword_tokens(text_lower, stop_words):
+    """Alphabetic, non-stopword tokens longer than 3 characters."""
+    words = nlp_resources.word_tokenize()(text_lower)
+    return [word for word in words if word.isalpha() and word not in stop_words and len(word) > 3]
+
+
+def _distinct(texts, is_str):
+    """
+    Distinct string values in order of appearance.
+
+    Returns:
+        Tuple of (numpy array of each row's index into the distinct values,
+        -1 for non-string rows; list of the distinct values)
+    """
+    codes, uniques = pd.factorize(pd.Series([text if ok else None for text, ok in zip(texts, is_str)],
+                                            dtype=object))
+    return codes, uniques.tolist()
+
+
+class FeedbackCorpus:
+    """
+    Feedback rows with every derived text field computed once.
+
+    The frame is indexed like the source rows and has the columns:
+        text: feedback text (non-string values are kept as-is in from_texts)
+        is_str: whether the raw value was a string (the keyword and
+            sentiment stages only read those rows)
+        lower: lowercased text
+        sentences: text split into sentences
+        sentences_lower: lowercased sentences, aligned with sentences
+        tokens: keyword tokens (empty for non-string values)
+        segment: promoter/passive/detractor, or None without scores
+    """
+
+    def __init__(self, frame, tokenize_error=None):
+        self.frame = frame
+        # Set when tokenization failed (e.g. missing punkt data); tokens are then empty
+        self.tokenize_error = tokenize_error
+        # Per-row keyword matches, filled on first use (see feedback_analysis.keyword_hits)
+        self.keyword_hits = None
+        self._unique = None
+
+    def __len__(self):
+        return len(self.frame)
+
+    def unique(self):
+        """
+        Rows grouped by identical feedback value (non-strings form one group).
+
+        Computed on first use; concurrent stages may both compute it, with
+        the same result.
+
+        Returns:
+            Tuple of (numpy array with the position of the first row of each
+            group, in order of appearance; numpy array with every row's group)
+        """
+        if self._unique is None:
+            codes, _ = _distinct(self.frame["text"], self.frame["is_str"])
+            # Renumber so the non-string group (-1) also takes its place by first appearance
+            inverse = pd.factorize(codes)[0]
+            first = np.unique(inverse, return_index=True)[1]
+            self._unique = (first, inverse)
+        return self._unique
+
+    @classmethod
+    def from_series(cls, values, segments=None, tokenize=True):
+        """
+        Build a corpus from a feedback column.
+
+        Missing values are dropped and the rest are converted with astype(str),
+        matching how the text stages have always read the column.
+
+        Args:
+            values: Series of raw feedback values
+            segments: Optional Series of NPS segment labels aligned with values
+            tokenize: Whether to compute keyword tokens
+
+        Returns:
+            FeedbackCorpus
+        """
+        values = values.dropna()
+        is_str = [isinstance(value, str) for value in values]
+        texts = values.astype(str).tolist()
+
+        if segments is not None:
+            segments = segments.loc[values.index].tolist()
+
+        return cls._build(texts, is_str, values.index, segments, tokenize)
+
+    @classmethod
+    def from_texts(cls, feedback_texts, tokenize=False):
+        """Build a corpus from a plain list of feedback values."""
+        feedback_texts = list(feedback_texts)
+        is_str = [isinstance(text, str) for text in feedback_texts]
+        return cls._build(feedback_texts, is_str, pd.RangeIndex(len(feedback_texts)), None, tokenize)
+
+    @classmethod
+    def _build(cls, texts, is_str, index, segments, tokenize):
+        # Preprocess each distinct string once; its rows share the results
+        codes, distinct = _distinct(texts, is_str)
+        distinct_lower = [text.lower() for text in distinct]
+        distinct_sentences = [SENTENCE_SPLIT.split(text) for text in distinct]
+        distinct_sentences_lower = [[sentence.lower() for sentence in split] for split in distinct_sentences]
+
+        distinct_tokens = [[] for _ in distinct]
+        tokenize_error = None
+        if tokenize:
+            try:
+                stop_words = keyword_stopwords()
+                distinct_tokens = [keyword_tokens(text_lower, stop_words) for text_lower in distinct_lower]
+            except Exception as e:
+                tokenize_error = str(e)
+                distinct_tokens = [[] for _ in distinct]
+
+        # Non-string values (-1) get no lowercase text, sentences or tokens
+        lower = [distinct_lower[code] if code >= 0 else None for code in codes]
+        sentences = [distinct_sentences[code] if code >= 0 else [] for code in codes]
+        sentences_lower = [distinct_sentences_lower[code] if code >= 0 else [] for code in codes]
+        tokens = [distinct_tokens[code] if code >= 0 else [] for code in codes]
+
+        frame = pd.DataFrame({
+            "text": texts,
+            "is_str": is_str,
+            "lower": lower,
+            "sentences": sentences,
+            "sentences_lower": sentences_lower,
+            "tokens": tokens,
+            "segment": segments if segments is not None else [None] * len(texts),
+        }, index=index)
+        return cls(frame, tokenize_error)
+
+    @classmethod
+    def concat(cls, corpora):
+        """Join per-chunk corpora into one."""
+        corpora = list(corpora)
+        if not corpora:
+            return cls.from_texts([])
+        tokenize_error = next((c.tokenize_error for c in corpora if c.tokenize_error), None)
+        return cls(pd.concat([c.frame for c in corpora]), tokenize_error)
+
+
+def as_corpus(feedback_texts):
+    """Return feedback_texts as a FeedbackCorpus, building one from a list if needed."""
+    if isinstance(feedback_texts, FeedbackCorpus):
+        return feedback_texts
+    return FeedbackCorpus.from_texts(feedback_texts)
@@ -0,0 +1,203 @@
+# text_scoring.py
+#
+# Per-row text scoring sharded across CPU cores. Large inputs are split into
+# row blocks and scored on a pool of shard processes: the document VADER and
+# TextBlob passes return one score per row (kept for the response store), the
+# aspect pass small partial tallies with capped samples. Blocks are merged in
+# order, so the output is identical to a serial run, including which samples
+# are kept. Inputs below NPS_TEXT_PARALLEL_MIN_ROWS are scored serially
+# in-process, where pool overhead would dominate. Only distinct feedback
+# texts are scored (see FeedbackCorpus.unique()); rows with the same text
+# share its score. VADER scores come from the engine the request picked
+# (sentiment_service.ENGINES); with "batch" each block is scored in one
+# vectorized pass instead of text by text.
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import util
+
+import config
+import nlp_resources
+import sentiment_service
+
+INTENSITY_LEVELS = ("strong_positive", "moderate_positive", "neutral", "moderate_negative", "strong_negative")
+
+_pool = None
+# Independent analysis stages may start scoring from several threads at once
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            return _pool
+        # The pool is started from a stage thread while other stages run;
+        # forking then could copy a lock another thread holds, so the shard
+        # processes come from a fork server (or are spawned) instead
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _pool = ProcessPoolExecutor(max_workers=config.TEXT_WORKERS, initializer=nlp_resources.warm_up,
+                                    mp_context=multiprocessing.get_context(method))
+        # Inside an analysis worker, multiprocessing joins child processes at
+        # exit before the executor's own exit hook would stop them. Shut the
+        # pool down first, ahead of the queue finalizers (priority 10) that
+        # would stop the shutdown sentinels from reaching the shards
+        util.Finalize(None, shutdown, exitpriority=100)
+    return _pool
+
+
+def shutdown():
+    """Stop the shard pool, if one was started."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def map_blocks(func, columns, args=()):
+    """
+    Apply func to row blocks of equal-length columns.
+
+    Args:
+        func: Module-level function taking one list per column (then args)
+            and returning a partial result for those rows
+        columns: Sequence of equal-length sequences (one entry per row)
+        args: Extra arguments passed unchanged to every call
+
+    Returns:
+        List of partial results in row-block order (one entry when serial)
+    """
+    global _pool
+    columns = [list(column) for column in columns]
+    rows = len(columns[0]) if columns else 0
+    if config.TEXT_WORKERS <= 1 or rows < max(config.TEXT_PARALLEL_MIN_ROWS, 1):
+        return [func(*columns, *args)]
+
+    size = max(config.TEXT_SHARD_ROWS, 1)
+    try:
+        pool = _get_pool()
+        futures = [pool.submit(func, *[column[start:start + size] for column in columns], *args)
+                   for start in range(0, rows, size)]
+        return [future.result() for future in futures]
+    except BrokenProcessPool as e:
+        # A shard process died (e.g. OOM-killed); start a fresh pool next time
+        print(f"Text scoring pool failed ({str(e)}), scoring serially")
+        _pool = None
+        return [func(*columns, *args)]
+
+
+def map_distinct(func, corpus, args=()):
+    """
+    Score each distinct feedback text once with a per-row block function.
+
+    Args:
+        func: Block function taking (texts, is_str, *args) and returning one value per row
+        corpus: FeedbackCorpus
+        args: Extra arguments passed to every call
+
+    Returns:
+        List aligned with the corpus rows
+    """
+    first, inverse = corpus.unique()
+    frame = corpus.frame
+    columns = (frame["text"].to_numpy()[first], frame["is_str"].to_numpy()[first])
+    scores = [score for block in map_blocks(func, columns, args) for score in block]
+    return [scores[i] for i in inverse]
+
+
+def _vader_block(texts, is_str, engine):
+    # Classify sentiment (memoized across rows and requests, or in one batch)
+    scored = [i for i, (text, ok) in enumerate(zip(texts, is_str)) if ok and len(text) > 5]
+    scores = [None] * len(texts)
+    for i, compound in zip(scored, sentiment_service.vader_compounds([texts[i] for i in scored], engine)):
+        scores[i] = compound
+    return scores
+
+
+def vader_scores(corpus, engine="exact"):
+    """
+    Document-level VADER compound score for every corpus row.
+
+    Args:
+        corpus: FeedbackCorpus
+        engine: VADER engine, one of sentiment_service.ENGINES
+
+    Returns:
+        List aligned with the corpus rows; None for texts of 5 characters or less
+    """
+    return map_distinct(_vader_block, corpus, (engine,))
+
+
+def vader_counts(compounds):
+    """
+    VADER label counts over per-row compound scores.
+
+    Args:
+        compounds: Scores from vader_scores()
+
+    Returns:
+        Dict of positive/neutral/negative -> number of scored texts
+    """
+    counts = {"positive": 0, "neutral": 0, "negative": 0}
+    for compound in compounds:
+        if compound is not None:
+            counts[sentiment_service.vader_label(compound)] += 1
+    return counts
+
+
+def _textblob_block(texts, is_str):
+    # TextBlob for polarity and subjectivity
+    return [sentiment_service.textblob_polarity(text) if ok and len(text) >= 5 else None
+            for text, ok in zip(texts, is_str)]
+
+
+def textblob_scores(corpus):
+    """
+    TextBlob polarity for every corpus row.
+
+    Args:
+        corpus: FeedbackCorpus
+
+    Returns:
+        List aligned with the corpus rows; None for texts under 5 characters
+    """
+    return map_distinct(_textblob_block, corpus)
+
+
+def intensity_level(polarity):
+    """Bucket a TextBlob polarity into one of INTENSITY_LEVELS."""
+    if polarity >= 0.5:
+        return "strong_positive"
+    if polarity >= 0.1:
+        return "moderate_positive"
+    if polarity <= -0.5:
+        return "strong_negative"
+    if polarity <= -0.1:
+        return "moderate_negative"
+    return "neutral"
+
+
+def textblob_counts(polarities, emotion_hits, emotion_names):
+    """
+    TextBlob intensity buckets and keyword emotion counts over scored rows.
+
+    Args:
+        polarities: Scores from textblob_scores()
+        emotion_hits: Per-row {emotion: hits} dicts aligned with polarities
+        emotion_names: All emotion labels, in output order
+
+    Returns:
+        Tuple of (intensity level -> count, emotion -> count) over texts of
+        at least 5 characters
+    """
+    intensity_counts = {level: 0 for level in INTENSITY_LEVELS}
+    emotion_counts = {emotion: 0 for emotion in emotion_names}
+    for polarity, emotions in zip(polarities, emotion_hits):
+        if polarity is None:
+            continue
+        intensity_counts[intensity_level(polarity)] += 1
+        # Detect emotions (at most one count per emotion per text)
+        for emotion in emotions:
+            emotion_counts[emotion] += 1
+    return intensity_counts, emotion_counts
@@ -0,0 +1,241 @@
+# topic_model.py
+#
+# Topic modeling for the feedback corpus. Two flavours:
+#
+#   batch   - fit CountVectorizer + LDA from scratch on this upload (the
+#             original behaviour; topics are not comparable between uploads)
+#   update  - online LDA over a hashed, fixed feature space, persisted on disk
+#             and updated with partial_fit; topic IDs stay stable across runs
+#   assign  - transform new rows with the persisted model, no training at all
+#
+# The persisted model lives at config.TOPIC_MODEL_PATH and is shared by all
+# worker processes through an exclusive file lock.
+import hashlib
+import os
+import pickle
+import tempfile
+from collections import Counter, OrderedDict
+
+import config
+import nlp_resources
+from file_lock import FileLock
+
+TOPIC_MODES = ("batch", "update", "assign")
+
+# Batch model parameters
+TOPIC_VECTORIZER_PARAMS = {"max_df": 0.95, "min_df": 2, "stop_words": "english"}
+TOPIC_MODEL_PARAMS = {"n_components": 5, "random_state": 42}
+
+# Online model parameters; the hashed feature space never changes, so the
+# model can keep learning from uploads without a vocabulary refit
+HASHING_PARAMS = {"n_features": 2 ** 16, "alternate_sign": False, "norm": None, "stop_words": "english"}
+ONLINE_MODEL_PARAMS = {"n_components": 5, "random_state": 42, "learning_method": "online"}
+
+# Bump to discard persisted models written with an incompatible layout
+STATE_VERSION = 1
+
+
+def default_mode():
+    """Configured mode, else online updates when a model path is set, else batch."""
+    if config.TOPIC_MODE:
+        return config.TOPIC_MODE
+    return "update" if config.TOPIC_MODEL_PATH else "batch"
+
+
+def _describe(components, column_words, dominant_topics):
+    """Build the `topics` response entries from model components."""
+    topics = []
+    for topic_idx, topic in enumerate(components):
+        top_words_idx = topic.argsort()[:-10 - 1:-1]
+        top_words = [column_words(i) for i in top_words_idx]
+        top_words = [word for word in top_words if word]
+
+        # Assign a simple name based on top words (hashed columns no training
+        # word maps to are dropped above, so there may be fewer than two)
+        topic_name = f"Topic {topic_idx+1}"
+        if len(top_words) >= 2:
+            topic_name += f": {top_words[0].title()} & {top_words[1].title()}"
+
+        topics.append({
+            "id": topic_idx,
+            "name": topic_name,
+            "top_words": top_words,
+            "weight": float(topic.sum() / components.sum()),
+            # Count feedback by dominant topic
+            "count": int((dominant_topics == topic_idx).sum())
+        })
+    return topics
+
+
+def batch_topics(texts_lower):
+    """
+    Fit a fresh LDA model on this upload and describe its topics.
+
+    Args:
+        texts_lower: Sequence of lowercased feedback texts
+
+    Returns:
+        List of topic dicts (id, name, top_words, weight, count)
+    """
+    # sklearn is imported on first use
+    CountVectorizer, LatentDirichletAllocation = nlp_resources.topic_model()
+
+    # The corpus is already lowercased
+    vectorizer = CountVectorizer(**TOPIC_VECTORIZER_PARAMS, lowercase=False)
+    dtm = vectorizer.fit_transform(texts_lower)
+
+    lda = LatentDirichletAllocation(**TOPIC_MODEL_PARAMS)
+    lda.fit(dtm)
+
+    feature_names = vectorizer.get_feature_names_out()
+    # For each feedback, find the dominant topic
+    dominant_topics = lda.transform(dtm).argmax(axis=1)
+    return _describe(lda.components_, lambda i: feature_names[i], dominant_topics)
+
+
+class OnlineTopicModel:
+    """Online LDA over hashed term counts, plus a map back from columns to words."""
+
+    def __init__(self):
+        _, LatentDirichletAllocation = nlp_resources.topic_model()
+        self.lda = LatentDirichletAllocation(**ONLINE_MODEL_PARAMS)
+        self.trained = False
+        # word -> hashed column, and how often each word was seen in training
+        self.word_columns = {}
+        self.word_counts = Counter()
+        # Fingerprints of the last config.TOPIC_SEEN_CORPORA corpora trained
+        # on, oldest first, so re-uploads don't count twice
+        self.seen_corpora = OrderedDict()
+        self.documents_seen = 0
+        self.params = (STATE_VERSION, HASHING_PARAMS, ONLINE_MODEL_PARAMS)
+
+    @staticmethod
+    def vectorizer():
+        # The corpus is already lowercased
+        return nlp_resources.hashing_vectorizer()(**HASHING_PARAMS, lowercase=False)
+
+    def learn_words(self, vectorizer, texts_lower):
+        analyzer = vectorizer.build_analyzer()
+        counts = Counter()
+        for text in texts_lower:
+            counts.update(analyzer(text))
+        new_words = [word for word in counts if word not in self.word_columns]
+        if new_words:
+            # Each single-word document hashes to exactly that word's column
+            columns = vectorizer.transform(new_words).indices
+            self.word_columns.update(zip(new_words, columns.tolist()))
+        self.word_counts.update(counts)
+
+    def remember(self, fingerprint):
+        self.seen_corpora[fingerprint] = None
+        while len(self.seen_corpora) > max(config.TOPIC_SEEN_CORPORA, 0):
+            self.seen_corpora.popitem(last=False)
+
+    def partial_fit(self, dtm):
+        self.lda.partial_fit(dtm)
+        self.trained = True
+        self.documents_seen += dtm.shape[0]
+
+    def column_words(self):
+        """Most frequent training word for every hashed column."""
+        best = {}
+        for word, column in self.word_columns.items():
+            current = best.get(column)
+            if current is None or self.word_counts[word] > self.word_counts[current]:
+                best[column] = word
+        return best
+
+
+def _corpus_fingerprint(texts_lower):
+    digest = hashlib.sha256()
+    for text in texts_lower:
+        digest.update(text.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _load(path):
+    try:
+        with open(path, 'rb') as f:
+            model = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    if getattr(model, "params", None) != (STATE_VERSION, HASHING_PARAMS, ONLINE_MODEL_PARAMS):
+        print("Persisted topic model was built with different parameters; starting a new one")
+        return None
+    if isinstance(model.seen_corpora, set):
+        # Models saved before the fingerprints were capped kept an unordered set
+        model.seen_corpora = OrderedDict.fromkeys(model.seen_corpora)
+    return model
+
+
+def _save(model, path):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def online_topics(texts_lower, mode, path=None):
+    """
+    Describe this upload's topics with the persisted online model.
+
+    Args:
+        texts_lower: Sequence of lowercased feedback texts
+        mode: "update" to train on the rows first, "assign" to only transform
+        path: Model file (defaults to config.TOPIC_MODEL_PATH)
+
+    Returns:
+        List of topic dicts in the same shape as batch_topics(); empty when
+        mode is "assign" and no model has been trained yet
+    """
+    path = path or config.TOPIC_MODEL_PATH
+    if not path:
+        raise ValueError("No topic model path configured (set NPS_TOPIC_MODEL_PATH)")
+
+    vectorizer = OnlineTopicModel.vectorizer()
+    texts_lower = list(texts_lower)
+    dtm = vectorizer.transform(texts_lower)
+
+    with FileLock(path):
+        model = _load(path)
+        if mode == "update":
+            model = model or OnlineTopicModel()
+            fingerprint = _corpus_fingerprint(texts_lower)
+            if fingerprint not in model.seen_corpora:
+                model.learn_words(vectorizer, texts_lower)
+                model.partial_fit(dtm)
+                model.remember(fingerprint)
+                _save(model, path)
+                print(f"Topic model updated with {dtm.shape[0]} documents ({model.documents_seen} total)")
+
+    if model is None or not model.trained:
+        print("No trained topic model yet; skipping topic assignment")
+        return []
+
+    words = model.column_words()
+    dominant_topics = model.lda.transform(dtm).argmax(axis=1)
+    return _describe(model.lda.components_, words.get, dominant_topics)
+
+
+def extract_topics(texts_lower, mode=None):
+    """
+    Topics for an upload using the requested mode (see module docstring).
+
+    Args:
+        texts_lower: Sequence of lowercased feedback texts
+        mode: One of TOPIC_MODES, or None for default_mode()
+
+    Returns:
+        List of topic dicts
+    """
+    mode = mode or default_mode()
+    if mode == "batch":
+        return batch_topics(texts_lower)
+    return online_topics(texts_lower, mode)
@@ -0,0 +1,353 @@
+# trends.py
+#
+# Time-windowed NPS from a response-date column. Responses are reduced to
+# additive per-day buckets: response, promoter and detractor counts per day
+# for every response, and per (location, day). The overall buckets are an
+# integer array over a contiguous day range, grown as new responses arrive;
+# the per-location ones are sparse, one entry per (location, day) that has
+# responses, so thousands of locations over years of dates cost what their
+# responses cost. Dates outside the accepted range (config.TREND_FIRST_DATE
+# to config.TREND_FUTURE_DAYS past today) count as undated, so one mistyped
+# year cannot stretch the day range over centuries.
+#
+# Every window is a difference of two prefix sums over the day axis, so a
+# query computes one cumulative sum and then answers each period (day, week,
+# month) and each rolling window ending at a period with two lookups,
+# however many years the buckets cover.
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+
+import config
+from accumulators import DETRACTOR_CODES, PROMOTER_CODES
+
+PERIODS = ("day", "week", "month")
+
+# numpy's integer value of NaT: rows whose date could not be parsed
+MISSING_DAY = np.iinfo(np.int64).min
+
+# Measures kept per bucket, in the order of the last axis
+MEASURES = ("responses", "promoters", "detractors")
+
+
+def response_days(values):
+    """
+    Parse response dates to day numbers (days since 1970-01-01).
+
+    Timezone-aware timestamps keep their local date.
+
+    Args:
+        values: Series of date strings, dates or timestamps
+
+    Returns:
+        numpy int64 array; MISSING_DAY where the value is missing or unparseable
+    """
+    parsed = pd.to_datetime(values, errors="coerce")
+    if not pd.api.types.is_datetime64_any_dtype(parsed):
+        # Mixed UTC offsets stay objects; compare them in UTC instead
+        parsed = pd.to_datetime(values, errors="coerce", utc=True)
+    if getattr(parsed.dt, "tz", None) is not None:
+        parsed = parsed.dt.tz_localize(None)
+    return parsed.to_numpy(dtype="datetime64[D]").view(np.int64)
+
+
+def _iso(day):
+    return (datetime.date(1970, 1, 1) + datetime.timedelta(days=int(day))).isoformat()
+
+
+def _day(value):
+    """Day number of a YYYY-MM-DD string; raises ValueError otherwise."""
+    try:
+        return (datetime.date.fromisoformat(value) - datetime.date(1970, 1, 1)).days
+    except ValueError:
+        raise ValueError("since and until must be dates in YYYY-MM-DD form")
+
+
+def _period_starts(first, last, period):
+    """Day numbers of the periods overlapping [first, last], clipped to first."""
+    days = np.arange(first, last + 1)
+    if period == "day":
+        return days
+    if period == "week":
+        # ISO weeks: 1970-01-01 was a Thursday
+        starts = days - (days + 3) % 7
+    else:
+        starts = days.astype("datetime64[D]").astype("datetime64[M]").astype("datetime64[D]").view(np.int64)
+    return np.maximum(np.unique(starts), first)
+
+
+def _nps(promoters, detractors, responses):
+    """NPS to one decimal for each entry, None where there are no responses."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        nps = np.round((promoters - detractors) / responses * 100, 1)
+    return [float(value) if total else None for value, total in zip(nps, responses)]
+
+
+def accepted_days():
+    """First and last day number trends accept (see config.TREND_FIRST_DATE)."""
+    first = _day(config.TREND_FIRST_DATE)
+    last = (datetime.datetime.now(datetime.timezone.utc).date() - datetime.date(1970, 1, 1)).days
+    return first, last + config.TREND_FUTURE_DAYS
+
+
+# Added to day numbers in keys, so any day of the int32 range sorts within its location
+_DAY_OFFSET = 1 << 31
+
+
+def _key(location_ids, days):
+    """Sparse bucket keys: location-major, then day, so one location's days are contiguous."""
+    return location_ids * (1 << 32) + np.clip(days, -_DAY_OFFSET, _DAY_OFFSET - 1) + _DAY_OFFSET
+
+
+class TrendBuckets:
+    """
+    Per-day response, promoter and detractor counts, overall and per location.
+
+    Row j of `overall` is day first_day + j; rows from `days` on are spare
+    capacity for later days. Locations (numbered in order of first
+    appearance) are stored sparsely: `keys` holds the sorted _key() of every
+    (location, day) with responses and `location_counts` their counts.
+    """
+
+    def __init__(self):
+        self.location_names = []
+        self.location_ids = {}
+        self.first_day = None
+        self.days = 0
+        self.overall = np.zeros((0, len(MEASURES)), dtype=np.int64)
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.location_counts = np.zeros((0, len(MEASURES)), dtype=np.int64)
+        # Per-chunk (keys, counts) not merged into keys yet
+        self._pending = []
+        self._pending_size = 0
+        # Rows skipped because their date was missing, unparseable or out of range
+        self.undated = 0
+
+    @property
+    def dated(self):
+        return int(self.overall[:self.days, 0].sum())
+
+    def add(self, days, codes, locations=None):
+        """
+        Add responses to their day's buckets.
+
+        Args:
+            days: Day numbers from response_days(), aligned with codes
+            codes: int8 score codes (see accumulators.score_codes)
+            locations: Optional Series of locations aligned with codes
+        """
+        days = np.asarray(days, dtype=np.int64)
+        first, last = accepted_days()
+        # MISSING_DAY is below every accepted day
+        dated = (days >= first) & (days <= last)
+        self.undated += int(len(days) - dated.sum())
+        if not dated.any():
+            return
+        days = days[dated]
+        codes = np.asarray(codes)[dated]
+        promoters = np.isin(codes, PROMOTER_CODES)
+        detractors = np.isin(codes, DETRACTOR_CODES)
+
+        lo, hi = int(days.min()), int(days.max())
+        self._reserve(lo, hi)
+        width = hi - lo + 1
+        offsets = days - lo
+        start = lo - self.first_day
+        self.overall[start:start + width] += np.stack([
+            np.bincount(offsets, minlength=width),
+            np.bincount(offsets[promoters], minlength=width),
+            np.bincount(offsets[detractors], minlength=width),
+        ], axis=-1)
+
+        if locations is not None:
+            local_ids, uniques = pd.factorize(pd.Series(locations).iloc[np.flatnonzero(dated)], sort=False)
+            to_id = np.array([self._location_id(location) for location in uniques], dtype=np.int64)
+            located = local_ids >= 0
+            keys, inverse = np.unique(_key(to_id[local_ids[located]], days[located]), return_inverse=True)
+            self._pending.append((keys, np.stack([
+                np.bincount(inverse, minlength=len(keys)),
+                np.bincount(inverse[promoters[located]], minlength=len(keys)),
+                np.bincount(inverse[detractors[located]], minlength=len(keys)),
+            ], axis=-1)))
+            self._pending_size += len(keys)
+            # Merging once the pending entries outgrow the merged ones keeps
+            # the total merge work proportional to the entries added
+            if self._pending_size > max(len(self.keys), 1 << 16):
+                self._merge()
+
+    def _location_id(self, location):
+        location_id = self.location_ids.get(location)
+        if location_id is None:
+            location_id = self.location_ids[location] = len(self.location_names)
+            self.location_names.append(location)
+        return location_id
+
+    def _merge(self):
+        if not self._pending:
+            return
+        keys = np.concatenate([self.keys] + [keys for keys, _ in self._pending])
+        counts = np.concatenate([self.location_counts] + [counts for _, counts in self._pending])
+        self.keys, inverse = np.unique(keys, return_inverse=True)
+        self.location_counts = np.stack([
+            np.bincount(inverse, weights=counts[:, measure], minlength=len(self.keys))
+            for measure in range(len(MEASURES))
+        ], axis=-1).astype(np.int64)
+        self._pending = []
+        self._pending_size = 0
+
+    def _reserve(self, lo, hi):
+        # Later days get doubling spare capacity (uploads mostly move forward in
+        # time); earlier days reallocate to fit
+        if self.first_day is None:
+            self.first_day = lo
+        first_day = min(self.first_day, lo)
+        days = max(self.first_day + self.days, hi + 1) - first_day
+        shift = self.first_day - first_day
+        capacity = len(self.overall)
+        if days > capacity:
+            grown = np.zeros((max(days, 2 * capacity), len(MEASURES)), dtype=np.int64)
+            grown[shift:shift + self.days] = self.overall[:self.days]
+            self.overall = grown
+        elif shift:
+            self.overall[shift:shift + self.days] = self.overall[:self.days].copy()
+            self.overall[:shift] = 0
+        self.first_day = first_day
+        self.days = days
+
+    def series(self, period=None, window=None, since=None, until=None, locations=None):
+        """
+        NPS per period and over a rolling window, overall and per location.
+
+        Args:
+            period: "day", "week" (ISO, Monday first) or "month" (defaults to
+                config.TREND_PERIOD)
+            window: Rolling window length in days (defaults to
+                config.TREND_WINDOW_DAYS); each period reports the window
+                ending on its last day
+            since: First day to report (YYYY-MM-DD), defaults to (and is
+                clamped to) the first dated response
+            until: Last day to report (YYYY-MM-DD), defaults to (and is
+                clamped to) the last dated response
+            locations: Location names to report (defaults to all)
+
+        Returns:
+            Dict with the period starts and ends and, for "overall" and each
+            location, columnar lists of responses, nps, rolling_responses and
+            rolling_nps (nps is None for empty periods), or None when there
+            are no dated responses
+
+        Raises:
+            ValueError: For an unknown period, a non-positive window, a
+                malformed date or more than config.TREND_MAX_CELLS periods x
+                series
+        """
+        period = period or config.TREND_PERIOD
+        window = config.TREND_WINDOW_DAYS if window is None else window
+        if period not in PERIODS:
+            raise ValueError(f"period must be one of: {', '.join(PERIODS)}")
+        if window < 1:
+            raise ValueError("window must be at least 1 day")
+        if self.days == 0:
+            return None
+        first = _day(since) if since else self.first_day
+        last = _day(until) if until else self.first_day + self.days - 1
+        if first > last:
+            raise ValueError("since must not be after until")
+        # Periods outside the buckets hold nothing; clamping keeps the number
+        # of periods bounded by the dated range, however wide the request
+        first = max(first, self.first_day)
+        last = min(last, self.first_day + self.days - 1)
+
+        # Locations are reported (and requested) by their string form, in the
+        # order location_breakdown uses: numeric ids as numbers, then text
+        ids = {str(name): location_id for name, location_id in self.location_ids.items()}
+        if locations is None:
+            names = [str(name) for name in sorted(self.location_ids, key=lambda name: (isinstance(name, str), name))]
+        else:
+            names = [name for name in locations if name in ids]
+        location_ids = np.array([ids[name] for name in names], dtype=np.int64)
+        self._merge()
+
+        # Overall: prefix[k] sums days first_day .. first_day + k - 1
+        prefix = np.zeros((self.days + 1, len(MEASURES)), dtype=np.int64)
+        np.cumsum(self.overall[:self.days], axis=0, out=prefix[1:])
+        # Locations: cumulative[k] sums the first k sparse entries; the entries
+        # of a location before a day are those below its key for that day
+        cumulative = np.zeros((len(self.keys) + 1, len(MEASURES)), dtype=np.int64)
+        np.cumsum(self.location_counts, axis=0, out=cumulative[1:])
+
+        def before(day):
+            # Counts on days before day: overall (periods, measures) and per
+            # location (locations, periods, measures)
+            overall = prefix[np.clip(day - self.first_day, 0, self.days)]
+            by_location = cumulative[np.searchsorted(self.keys, _key(location_ids[:, None], day[None, :]))]
+            return overall, by_location
+
+        if first > last:
+            starts = ends = np.zeros(0, dtype=np.int64)
+        else:
+            starts = _period_starts(first, last, period)
+            ends = np.append(starts[1:] - 1, last)
+        if len(starts) * (len(names) + 1) > config.TREND_MAX_CELLS:
+            raise ValueError(f"{len(starts)} periods x {len(names) + 1} series exceed {config.TREND_MAX_CELLS} "
+                             "values; use a longer period, a narrower since/until or fewer locations")
+        (to_end, to_end_by_location), (to_start, to_start_by_location) = before(ends + 1), before(starts)
+        from_window, from_window_by_location = before(ends + 1 - window)
+
+        def columns(in_period, rolling):
+            return {
+                "responses": in_period[:, 0].tolist(),
+                "nps": _nps(in_period[:, 1], in_period[:, 2], in_period[:, 0]),
+                "rolling_responses": rolling[:, 0].tolist(),
+                "rolling_nps": _nps(rolling[:, 1], rolling[:, 2], rolling[:, 0]),
+            }
+
+        return {
+            "period": period,
+            "window": window,
+            "starts": [_iso(day) for day in starts],
+            "ends": [_iso(day) for day in ends],
+            "undated": self.undated,
+            "overall": columns(to_end - to_start, to_end - from_window),
+            "locations": {name: columns(to_end_by_location[i] - to_start_by_location[i],
+                                        to_end_by_location[i] - from_window_by_location[i])
+                          for i, name in enumerate(names)},
+        }
+
+    def save(self, path):
+        """Write the buckets to an .npz file, replacing it atomically."""
+        self._merge()
+        tmp_path = os.path.join(os.path.dirname(path) or ".", "." + os.path.basename(path))
+        with open(tmp_path, "wb") as f:
+            np.savez(f, overall=self.overall[:self.days], keys=self.keys, location_counts=self.location_counts,
+                     meta=np.array([self.first_day or 0, self.undated], dtype=np.int64),
+                     locations=np.array([str(name) for name in self.location_names], dtype=str))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Buckets saved by save(), or empty buckets when path does not exist."""
+        buckets = cls()
+        if not os.path.exists(path):
+            return buckets
+        with np.load(path) as saved:
+            buckets.first_day, buckets.undated = (int(value) for value in saved["meta"])
+            buckets.location_names = saved["locations"].tolist()
+            if "counts" in saved.files:
+                # Dense buckets of earlier versions: row 0 overall, row i + 1 location i
+                counts = saved["counts"]
+                buckets.overall = counts[0].copy()
+                location_ids, offsets = np.nonzero(counts[1:, :, 0])
+                buckets.keys = _key(location_ids.astype(np.int64), offsets + buckets.first_day)
+                buckets.location_counts = counts[1:][location_ids, offsets]
+            else:
+                buckets.overall = saved["overall"]
+                buckets.keys = saved["keys"]
+                buckets.location_counts = saved["location_counts"]
+        buckets.location_ids = {name: i for i, name in enumerate(buckets.location_names)}
+        buckets.days = len(buckets.overall)
+        if buckets.days == 0:
+            buckets.first_day = None
+        return buckets
@@ -0,0 +1,223 @@
+# vader_batch.py
+#
+# Batch VADER scoring. NLTK's SentimentIntensityAnalyzer walks every text word
+# by word in Python; here a whole list of texts is split once into a flat
+# token stream (a CSR-style document-term layout: a vocabulary id per token
+# and each document's token range), every per-word property is looked up once
+# per vocabulary entry, and the lexicon valence and VADER's rules are applied
+# to all tokens at once with numpy:
+#
+#   - ALL CAPS emphasis of sentiment words and boosters
+#   - booster/dampener words up to three words back, scaled by distance
+#   - negations ("not", "never", "n't", ...) up to three words back, "least"
+#   - "never so/this" intensifiers, the "kind of" / "sort of" dampeners and
+#     VADER's special-case idioms
+#   - the "but" shift and "!"/"?" emphasis
+#
+# The rules follow nltk.sentiment.vader, including its habit of reading the
+# context of a repeated word at that word's first position in the text, so
+# scores match polarity_scores()['compound'] exactly. tests/test_vader_batch.py
+# checks that for fixed cases of each rule above; benchmarks/vader_parity.py
+# checks it on generated or real exports and exits 1 on any difference.
+import string
+
+import numpy as np
+import pandas as pd
+
+import nlp_resources
+
+_PUNCTUATION = set(string.punctuation)
+
+
+def _strip_punctuation(token, punc_list):
+    """
+    A token as VADER's SentiText keeps it.
+
+    One leading or trailing run of punctuation is dropped when it is one of
+    punc_list and what remains is a word of two or more characters without
+    punctuation ("good!" -> "good", but "don't," and ":-)" stay as they are).
+    """
+    word = token.rstrip(string.punctuation)
+    if token[len(word):] in punc_list and len(word) > 1 and not _PUNCTUATION.intersection(word):
+        return word
+    word = token.lstrip(string.punctuation)
+    if token[:len(token) - len(word)] in punc_list and len(word) > 1 and not _PUNCTUATION.intersection(word):
+        return word
+    return token
+
+
+class _Vocabulary:
+    """Per-word properties of the distinct words of a batch, as arrays by word id."""
+
+    def __init__(self, words, analyzer):
+        constants = analyzer.constants
+        lexicon = analyzer.lexicon
+        self.ids = {word: i for i, word in enumerate(words)}
+        lower = [word.lower() for word in words]
+        self.valence = np.array([lexicon.get(word, 0.0) for word in lower])
+        self.in_lexicon = np.array([word in lexicon for word in lower], dtype=bool)
+        self.booster = np.array([constants.BOOSTER_DICT.get(word, 0.0) for word in lower])
+        self.is_booster = np.array([word in constants.BOOSTER_DICT for word in lower], dtype=bool)
+        self.negation = np.array([word in constants.NEGATE or "n't" in word for word in lower], dtype=bool)
+        self.upper = np.array([word.isupper() for word in words], dtype=bool)
+        # "never so/this" compares the words as written
+        self.never = np.array([word == "never" for word in words], dtype=bool)
+        self.so_this = np.array([word in ("so", "this") for word in words], dtype=bool)
+        self.lower_is = {name: np.array([word == name for word in lower], dtype=bool)
+                         for name in ("but", "least", "at", "very", "kind", "of")}
+
+    def phrase(self, text):
+        """Word ids of a space-separated phrase, or None if a word never occurs."""
+        ids = [self.ids.get(word) for word in text.split(" ")]
+        return None if None in ids else ids
+
+
+def compounds(texts):
+    """
+    VADER compound scores of many texts at once.
+
+    Args:
+        texts: List of strings (documents or sentences)
+
+    Returns:
+        numpy float array aligned with texts, rounded to 4 decimals like
+        SentimentIntensityAnalyzer.polarity_scores()
+    """
+    analyzer = nlp_resources.vader()
+    constants = analyzer.constants
+    n_docs = len(texts)
+    if n_docs == 0:
+        return np.zeros(0)
+
+    # Token stream: whitespace split, one-character tokens dropped, each
+    # distinct raw token cleaned once
+    split = [text.split() for text in texts]
+    lengths = np.fromiter(map(len, split), dtype=np.int64, count=n_docs)
+    raw_ids, raw_vocab = pd.factorize(pd.Series([token for tokens in split for token in tokens], dtype=object))
+    raw_vocab = raw_vocab.tolist()
+    kept_raw = np.array([len(token) > 1 for token in raw_vocab], dtype=bool)
+    word_ids, words = pd.factorize(pd.Series([_strip_punctuation(token, constants.PUNC_LIST)
+                                              for token in raw_vocab], dtype=object))
+    vocab = _Vocabulary(words.tolist(), analyzer)
+
+    keep = kept_raw[raw_ids] if len(raw_ids) else np.zeros(0, dtype=bool)
+    doc = np.repeat(np.arange(n_docs), lengths)[keep]
+    word = word_ids[raw_ids[keep]].astype(np.int64)
+    counts = np.bincount(doc, minlength=n_docs)
+    starts = np.cumsum(counts) - counts
+    position = np.arange(len(word)) - starts[doc]
+
+    # Some but not all words of the text in ALL CAPS
+    upper_words = np.bincount(doc, weights=vocab.upper[word], minlength=n_docs)
+    cap_diff = (counts - upper_words > 0) & (upper_words > 0)
+
+    # Context is read around a word's first occurrence in its text
+    _, first_index, group = np.unique(doc * len(words) + word, return_index=True, return_inverse=True)
+    anchor = first_index[group]
+    anchor_position = anchor - starts[doc]
+
+    def around(offset, rows):
+        # Word id at anchor + offset of the given tokens, -1 outside their text
+        target = anchor_position[rows] + offset
+        inside = (target >= 0) & (target < counts[doc[rows]])
+        return np.where(inside, word[np.where(inside, anchor[rows] + offset, 0)], -1)
+
+    def has(flags, ids):
+        return np.where(ids >= 0, flags[np.maximum(ids, 0)], False)
+
+    # Sentiment words (boosters and a "kind" followed by "of" count as neutral)
+    tokens = np.arange(len(word))
+    scored = vocab.in_lexicon[word] & ~vocab.is_booster[word]
+    scored &= ~(vocab.lower_is["kind"][word] & has(vocab.lower_is["of"], around(1, tokens)))
+    rows = np.flatnonzero(scored)
+    rows_doc = doc[rows]
+    rows_cap = cap_diff[rows_doc]
+    valence = vocab.valence[word[rows]]
+    valence = np.where(vocab.upper[word[rows]] & rows_cap,
+                       np.where(valence > 0, valence + constants.C_INCR, valence - constants.C_INCR), valence)
+
+    previous = [around(-k, rows) for k in (1, 2, 3)]
+    for k, (prior, scale) in enumerate(zip(previous, (1.0, 0.95, 0.9)), start=1):
+        applies = (prior >= 0) & ~has(vocab.in_lexicon, prior)
+        # Booster or dampener k words back
+        scalar = np.where(valence < 0, -1, 1) * np.where(prior >= 0, vocab.booster[np.maximum(prior, 0)], 0.0)
+        capped = has(vocab.is_booster, prior) & has(vocab.upper, prior) & rows_cap
+        scalar = np.where(capped, np.where(valence > 0, scalar + constants.C_INCR, scalar - constants.C_INCR),
+                          scalar)
+        if k > 1:
+            scalar = np.where(scalar != 0, scalar * scale, scalar)
+        valence = np.where(applies, valence + scalar, valence)
+
+        # Negation k words back, or the "never so/this" intensifiers
+        negated = has(vocab.negation, prior)
+        if k == 1:
+            factor = np.where(negated, constants.N_SCALAR, 1.0)
+        elif k == 2:
+            never_so = has(vocab.never, previous[1]) & has(vocab.so_this, previous[0])
+            factor = np.where(never_so, 1.5, np.where(negated, constants.N_SCALAR, 1.0))
+        else:
+            never_so = (has(vocab.never, previous[2]) & has(vocab.so_this, previous[1])) | has(vocab.so_this,
+                                                                                             previous[0])
+            factor = np.where(never_so, 1.25, np.where(negated, constants.N_SCALAR, 1.0))
+        valence = np.where(applies & (factor != 1.0), valence * factor, valence)
+
+        if k == 3:
+            valence = np.where(applies, _idioms(valence, rows, around, vocab, constants), valence)
+
+    # "least" negates, except in "at least" and "very least"
+    least = has(vocab.lower_is["least"], previous[0]) & ~has(vocab.in_lexicon, previous[0])
+    spared = has(vocab.lower_is["at"], previous[1]) | has(vocab.lower_is["very"], previous[1])
+    valence = np.where(least & ~((anchor_position[rows] > 1) & spared), valence * constants.N_SCALAR, valence)
+
+    # Words before the first "but" count half, words after it one and a half times
+    is_but = vocab.lower_is["but"][word]
+    but_position = np.full(n_docs, -1)
+    but_docs, first_but = np.unique(doc[is_but], return_index=True)
+    but_position[but_docs] = position[is_but][first_but]
+    rows_but = but_position[rows_doc]
+    rows_position = position[rows]
+    valence = np.where((rows_but >= 0) & (rows_position < rows_but), valence * 0.5, valence)
+    valence = np.where((rows_but >= 0) & (rows_position > rows_but), valence * 1.5, valence)
+
+    total = np.bincount(rows_doc, weights=valence, minlength=n_docs)
+
+    # "!" (up to 4) and "?" (2 or more) emphasis, in the direction of the sum
+    text_series = pd.Series(texts, dtype=object)
+    exclamations = np.minimum(text_series.str.count("!").to_numpy(), 4) * 0.292
+    questions = text_series.str.count("\\?").to_numpy()
+    emphasis = exclamations + np.where(questions > 1, np.where(questions <= 3, questions * 0.18, 0.96), 0)
+    total = np.where(total > 0, total + emphasis, np.where(total < 0, total - emphasis, total))
+
+    compound = total / np.sqrt(total * total + 15)
+    compound[counts == 0] = 0.0
+    return np.round(compound, 4)
+
+
+def _idioms(valence, rows, around, vocab, constants):
+    """VADER's special-case idioms and the "kind of" / "sort of" dampeners, three words back and on."""
+    at = {offset: around(offset, rows) for offset in (-3, -2, -1, 0, 1, 2)}
+
+    def matches(phrase, offsets):
+        ids = vocab.phrase(phrase)
+        if ids is None or len(ids) != len(offsets):
+            return np.zeros(len(rows), dtype=bool)
+        found = np.ones(len(rows), dtype=bool)
+        for word_id, offset in zip(ids, offsets):
+            found &= at[offset] == word_id
+        return found
+
+    # Backward sequences: the first one (in VADER's order) holding an idiom wins
+    backward = ((-1, 0), (-2, -1, 0), (-2, -1), (-3, -2, -1), (-3, -2))
+    for offsets in reversed(backward):
+        for phrase, value in constants.SPECIAL_CASE_IDIOMS.items():
+            valence = np.where(matches(phrase, offsets), value, valence)
+    # Forward ones override
+    for offsets in ((0, 1), (0, 1, 2)):
+        for phrase, value in constants.SPECIAL_CASE_IDIOMS.items():
+            valence = np.where(matches(phrase, offsets), value, valence)
+
+    bigrams = [phrase for phrase in constants.BOOSTER_DICT if " " in phrase]
+    dampened = np.zeros(len(rows), dtype=bool)
+    for phrase in bigrams:
+        dampened |= matches(phrase, (-3, -2)) | matches(phrase, (-2, -1))
+    return np.where(dampened, valence + constants.B_DECR, valence)